@@ -1,28 +1,74 @@
-import logging
-import threading
-from datetime import datetime
-import time
-import requests
+from datetime import timedelta
 
+import csp
 from csp import ts
 from csp.impl.pushadapter import PushInputAdapter
 from csp.impl.wiring import py_push_adapter_def
 
-from .compiled_protobuf.gtfs_realtime_pb2 import FeedMessage
+from .compiled_protobuf.gtfs_realtime_pb2 import FeedHeader, FeedMessage
+from .feed_poller import get_feed_poller
+from .feed_selection import FeedSelection
 from .mta_util import *
+from .trip_delta import TripDelta, TripDeltaTracker
+
+__all__ = (
+    "GTFSRealtimeInputAdapter",
+    "GTFSRealtimeRawInputAdapter",
+    "GTFSRealtimeDeltaInputAdapter",
+    "decode_feed_message",
+    "peek_feed_timestamp",
+)
+
+
+def decode_feed_message(content):
+    """Parse raw GTFS-rt bytes into a FeedMessage"""
+    feed = FeedMessage()
+    feed.ParseFromString(content)
+    return feed
+
+
+def _read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        result |= (b & 0x7F) << shift
+        pos += 1
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def peek_feed_timestamp(content):
+    """
+    Read header.timestamp from raw GTFS-rt bytes without parsing the entities
+    Returns None if the header is not the leading field or has no timestamp
+    """
+    # field 1 (header), wire type 2 (length-delimited)
+    if not content or content[0] != 0x0A:
+        return None
+    length, pos = _read_varint(content, 1)
+    header = FeedHeader.FromString(content[pos : pos + length])
+    return header.timestamp or None
 
-__all__ = ("GTFSRealtimeInputAdapter",)
 
 # Realtime push adapter
 
 
 class GTFSRealtimeAdapterImpl(PushInputAdapter):
-    def __init__(self, service, publish_raw_bytes):
+    def __init__(self, service, publish_raw_bytes, tick_unchanged, selection=None, timeout=None):
         """Implementation for GTFS Realtime Adapter
 
         Args:
             service (str): services to subscribe to
             publish_raw_bytes (bool): used for recording data
+            tick_unchanged (bool): tick on every poll, even if the feed has not been updated
+            selection (FeedSelection): if given, only the selected entities are decoded
+            timeout (timedelta): if given, overrides the poller's request timeout for the service's feed
+
+        By default a poll only ticks if the feed's header timestamp has changed since the last one.
+
+        All adapters on the same service (and selection) in a process share one fetch and one decoded
+        FeedMessage per poll, so ticked messages must not be modified.
         """
         if service not in LINE_TO_ENDPOINT:
             raise ValueError(
@@ -32,45 +78,146 @@ class GTFSRealtimeAdapterImpl(PushInputAdapter):
         self._service = service
         self._interval = MTA_FEED_UPDATE_TIME.total_seconds()
         self._raw = publish_raw_bytes
+        self._tick_unchanged = tick_unchanged
         self._endpoint = LINE_TO_ENDPOINT[service]
-        self._thread = None
-        self._running = False
+        self._decoder = None
+        if not publish_raw_bytes:
+            self._decoder = selection if selection is not None else decode_feed_message
+        self._timeout = timeout.total_seconds() if timeout is not None else None
+        self._subscription = None
 
     def start(self, starttime, endtime):
-        self._endtime = endtime
-        self._running = True
-        self._thread = threading.Thread(target=self._run, daemon=True)
-        self._thread.start()
+        self._subscription = get_feed_poller().subscribe(
+            self._endpoint,
+            self._interval,
+            self.push_tick,
+            decoder=self._decoder,
+            version=peek_feed_timestamp,
+            tick_unchanged=self._tick_unchanged,
+            timeout=self._timeout,
+        )
 
     def stop(self):
-        if self._running:
-            self._running = False
-            self._thread.join()
-
-    def _run(self):
-        while self._running:
-            """
-            Tick out a list of GTFS messages for all services subscribed to
-            """
-            response = requests.get(self._endpoint)
-            if self._raw:
-                self.push_tick(response.content)  # raw bytes for recording
-            else:
-                feed = FeedMessage()
-                feed.ParseFromString(response.content)
-                self.push_tick(feed)
-            sleep_interval = min(
-                # edge case where we exit prematurely
-                (self._endtime-datetime.utcnow()).total_seconds(), 
-                self._interval
-            )
-            time.sleep(sleep_interval)
+        if self._subscription is not None:
+            get_feed_poller().unsubscribe(self._subscription)
+            self._subscription = None
 
 
-GTFSRealtimeInputAdapter = py_push_adapter_def(
+_GTFSRealtimePushAdapter = py_push_adapter_def(
     "GTFSRealtimeInputAdapter",
     GTFSRealtimeAdapterImpl,
     ts[FeedMessage],
     service=str,
     publish_raw_bytes=bool,
+    tick_unchanged=(bool, False),
+    selection=(FeedSelection, None),
+    timeout=(timedelta, None),
+)
+
+
+@csp.graph
+def GTFSRealtimeInputAdapter(
+    service: str,
+    publish_raw_bytes: bool,
+    tick_unchanged: bool = False,
+    recording: str = "",
+    speed: float = 1.0,
+    selection: FeedSelection = None,
+    timeout: timedelta = None,
+) -> ts[FeedMessage]:
+    """
+    FeedMessages of a service as they are published, polled from the MTA's realtime feed
+
+    If a recording of the service's feed is given instead, its snapshots are replayed in simulation time
+    (csp.run with realtime=False and a starttime within the recording), ticking at most speed recorded seconds
+    per wall-clock second; speed 0 replays as fast as possible. Graphs written against the realtime feed can
+    then be run over historical data as they are.
+
+    With a FeedSelection, only the entities it selects are decoded, e.g. the trips calling at one station.
+    timeout overrides the poller's request timeout for the feed; the smallest asked for by its adapters applies.
+    """
+    if not recording:
+        return _GTFSRealtimePushAdapter(
+            service, publish_raw_bytes, tick_unchanged, selection, timeout
+        )
+    if service not in LINE_TO_ENDPOINT:
+        raise ValueError(f"Given transit service {service} is unknown")
+    if publish_raw_bytes:
+        raise ValueError(
+            "publish_raw_bytes is not supported when replaying a recording: use recorded_snapshots"
+        )
+    # imported here as the replay adapters depend on this module
+    from .GTFSReplayInputAdapter import GTFSReplayInputAdapter
+
+    return GTFSReplayInputAdapter(
+        recording, speed=speed, tick_unchanged=tick_unchanged, selection=selection
+    )
+
+
+class GTFSRealtimeRawAdapterImpl(GTFSRealtimeAdapterImpl):
+    def __init__(self, service, tick_unchanged):
+        """Implementation for the raw GTFS Realtime Adapter, which ticks the undecoded feed bytes for recording
+
+        Args:
+            service (str): services to subscribe to
+            tick_unchanged (bool): tick on every poll, even if the feed has not been updated
+        """
+        super().__init__(service, True, tick_unchanged)
+
+
+GTFSRealtimeRawInputAdapter = py_push_adapter_def(
+    "GTFSRealtimeRawInputAdapter",
+    GTFSRealtimeRawAdapterImpl,
+    ts[bytes],
+    service=str,
+    tick_unchanged=(bool, False),
+)
+
+
+class GTFSRealtimeDeltaAdapterImpl(PushInputAdapter):
+    def __init__(self, service):
+        """Implementation for the GTFS Realtime delta adapter
+
+        Ticks the list of trip-level added/updated/removed events between successive snapshots of the
+        service, rather than the whole FeedMessage. The first tick adds every trip in the feed.
+
+        Args:
+            service (str): services to subscribe to
+        """
+        if service not in LINE_TO_ENDPOINT:
+            raise ValueError(
+                f"Given transit service {service} is unknown: supported services are all lines of NYC Subway, MTA LIRR, and MetroNorth (MNR)"
+            )
+
+        self._interval = MTA_FEED_UPDATE_TIME.total_seconds()
+        self._endpoint = LINE_TO_ENDPOINT[service]
+        self._tracker = None
+        self._subscription = None
+
+    def start(self, starttime, endtime):
+        self._tracker = TripDeltaTracker()
+        self._subscription = get_feed_poller().subscribe(
+            self._endpoint,
+            self._interval,
+            self._on_feed,
+            decoder=decode_feed_message,
+            version=peek_feed_timestamp,
+        )
+
+    def stop(self):
+        if self._subscription is not None:
+            get_feed_poller().unsubscribe(self._subscription)
+            self._subscription = None
+
+    def _on_feed(self, feed):
+        deltas = self._tracker.update(feed)
+        if deltas:
+            self.push_tick(deltas)
+
+
+GTFSRealtimeDeltaInputAdapter = py_push_adapter_def(
+    "GTFSRealtimeDeltaInputAdapter",
+    GTFSRealtimeDeltaAdapterImpl,
+    ts[[TripDelta]],
+    service=str,
 )
@@ -0,0 +1,175 @@
+import os
+import time as _time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from csp import ts
+from csp.impl.pulladapter import PullInputAdapter
+from csp.impl.wiring import py_pull_adapter_def
+
+from .columnar import FeedColumns, FeedColumnsDecoder
+from .compiled_protobuf.gtfs_realtime_pb2 import FeedMessage
+from .feed_selection import FeedSelection
+from .GTFSInputAdapter import decode_feed_message, peek_feed_timestamp
+from .recording import iter_recording
+
+__all__ = ("GTFSReplayInputAdapter", "GTFSColumnsReplayInputAdapter")
+
+# Historical replay pull adapters
+
+
+def _decode_portable_columns(content):
+    # Runs in a worker process: the codes are local to this call, so ship the strings back with them
+    decoder = FeedColumnsDecoder()
+    columns = decoder.decode_bytes(content)
+    return columns, decoder.trips.strings, decoder.routes.strings, decoder.stops.strings
+
+
+def _changed_snapshots(snapshots):
+    """Skip snapshots whose header timestamp is the same as the one before, as the realtime adapters do"""
+    last = None
+    for time, content in snapshots:
+        version = peek_feed_timestamp(content)
+        if version is None or version != last:
+            last = version
+            yield time, content
+
+
+def _default_workers():
+    # a pool only pays for itself when it runs alongside the engine: on one core, decode inline
+    cpus = os.cpu_count() or 1
+    return cpus if cpus > 1 else 0
+
+
+class _ReplayImpl(PullInputAdapter):
+    def __init__(
+        self, filename, speed, tick_unchanged, decode, workers=0, prefetch=1, pool_decode=None, adopt=None
+    ):
+        """Base implementation for replaying a recording, optionally with snapshots decoded ahead of time in a pool
+
+        Args:
+            filename (str): recording to replay, in either recording format
+            speed (float): if positive, snapshots are ticked no faster than this many recorded seconds per
+                wall-clock second; 0 replays as fast as possible
+            tick_unchanged (bool): tick snapshots whose header timestamp has not changed since the last one
+            decode (callable): decodes a snapshot's bytes inline on the engine thread
+            workers (int): size of the process pool decoding with pool_decode; 0 decodes inline with decode
+            prefetch (int): maximum number of snapshots decoded ahead of the engine
+            pool_decode (callable): decodes a snapshot's bytes in a worker process; must be picklable
+            adopt (callable): post-processes a result of pool_decode on the engine thread
+        """
+        self._filename = filename
+        self._speed = speed
+        self._tick_unchanged = tick_unchanged
+        self._decode = decode
+        self._workers = workers if pool_decode is not None else 0
+        self._prefetch = max(prefetch, 1)
+        self._pool_decode = pool_decode
+        self._adopt = adopt
+        self._pace_start = None
+        self._executor = None
+        self._snapshots = None
+        self._pending = deque()
+        super().__init__()
+
+    def start(self, start_time, end_time):
+        super().start(start_time, end_time)
+        self._snapshots = iter_recording(self._filename, start_time, end_time)
+        if not self._tick_unchanged:
+            self._snapshots = _changed_snapshots(self._snapshots)
+        if self._workers > 0:
+            self._executor = ProcessPoolExecutor(self._workers)
+            self._fill()
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._pending.clear()
+
+    def _fill(self):
+        while len(self._pending) < self._prefetch:
+            snapshot = next(self._snapshots, None)
+            if snapshot is None:
+                return
+            time, content = snapshot
+            future = self._executor.submit(self._pool_decode, content)
+            self._pending.append((time, future))
+
+    def _pace(self, time):
+        """Wait until the snapshot at time is due on the wall clock"""
+        if self._pace_start is None:
+            self._pace_start = (_time.perf_counter(), time)
+            return
+        wall, first = self._pace_start
+        delay = wall + (time - first).total_seconds() / self._speed - _time.perf_counter()
+        if delay > 0:
+            _time.sleep(delay)
+
+    def next(self):
+        if self._executor is None:
+            snapshot = next(self._snapshots, None)
+            if snapshot is None:
+                return None
+            time, decoded = snapshot[0], self._decode(snapshot[1])
+        else:
+            if not self._pending:
+                return None
+            # snapshots are delivered in recording order, whichever worker finishes first
+            time, future = self._pending.popleft()
+            decoded = self._adopt(future.result())
+            self._fill()
+        if self._speed > 0:
+            self._pace(time)
+        return time.replace(tzinfo=None), decoded
+
+
+class GTFSReplayAdapterImpl(_ReplayImpl):
+    """Replays FeedMessages, parsed inline, and optionally only the entities selected"""
+
+    def __init__(self, filename, speed, tick_unchanged, selection):
+        super().__init__(
+            filename, speed, tick_unchanged, selection if selection is not None else decode_feed_message
+        )
+
+
+class GTFSColumnsReplayAdapterImpl(_ReplayImpl):
+    """Replays FeedColumns, decoded ahead of time on a process pool if there is more than one core"""
+
+    def __init__(self, filename, workers, prefetch, speed, tick_unchanged, decoder):
+        decoder = decoder if decoder is not None else FeedColumnsDecoder()
+        super().__init__(
+            filename,
+            speed,
+            tick_unchanged,
+            decoder.decode_bytes,
+            workers if workers is not None else _default_workers(),
+            prefetch,
+            _decode_portable_columns,
+            lambda decoded: decoder.adopt(*decoded),
+        )
+
+
+# FeedMessages are parsed while holding the GIL, and cannot be pickled cheaply, so a pool of either kind is slower
+# than parsing inline; FeedColumns are cheap to pickle, so they can be decoded on a process pool and scale with cores
+GTFSReplayInputAdapter = py_pull_adapter_def(
+    "GTFSReplayInputAdapter",
+    GTFSReplayAdapterImpl,
+    ts[FeedMessage],
+    filename=str,
+    speed=(float, 0.0),
+    tick_unchanged=(bool, True),
+    selection=(FeedSelection, None),
+)
+
+GTFSColumnsReplayInputAdapter = py_pull_adapter_def(
+    "GTFSColumnsReplayInputAdapter",
+    GTFSColumnsReplayAdapterImpl,
+    ts[FeedColumns],
+    filename=str,
+    workers=(int, None),
+    prefetch=(int, 64),
+    speed=(float, 0.0),
+    tick_unchanged=(bool, True),
+    decoder=(FeedColumnsDecoder, None),
+)
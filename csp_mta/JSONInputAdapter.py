@@ -1,47 +1,90 @@
-import threading
-import time
-from datetime import datetime, timedelta
+import typing
+from datetime import timedelta
 
-import requests
 from csp import ts
 from csp.impl.pushadapter import PushInputAdapter
 from csp.impl.wiring import py_push_adapter_def
 
-__all__ = ("JSONRealtimeInputAdapter",)
+from .feed_poller import get_feed_poller
+from .json_records import (
+    Alert,
+    AlertDecoder,
+    EquipmentOutage,
+    EquipmentOutageDecoder,
+    loads,
+)
+from .mta_util import ACCESSIBILITY_ENDPOINT, MTA_FEED_UPDATE_TIME
+
+__all__ = (
+    "JSONRealtimeInputAdapter",
+    "AlertsInputAdapter",
+    "EquipmentOutagesInputAdapter",
+)
 
 
 class JSONRealtimeAdapterImpl(PushInputAdapter):
-    def __init__(self, endpoint, interval, publish_raw_bytes):
+    def __init__(self, endpoint, interval, publish_raw_bytes, tick_unchanged, timeout=None):
+        """Implementation for JSON Realtime Adapter
+
+        Args:
+            endpoint (str): URL of the JSON feed
+            interval (timedelta): polling interval
+            publish_raw_bytes (bool): used for recording data
+            tick_unchanged (bool): tick on every poll, even if the payload is identical to the last one
+            timeout (timedelta): if given, overrides the poller's request timeout for the endpoint
+        """
         self._endpoint = endpoint
         self._interval = interval.total_seconds()
         self._raw = publish_raw_bytes
-        self._thread = None
-        self._running = False
+        self._tick_unchanged = tick_unchanged
+        self._decoder = loads
+        self._timeout = timeout.total_seconds() if timeout is not None else None
+        self._subscription = None
 
     def start(self, starttime, endtime):
-        self._endtime = endtime
-        self._running = True
-        self._thread = threading.Thread(target=self._run, daemon=True)
-        self._thread.start()
+        self._subscription = get_feed_poller().subscribe(
+            self._endpoint,
+            self._interval,
+            self.push_tick,
+            decoder=None if self._raw else self._decoder,
+            tick_unchanged=self._tick_unchanged,
+            timeout=self._timeout,
+        )
 
     def stop(self):
-        if self._running:
-            self._running = False
-            self._thread.join()
-
-    def _run(self):
-        while self._running:
-            response = requests.get(self._endpoint)
-            if self._raw:
-                self.push_tick(response.content)  # raw bytes for recording
-            else:
-                self.push_tick(response.json())
-            sleep_interval = min(
-                # edge case where we exit prematurely
-                (self._endtime-datetime.utcnow()).total_seconds(), 
-                self._interval
-            )
-            time.sleep(sleep_interval)
+        if self._subscription is not None:
+            get_feed_poller().unsubscribe(self._subscription)
+            self._subscription = None
+
+
+class AlertsAdapterImpl(JSONRealtimeAdapterImpl):
+    def __init__(self, endpoint, interval, route_ids, include_description, tick_unchanged):
+        """Implementation for the typed alerts adapter
+
+        Args:
+            endpoint (str): URL of the alerts feed, see ALERT_ENDPOINTS
+            interval (timedelta): polling interval
+            route_ids (list): if given, only alerts informing one of these routes are ticked
+            include_description (bool): decode the (long) description text of each alert
+            tick_unchanged (bool): tick on every poll, even if the payload is identical to the last one
+        """
+        super().__init__(endpoint, interval, False, tick_unchanged)
+        self._decoder = AlertDecoder(route_ids, include_description)
+
+
+class EquipmentOutagesAdapterImpl(JSONRealtimeAdapterImpl):
+    def __init__(self, endpoint, interval, equipment_types, include_upcoming, tick_unchanged):
+        """Implementation for the typed elevator/escalator outages adapter
+
+        Args:
+            endpoint (str): URL of the elevator/escalator status feed
+            interval (timedelta): polling interval
+            equipment_types (list): if given, only outages of these equipment types (EL, ES) are ticked
+            include_upcoming (bool): include planned outages which have not started yet
+            tick_unchanged (bool): tick on every poll, even if the payload is identical to the last one
+        """
+        super().__init__(endpoint, interval, False, tick_unchanged)
+        self._decoder = EquipmentOutageDecoder(equipment_types, include_upcoming)
 
 
 JSONRealtimeInputAdapter = py_push_adapter_def(
@@ -51,4 +94,28 @@ JSONRealtimeInputAdapter = py_push_adapter_def(
     endpoint=str,
     interval=timedelta,
     publish_raw_bytes=bool,
+    tick_unchanged=(bool, False),
+    timeout=(timedelta, None),
+)
+
+AlertsInputAdapter = py_push_adapter_def(
+    "AlertsAdapter",
+    AlertsAdapterImpl,
+    ts[[Alert]],
+    endpoint=str,
+    interval=(timedelta, MTA_FEED_UPDATE_TIME),
+    route_ids=(typing.List[str], None),
+    include_description=(bool, False),
+    tick_unchanged=(bool, False),
+)
+
+EquipmentOutagesInputAdapter = py_push_adapter_def(
+    "EquipmentOutagesAdapter",
+    EquipmentOutagesAdapterImpl,
+    ts[[EquipmentOutage]],
+    endpoint=(str, ACCESSIBILITY_ENDPOINT),
+    interval=(timedelta, MTA_FEED_UPDATE_TIME),
+    equipment_types=(typing.List[str], None),
+    include_upcoming=(bool, True),
+    tick_unchanged=(bool, False),
 )
@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+from csp import ts
+from csp.impl.pushadapter import PushInputAdapter
+from csp.impl.wiring import py_push_adapter_def
+
+from .feed_poller import PollMetrics, get_feed_poller
+from .GTFSInputAdapter import decode_feed_message
+from .json_records import loads
+from .mta_util import LINE_TO_ENDPOINT, MTA_FEED_UPDATE_TIME
+
+__all__ = ("PollMetricsInputAdapter",)
+
+_GTFS_ENDPOINTS = frozenset(LINE_TO_ENDPOINT.values())
+
+
+class PollMetricsAdapterImpl(PushInputAdapter):
+    def __init__(self, endpoint, interval, decoder):
+        """Implementation for the poll metrics adapter
+
+        Args:
+            endpoint (str): URL of the feed, or a GTFS service from LINE_TO_ENDPOINT
+            interval (timedelta): polling interval, if the feed is not already polled more often
+            decoder (callable): decodes snapshots to count their entities when no other adapter on the feed decodes
+                them, e.g. the FeedSelection or AlertDecoder of the adapter being measured; by default FeedMessages
+                for GTFS services and parsed JSON otherwise
+        """
+        self._endpoint = LINE_TO_ENDPOINT.get(endpoint, endpoint)
+        if decoder is None:
+            decoder = decode_feed_message if self._endpoint in _GTFS_ENDPOINTS else loads
+        self._interval = interval.total_seconds()
+        self._decoder = decoder
+        self._subscription = None
+
+    def start(self, starttime, endtime):
+        self._subscription = get_feed_poller().subscribe(
+            self._endpoint,
+            self._interval,
+            None,
+            decoder=self._decoder,
+            metrics_callback=self.push_tick,
+        )
+
+    def stop(self):
+        if self._subscription is not None:
+            get_feed_poller().unsubscribe(self._subscription)
+            self._subscription = None
+
+
+# Ticks the metrics of every poll of a feed. Polls are shared, so alongside a GTFS or JSON adapter on the same
+# feed this describes the very polls that adapter ticks from, and entity counts come from that adapter's decoding;
+# on its own, it decodes each new snapshot with decoder to count its entities
+PollMetricsInputAdapter = py_push_adapter_def(
+    "PollMetricsAdapter",
+    PollMetricsAdapterImpl,
+    ts[PollMetrics],
+    endpoint=str,
+    interval=(timedelta, MTA_FEED_UPDATE_TIME),
+    decoder=(object, None),
+)
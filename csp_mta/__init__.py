@@ -1,4 +1,32 @@
+from .arrival_inference import *
+from .backtest import *
+from .backtest_runner import *
+from .columnar import *
 from .compiled_protobuf import *
+from .departure_boards import *
+from .event_stream import *
+from .feed_poller import *
+from .feed_selection import *
+from .feed_simulator import *
 from .GTFSInputAdapter import *
+from .GTFSReplayInputAdapter import *
+from .journey_planner import *
+from .json_records import *
 from .JSONInputAdapter import *
 from .mta_util import *
+from .outage_tracker import *
+from .poll_metrics import *
+from .PollMetricsInputAdapter import *
+from .quantile_sketch import *
+from .recording import *
+from .reference_data import *
+from .stop_index import *
+from .stop_time_archive import *
+from .trip_delta import *
+
+
+def __getattr__(name):
+    # STOP_INFO_DF and TRANSFER_INFO_DF are built lazily, see mta_util
+    if name in ("STOP_INFO_DF", "TRANSFER_INFO_DF"):
+        return getattr(mta_util, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,140 @@
+"""
+A minimal asyncio HTTP/1.1 server run on a background thread, shared by FeedSimulator and EventStreamServer.
+
+HTTPServerThread owns the thread, event loop and listening socket: start() returns once the server is listening,
+and raises on the calling thread if it could not bind, e.g. because the port is in use; stop() closes the server
+and cancels every open connection. Subclasses implement _handle(reader, writer) for one connection.
+"""
+
+import abc
+import asyncio
+import threading
+
+_MAX_HEADER_LINES = 100
+
+
+async def read_request(reader):
+    """
+    Read the request line and headers of one request, as (method, target, headers)
+    Header names are lower-cased; returns (None, None, None) if the connection was closed first
+    """
+    request = await reader.readline()
+    if not request:
+        return None, None, None
+    method, target, _ = request.decode("latin-1").split(" ", 2)
+    headers = {}
+    for _ in range(_MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return method, target, headers
+
+
+class HTTPServerThread(abc.ABC):
+    thread_name = "csp_mta-http-server"
+
+    def __init__(self, host, port):
+        """Base for servers answering connections with _handle on a background asyncio thread
+
+        Args:
+            host (str): address to listen on
+            port (int): port to listen on, 0 for any free port; set to the port bound once started
+        """
+        self.host = host
+        self.port = port
+        self._server = None
+        self._connections = set()
+        self._event_loop = None
+        self._thread = None
+        self._lifecycle_lock = threading.Lock()  # serializes start and stop
+        # the event loop once it is serving, for other threads to hand work to
+        self._serving_loop = None
+
+    @abc.abstractmethod
+    async def _handle(self, reader, writer):
+        """Serve one connection; it is closed on return"""
+
+    async def _connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            await self._handle(reader, writer)
+        except (ConnectionError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _serve(self, started, errors):
+        try:
+            self._server = await asyncio.start_server(self._connection, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+        except Exception as e:
+            # e.g. the port is in use: raised by start() rather than lost on the server thread
+            errors.append(e)
+            return
+        finally:
+            started.set()
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+    def run(self):
+        """Serve on the calling thread until interrupted"""
+        errors = []
+        asyncio.run(self._serve(threading.Event(), errors))
+        if errors:
+            raise errors[0]
+
+    def start(self):
+        """Serve from a background thread, returning once the server is listening; does nothing if already serving"""
+        with self._lifecycle_lock:
+            if self._thread is not None:
+                return self
+            started = threading.Event()
+            errors = []
+            self._event_loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._event_loop.run_until_complete,
+                args=(self._serve(started, errors),),
+                name=self.thread_name,
+                daemon=True,
+            )
+            self._thread.start()
+            started.wait()
+            if errors:
+                self._thread.join()
+                self._event_loop.close()
+                self._thread = None
+                self._event_loop = None
+                raise errors[0]
+            self._serving_loop = self._event_loop
+        return self
+
+    def _close(self):
+        """Runs on the server thread: stop listening, and end every connection, e.g. keep-alive ones"""
+        self._server.close()
+        for connection in self._connections:
+            connection.cancel()
+
+    def stop(self):
+        with self._lifecycle_lock:
+            if self._thread is None:
+                return
+            self._serving_loop = None
+            self._event_loop.call_soon_threadsafe(self._close)
+            self._thread.join()
+            self._event_loop.close()
+            self._thread = None
+            self._event_loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,217 @@
+"""
+Actual arrival and departure times inferred from successive GTFS-rt snapshots.
+
+The feeds only ever publish predictions, but a train's past can be read off how they change: stops drop out of
+a trip's stop_time_update once the train has left them, and the trip's vehicle position moves on to the next
+stop. When either happens the stops passed are published as ObservedArrivals, timed by the last prediction made
+for them (capped at the time they were seen to be passed), or by the vehicle position's own timestamp if the
+train was reported stopped at the station.
+
+State is kept only for trips in the feed, holding the stops still ahead of each train; a trip is evicted once its
+last stop is passed or it has been missing from the feed for a few snapshots. Trips whose TripUpdate is unchanged
+since the last snapshot cost no per-stop work.
+"""
+
+from collections import OrderedDict
+
+import csp
+from csp import ts
+
+from .compiled_protobuf import nyct_subway_pb2
+from .compiled_protobuf.gtfs_realtime_pb2 import FeedMessage, VehiclePosition
+
+__all__ = (
+    "ObservedArrival",
+    "ArrivalInferenceEngine",
+    "observed_arrivals",
+)
+
+_STOPPED_AT = VehiclePosition.STOPPED_AT
+# trips are occasionally dropped and then reinstated, so the stops published for recently evicted trips are kept
+MAX_FINISHED_TRIPS = 1024
+
+
+class ObservedArrival(csp.Struct):
+    trip_id: str
+    route_id: str
+    direction: int  # index into GTFS_DIRECTION
+    stop_id: str
+    arrival_time: int  # epoch seconds
+    departure_time: int  # epoch seconds, the same as the arrival time at the last stop of a trip
+    observed: bool  # whether the arrival time is from the train's reported position rather than a prediction
+    timestamp: int  # feed header timestamp of the snapshot in which the train had passed the stop
+
+
+class _ActiveTrip:
+    __slots__ = (
+        "raw",
+        "route_id",
+        "direction",
+        "stop_ids",
+        "times",
+        "passed",
+        "arrived_stop",
+        "arrived_time",
+        "missing",
+    )
+
+    def __init__(self, route_id, direction):
+        self.raw = None
+        self.route_id = route_id
+        self.direction = direction
+        self.stop_ids = []  # stops still ahead of the train
+        self.times = []  # their predicted (arrival, departure) times
+        self.passed = set()  # stops already published, in case a later snapshot lists them again
+        self.arrived_stop = None  # the stop the train was last reported stopped at
+        self.arrived_time = 0
+        self.missing = 0  # consecutive snapshots the trip has been missing from
+
+
+class ArrivalInferenceEngine:
+    """
+    Tracks the trips of one feed across snapshots, returning the stops each train has passed since the last one
+    Trips missing from max_missing consecutive snapshots are evicted, along with any stops they were due at by then
+    """
+
+    def __init__(self, max_missing=2):
+        self.max_missing = max_missing
+        self._trips = {}
+        self._finished = OrderedDict()  # trip_id -> stops published, for the most recently evicted trips
+
+    def __len__(self):
+        return len(self._trips)
+
+    def _pass(self, trip_id, trip, n, now, arrivals):
+        """Publish the next n stops of a trip as passed"""
+        for stop_id, (arrival, departure) in zip(trip.stop_ids[:n], trip.times[:n]):
+            observed = stop_id == trip.arrived_stop
+            if observed:
+                arrival = trip.arrived_time
+            else:
+                arrival = min(arrival or departure, now)
+            if arrival:
+                arrivals.append(
+                    ObservedArrival(
+                        trip_id=trip_id,
+                        route_id=trip.route_id,
+                        direction=trip.direction,
+                        stop_id=stop_id,
+                        arrival_time=arrival,
+                        departure_time=max(min(departure or arrival, now), arrival),
+                        observed=observed,
+                        timestamp=now,
+                    )
+                )
+            trip.passed.add(stop_id)
+        del trip.stop_ids[:n]
+        del trip.times[:n]
+
+    def _observe_vehicle(self, trip_id, trip, vehicle, now, arrivals):
+        stop_id = vehicle.stop_id
+        try:
+            i = trip.stop_ids.index(stop_id)
+        except ValueError:
+            return
+        # the vehicle's stop is the one it is at or heading to, so every stop before it has been passed
+        if i:
+            self._pass(trip_id, trip, i, now, arrivals)
+        if vehicle.current_status == _STOPPED_AT and trip.arrived_stop != stop_id:
+            trip.arrived_stop = stop_id
+            trip.arrived_time = vehicle.timestamp or now
+
+    def _update_stops(self, trip_id, trip, trip_update, now, arrivals):
+        stop_ids = []
+        times = []
+        for u in trip_update.stop_time_update:
+            if u.stop_id not in trip.passed:
+                stop_ids.append(u.stop_id)
+                times.append((u.arrival.time, u.departure.time))
+        # stops which dropped off the front of the trip have been passed
+        remaining = set(stop_ids)
+        n = 0
+        for stop_id in trip.stop_ids:
+            if stop_id in remaining:
+                break
+            n += 1
+        if n:
+            self._pass(trip_id, trip, n, now, arrivals)
+        trip.stop_ids = stop_ids
+        trip.times = times
+
+    def update(self, feed):
+        """Apply a new snapshot, returning the list of ObservedArrivals at stops passed since the previous one"""
+        now = feed.header.timestamp
+        vehicles = {}
+        for entity in feed.entity:
+            if entity.HasField("vehicle"):
+                vehicles[entity.vehicle.trip.trip_id] = entity.vehicle
+
+        arrivals = []
+        seen = set()
+        for entity in feed.entity:
+            if not entity.HasField("trip_update"):
+                continue
+            trip_update = entity.trip_update
+            trip_id = trip_update.trip.trip_id
+            seen.add(trip_id)
+            trip = self._trips.get(trip_id)
+            if trip is None:
+                if not trip_update.stop_time_update:
+                    continue
+                trip = self._trips[trip_id] = _ActiveTrip(
+                    trip_update.trip.route_id,
+                    trip_update.trip.Extensions[
+                        nyct_subway_pb2.nyct_trip_descriptor
+                    ].direction,
+                )
+                trip.passed = self._finished.pop(trip_id, trip.passed)
+            trip.missing = 0
+
+            # the vehicle position is applied first, as a train which has just reached a stop may also have
+            # dropped it from its stop time updates in the same snapshot
+            vehicle = vehicles.get(trip_id)
+            if vehicle is not None and trip.raw is not None:
+                self._observe_vehicle(trip_id, trip, vehicle, now, arrivals)
+            raw = trip_update.SerializeToString()
+            if raw != trip.raw:
+                new = trip.raw is None
+                trip.raw = raw
+                self._update_stops(trip_id, trip, trip_update, now, arrivals)
+                if new and vehicle is not None:
+                    self._observe_vehicle(trip_id, trip, vehicle, now, arrivals)
+            if not trip.stop_ids:
+                self._evict(trip_id)
+
+        for trip_id in [t for t in self._trips if t not in seen]:
+            trip = self._trips[trip_id]
+            trip.missing += 1
+            if trip.missing > self.max_missing:
+                n = 0
+                for arrival, departure in trip.times:
+                    if (arrival or departure) > now:
+                        break
+                    n += 1
+                self._pass(trip_id, trip, n, now, arrivals)
+                self._evict(trip_id)
+        return arrivals
+
+    def _evict(self, trip_id):
+        self._finished[trip_id] = self._trips.pop(trip_id).passed
+        if len(self._finished) > MAX_FINISHED_TRIPS:
+            self._finished.popitem(last=False)
+
+
+@csp.node
+def observed_arrivals(
+    feed: ts[FeedMessage], max_missing: int = 2
+) -> ts[[ObservedArrival]]:
+    """
+    Infers the actual arrival and departure times of trains from successive snapshots of a feed
+    Ticks the stops passed since the previous snapshot, whenever there are any
+    """
+    with csp.state():
+        s_engine = ArrivalInferenceEngine(max_missing)
+
+    arrivals = s_engine.update(feed)
+    if arrivals:
+        return arrivals
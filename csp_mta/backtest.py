@@ -0,0 +1,305 @@
+"""
+Network-wide wait time and headway backtests over recorded feeds.
+
+One pass over a recording computes statistics for every stop and direction at once. Each snapshot is decoded
+into FeedColumns and reduced with NumPy:
+  - wait: the posted wait for the next train at each platform, sampled at every snapshot (as in e_04)
+  - headway: the time between consecutive trains at each platform, from the last prediction of each train's
+    arrival before it dropped out of the feed (capped at the snapshot it dropped out in)
+
+Samples are bucketed by NYC local time, with the bucket found per snapshot by epoch arithmetic rather than per
+entity, and only running sums are kept per bucket, so memory does not grow with the length of the recording.
+Optionally, each bucket also gets a QuantileSketch per stop, for percentiles which can be merged across runs.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .columnar import FeedColumnsDecoder
+from .mta_util import NYC_TIMEZONE, to_epoch_seconds
+from .quantile_sketch import DEFAULT_QUANTILES, QuantileSketch
+from .recording import iter_recording
+
+__all__ = (
+    "BACKTEST_METRICS",
+    "WaitTimeBacktest",
+    "summarize_backtest",
+    "backtest_recording",
+)
+
+BACKTEST_METRICS = ("wait", "headway")
+# predictions further ahead than this are not tracked for headways, as a train's arrival is taken from its
+# prediction in the snapshot before it drops out of the feed
+HEADWAY_HORIZON = 300
+_INT64_MAX = np.iinfo(np.int64).max
+_SKETCH_BATCH = 1 << 16
+
+
+class _Buckets:
+    """Running count, sum, sum of squares, min and max per stop code for one time bucket, and optionally a sketch"""
+
+    def __init__(self, size, sketches):
+        # stop code -> QuantileSketch of its samples, which holds a bounded number of centroids and buffered samples
+        self.sketches = {} if sketches else None
+        # samples not yet added to the sketches, added in batches of at least _SKETCH_BATCH
+        self._pending = []
+        self._num_pending = 0
+        self.count = np.zeros(size, dtype=np.int64)
+        self.total = np.zeros(size, dtype=np.float64)
+        self.total_sq = np.zeros(size, dtype=np.float64)
+        self.min = np.full(size, _INT64_MAX, dtype=np.int64)
+        self.max = np.zeros(size, dtype=np.int64)
+
+    def grow(self, size):
+        n = size - len(self.count)
+        if n > 0:
+            self.count = np.r_[self.count, np.zeros(n, dtype=np.int64)]
+            self.total = np.r_[self.total, np.zeros(n)]
+            self.total_sq = np.r_[self.total_sq, np.zeros(n)]
+            self.min = np.r_[self.min, np.full(n, _INT64_MAX, dtype=np.int64)]
+            self.max = np.r_[self.max, np.zeros(n, dtype=np.int64)]
+
+    def add(self, stops, values):
+        """Add samples; stops may repeat"""
+        np.add.at(self.count, stops, 1)
+        np.add.at(self.total, stops, values)
+        np.add.at(self.total_sq, stops, values.astype(np.float64) ** 2)
+        np.minimum.at(self.min, stops, values)
+        np.maximum.at(self.max, stops, values)
+        if self.sketches is not None and len(stops):
+            self._pending.append((stops, values))
+            self._num_pending += len(stops)
+            if self._num_pending >= _SKETCH_BATCH:
+                self._add_pending()
+
+    def _add_pending(self):
+        """Add the pending samples to the sketches, each stop's as one array in the order they were given"""
+        if not self._pending:
+            return
+        stops = np.concatenate([p[0] for p in self._pending])
+        values = np.concatenate([p[1] for p in self._pending])
+        self._pending = []
+        self._num_pending = 0
+        order = np.argsort(stops, kind="stable")
+        stops = stops[order]
+        starts = np.flatnonzero(np.r_[True, stops[1:] != stops[:-1]])
+        sketches = self.sketches
+        for stop, samples in zip(stops[starts].tolist(), np.split(values[order], starts[1:])):
+            sketch = sketches.get(stop)
+            if sketch is None:
+                sketch = sketches[stop] = QuantileSketch()
+            sketch.update(samples)
+
+    def serialized_sketches(self):
+        """Serialized QuantileSketch of the samples for each stop code with any, in code order"""
+        self._add_pending()
+        return [self.sketches[stop].to_bytes() for stop in sorted(self.sketches)]
+
+
+def _row_keys(columns):
+    return (columns.trip.astype(np.int64) << 32) | columns.stop.astype(np.int64)
+
+
+class WaitTimeBacktest:
+    """
+    Accumulates wait time and headway statistics for every stop over a sequence of FeedColumns snapshots
+    Snapshots must be given in time order and decoded by the same FeedColumnsDecoder, so stop codes agree
+    With sketches, the samples of each bucket are also summarized by a QuantileSketch per stop
+    """
+
+    def __init__(self, decoder=None, bucket=timedelta(hours=1), sketches=False):
+        self.decoder = decoder if decoder is not None else FeedColumnsDecoder()
+        self._bucket = int(bucket.total_seconds())
+        self._sketches = sketches
+        self._bucket_start = None
+        self._bucket_end = None
+        self._buckets = {}
+        self._chunks = []
+        # headway state: arrival of the last train at each stop code, and the tracked rows of the last snapshot
+        self._last_arrival = np.zeros(0, dtype=np.int64)
+        self._prev = None
+
+    def _start_bucket(self, now):
+        self._flush()
+        # local bucket boundaries as epoch seconds; the UTC offset is looked up once per bucket
+        offset = int(datetime.fromtimestamp(now, NYC_TIMEZONE).utcoffset().total_seconds())
+        self._bucket_start = now - (now + offset) % self._bucket
+        self._bucket_end = self._bucket_start + self._bucket
+        size = len(self.decoder.stops)
+        self._buckets = {
+            metric: _Buckets(size, self._sketches) for metric in BACKTEST_METRICS
+        }
+
+    def _flush(self):
+        for metric, buckets in self._buckets.items():
+            stops = np.flatnonzero(buckets.count)
+            if len(stops):
+                self._chunks.append(
+                    (
+                        self._bucket_start,
+                        metric,
+                        stops,
+                        buckets.count[stops],
+                        buckets.total[stops],
+                        buckets.total_sq[stops],
+                        buckets.min[stops],
+                        buckets.max[stops],
+                        buckets.serialized_sketches() if self._sketches else None,
+                    )
+                )
+        self._buckets = {}
+
+    def update(self, now, columns, record=True):
+        """
+        Add a snapshot taken at now (epoch seconds)
+        Snapshots with record False only warm up the headway state, e.g. those before the start of a time slice
+        """
+        if not record:
+            arrival = np.where(columns.arrival > 0, columns.arrival, columns.departure)
+            self._add_headways(now, columns, arrival, False)
+            return
+        if self._bucket_start is None or now >= self._bucket_end:
+            self._start_bucket(now)
+        size = len(self.decoder.stops)
+        for buckets in self._buckets.values():
+            buckets.grow(size)
+
+        arrival = np.where(columns.arrival > 0, columns.arrival, columns.departure)
+        upcoming = arrival >= now
+        self._add_waits(columns.stop[upcoming], arrival[upcoming] - now)
+        self._add_headways(now, columns, arrival)
+
+    def _add_waits(self, stops, waits):
+        # the first row of each stop, sorted by wait, is the next train there
+        order = np.lexsort((waits, stops))
+        stops = stops[order]
+        waits = waits[order]
+        first = np.r_[True, stops[1:] != stops[:-1]] if len(stops) else np.zeros(0, bool)
+        self._buckets["wait"].add(stops[first], waits[first])
+
+    def _add_headways(self, now, columns, arrival, record=True):
+        keys = _row_keys(columns)
+        if self._prev is not None:
+            prev_keys, prev_stops, prev_arrivals = self._prev
+            dropped = ~np.isin(prev_keys, keys)
+            self._add_arrivals(
+                prev_stops[dropped], np.minimum(prev_arrivals[dropped], now), record
+            )
+        tracked = (arrival > 0) & (arrival <= now + HEADWAY_HORIZON)
+        self._prev = (keys[tracked], columns.stop[tracked], arrival[tracked])
+
+    def _add_arrivals(self, stops, arrivals, record):
+        if len(self._last_arrival) < len(self.decoder.stops):
+            self._last_arrival = np.r_[
+                self._last_arrival,
+                np.zeros(len(self.decoder.stops) - len(self._last_arrival), dtype=np.int64),
+            ]
+        if not len(stops):
+            return
+        order = np.lexsort((arrivals, stops))
+        stops = stops[order]
+        arrivals = arrivals[order]
+        prev = np.r_[0, arrivals[:-1]]
+        first = np.r_[True, stops[1:] != stops[:-1]]
+        prev[first] = self._last_arrival[stops[first]]
+        np.maximum.at(self._last_arrival, stops, arrivals)
+        if not record:
+            return
+        valid = (prev > 0) & (arrivals > prev)
+        self._buckets["headway"].add(stops[valid], arrivals[valid] - prev[valid])
+
+    def aggregates(self):
+        """
+        Running sums per (time, stop_id, direction, metric) bucket, in seconds, which can be added up across
+        backtests of other recordings and then passed to summarize_backtest
+        With sketches, the serialized QuantileSketch of each bucket is in the sketch column
+        """
+        # imported here so that importing the package does not require pandas
+        import pandas as pd
+
+        self._flush()
+        self._bucket_start = None
+        chunks, self._chunks = self._chunks, []
+        columns = ["time", "stop_id", "direction", "metric", "count", "total", "total_sq", "min", "max"]
+        if not chunks:
+            return pd.DataFrame(columns=columns + ["sketch"] if self._sketches else columns)
+
+        strings = np.array(self.decoder.stops.strings, dtype=object)
+        counts = [len(chunk[2]) for chunk in chunks]
+        stop_ids = strings[np.concatenate([chunk[2] for chunk in chunks])]
+        platform = pd.Series(stop_ids, dtype=object)
+        # platform stop_ids end in N or S for the direction of travel
+        has_direction = platform.str[-1].isin(("N", "S"))
+        df = pd.DataFrame(
+            {
+                "time": pd.to_datetime(
+                    np.repeat([chunk[0] for chunk in chunks], counts), unit="s", utc=True
+                ).tz_convert(NYC_TIMEZONE),
+                "stop_id": platform.where(~has_direction, platform.str[:-1]),
+                "direction": platform.str[-1].where(has_direction, ""),
+                "metric": np.repeat([chunk[1] for chunk in chunks], counts),
+            }
+        )
+        for i, name in enumerate(["count", "total", "total_sq", "min", "max"]):
+            df[name] = np.concatenate([chunk[3 + i] for chunk in chunks])
+        if self._sketches:
+            df["sketch"] = [sketch for chunk in chunks for sketch in chunk[8]]
+        return df
+
+
+def _merge_sketches(sketches):
+    merged = QuantileSketch()
+    for sketch in sketches:
+        merged.merge(QuantileSketch.from_bytes(sketch))
+    return merged
+
+
+def summarize_backtest(aggregates, quantiles=DEFAULT_QUANTILES):
+    """
+    Tidy statistics from backtest aggregates: one row per (time, stop_id, direction, metric) with the
+    count, mean, std, min and max in seconds, and p50, p90, ... for the given quantiles if the aggregates have sketches
+    Aggregates of several backtests are combined first, e.g. for recordings which overlap a bucket; if they have
+    a service column, each service is kept apart
+    """
+    keys = ["time", "stop_id", "direction", "metric"]
+    if "service" in aggregates:
+        keys.insert(0, "service")
+    grouped = aggregates.groupby(keys, sort=True, observed=True)
+    df = grouped[["count", "total", "total_sq"]].sum()
+    df["min"] = grouped["min"].min()
+    df["max"] = grouped["max"].max()
+    count = df["count"].astype(np.float64)
+    mean = df["total"] / count
+    df["std"] = np.sqrt(np.maximum(df["total_sq"] / count - mean**2, 0.0))
+    df["mean"] = mean
+    columns = keys + ["count", "mean", "std", "min", "max"]
+    if "sketch" in aggregates:
+        estimates = np.array(
+            [_merge_sketches(s).quantiles(quantiles) for s in grouped["sketch"].agg(list)]
+        ).reshape(len(df), len(quantiles))
+        for i, q in enumerate(quantiles):
+            name = f"p{100 * q:g}"
+            df[name] = estimates[:, i]
+            columns.append(name)
+    return df.reset_index()[columns]
+
+
+def backtest_recording(
+    recording,
+    starttime=None,
+    endtime=None,
+    bucket=timedelta(hours=1),
+    aggregate=False,
+    sketches=False,
+):
+    """
+    Wait time and headway statistics for every stop in a recording (either recording format), in one pass
+    Returns summarize_backtest's tidy DataFrame, with percentiles if sketches is True, or the raw aggregates
+    if aggregate is True
+    """
+    backtest = WaitTimeBacktest(bucket=bucket, sketches=sketches)
+    for time, content in iter_recording(recording, starttime, endtime):
+        backtest.update(to_epoch_seconds(time), backtest.decoder.decode_bytes(content))
+    aggregates = backtest.aggregates()
+    return aggregates if aggregate else summarize_backtest(aggregates)
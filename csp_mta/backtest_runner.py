@@ -0,0 +1,227 @@
+"""
+Parallel backtests over a directory of recordings, such as recorded_data/.
+
+Recordings are discovered by service and time range, and split into shards: one per time slice of each
+recording. Each shard is a csp.run of a columnar replay through WaitTimeBacktest in its own process, and the
+partial aggregates are merged in shard order, whichever process finishes first, so results do not depend on
+the number of workers.
+
+Shards cover half-open time ranges, so no snapshot is counted twice. Each shard replays a warm-up period before
+its range without recording samples, so that headways which span a shard boundary are still measured, and
+where two recordings of a service overlap, the later one only covers the time after the earlier one ends.
+"""
+
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import csp
+from csp import ts
+
+from .backtest import WaitTimeBacktest, summarize_backtest
+from .columnar import FeedColumns
+from .GTFSReplayInputAdapter import GTFSColumnsReplayInputAdapter
+from .mta_util import LINE_TO_ENDPOINT, to_epoch_seconds
+
+__all__ = (
+    "RecordingFile",
+    "BacktestShard",
+    "discover_recordings",
+    "backtest_shards",
+    "run_backtest_shard",
+    "run_backtest",
+)
+
+DEFAULT_SLICE_LENGTH = timedelta(hours=6)
+DEFAULT_WARMUP = timedelta(hours=1)
+# csp end times are inclusive, while shards are half-open
+_END_EPSILON = timedelta(microseconds=1)
+_EPOCH = datetime(1970, 1, 1)
+_UNIT_NANOSECONDS = {"s": 1_000_000_000, "ms": 1_000_000, "us": 1_000, "ns": 1}
+
+
+class RecordingFile(csp.Struct):
+    service: str
+    filename: str
+    starttime: datetime  # naive UTC, the first snapshot
+    endtime: datetime  # naive UTC, the last snapshot
+
+
+class BacktestShard(csp.Struct):
+    service: str
+    filename: str
+    starttime: datetime  # naive UTC, inclusive
+    endtime: datetime  # naive UTC, exclusive
+    warmup: timedelta
+
+
+def _time_range(filename):
+    """First and last snapshot times of a recording, from the Parquet column statistics where possible"""
+    metadata = pq.ParquetFile(filename).metadata
+    schema = metadata.schema.to_arrow_schema()
+    index = schema.get_field_index("time")
+    stats = [metadata.row_group(i).column(index).statistics for i in range(metadata.num_row_groups)]
+    if stats and all(s is not None and s.has_min_max for s in stats):
+        # the raw statistics of a timestamp column are integers in its unit
+        first = min(s.min_raw for s in stats)
+        last = max(s.max_raw for s in stats)
+    else:
+        times = pq.read_table(filename, columns=["time"]).column("time").cast("int64")
+        bounds = pc.min_max(times)
+        first = bounds["min"].as_py()
+        last = bounds["max"].as_py()
+    nanoseconds = _UNIT_NANOSECONDS[schema.field(index).type.unit]
+    # times are recorded to the nanosecond, and datetimes only hold microseconds
+    start = first * nanoseconds // 1000
+    end = -(-last * nanoseconds // 1000)
+    return _EPOCH + timedelta(microseconds=start), _EPOCH + timedelta(microseconds=end)
+
+
+def discover_recordings(root, services=None, starttime=None, endtime=None):
+    """
+    RecordingFiles under root, named as record_data.py names them (e.g. G_20240421_1854.parquet), sorted by
+    service and start time
+    Only recordings of the given services which overlap [starttime, endtime] (naive UTC) are returned
+    """
+    recordings = []
+    for filename in glob.glob(os.path.join(root, "**", "*.parquet"), recursive=True):
+        service = os.path.basename(filename).split("_")[0]
+        if service not in LINE_TO_ENDPOINT or (services is not None and service not in services):
+            continue
+        start, end = _time_range(filename)
+        if (starttime is not None and end < starttime) or (endtime is not None and start > endtime):
+            continue
+        recordings.append(
+            RecordingFile(service=service, filename=filename, starttime=start, endtime=end)
+        )
+    recordings.sort(key=lambda r: (r.service, r.starttime, r.filename))
+    return recordings
+
+
+def backtest_shards(
+    recordings,
+    starttime=None,
+    endtime=None,
+    slice_length=DEFAULT_SLICE_LENGTH,
+    warmup=DEFAULT_WARMUP,
+):
+    """
+    Split recordings into shards of at most slice_length, covering each service's time in [starttime, endtime)
+    once; where recordings of a service overlap, the earlier one covers the overlap
+    """
+    shards = []
+    covered = {}
+    for recording in sorted(recordings, key=lambda r: (r.service, r.starttime, r.filename)):
+        start = recording.starttime
+        if starttime is not None:
+            start = max(start, starttime)
+        start = max(start, covered.get(recording.service, start))
+        # the last snapshot is included in the recording's range
+        end = recording.endtime + _END_EPSILON
+        if endtime is not None:
+            end = min(end, endtime)
+        if start >= end:
+            continue
+        covered[recording.service] = end
+        while start < end:
+            shard_end = min(start + slice_length, end)
+            shards.append(
+                BacktestShard(
+                    service=recording.service,
+                    filename=recording.filename,
+                    starttime=start,
+                    endtime=shard_end,
+                    warmup=warmup,
+                )
+            )
+            start = shard_end
+    return shards
+
+
+@csp.node
+def _backtest_columns(
+    columns: ts[FeedColumns], backtest: WaitTimeBacktest, record_from: datetime
+):
+    backtest.update(
+        to_epoch_seconds(csp.now()), columns, record=csp.now() >= record_from
+    )
+
+
+@csp.graph
+def _backtest_graph(shard: BacktestShard, backtest: WaitTimeBacktest):
+    columns = GTFSColumnsReplayInputAdapter(
+        shard.filename, workers=0, decoder=backtest.decoder
+    )
+    _backtest_columns(columns, backtest, shard.starttime)
+
+
+def _empty_aggregates(bucket, sketches):
+    aggregates = WaitTimeBacktest(bucket=bucket, sketches=sketches).aggregates()
+    aggregates.insert(0, "service", "")
+    return aggregates
+
+
+def run_backtest_shard(shard, bucket=timedelta(hours=1), sketches=False):
+    """Backtest aggregates of one shard, with a service column"""
+    backtest = WaitTimeBacktest(bucket=bucket, sketches=sketches)
+    csp.run(
+        _backtest_graph,
+        shard,
+        backtest,
+        starttime=shard.starttime - shard.warmup,
+        endtime=shard.endtime - _END_EPSILON,
+    )
+    aggregates = backtest.aggregates()
+    aggregates.insert(0, "service", shard.service)
+    return aggregates
+
+
+def run_backtest(
+    root,
+    services=None,
+    starttime=None,
+    endtime=None,
+    workers=None,
+    slice_length=DEFAULT_SLICE_LENGTH,
+    warmup=DEFAULT_WARMUP,
+    bucket=timedelta(hours=1),
+    sketches=False,
+    aggregate=False,
+):
+    """
+    Wait time and headway statistics for every stop of every service recorded under root, over [starttime, endtime)
+    (naive UTC, or all of the recordings if not given)
+
+    Shards are run on a pool of workers processes (os.cpu_count() if None, inline if 0). Returns
+    summarize_backtest's tidy DataFrame with a service column, or the merged raw aggregates if aggregate is True
+    Either is empty, with the same columns, if there are no recordings or arrivals in the time range
+    """
+    recordings = discover_recordings(root, services, starttime, endtime)
+    shards = backtest_shards(recordings, starttime, endtime, slice_length, warmup)
+    if not shards:
+        # no recordings for the given services and time range
+        results = [_empty_aggregates(bucket, sketches)]
+    elif workers == 0:
+        results = [run_backtest_shard(shard, bucket, sketches) for shard in shards]
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            # map returns results in shard order, which fixes the order they are merged in
+            results = list(
+                executor.map(
+                    run_backtest_shard,
+                    shards,
+                    [bucket] * len(shards),
+                    [sketches] * len(shards),
+                )
+            )
+    # imported here so that importing the package does not require pandas
+    import pandas as pd
+
+    # if no shard has any arrivals, the first one's empty aggregates keep the columns
+    results = [r for r in results if len(r)] or results[:1]
+    aggregates = pd.concat(results, ignore_index=True)
+    return aggregates if aggregate else summarize_backtest(aggregates)
@@ -0,0 +1,190 @@
+"""
+Columnar decoding of GTFS-rt feeds.
+
+Flattens the stop time updates of a FeedMessage into contiguous NumPy columns, one row per
+(trip, stop), so that filtering, sorting and wait-time arithmetic can be vectorized rather than
+done per protobuf object. String ids are interned into integer codes by a decoder which is kept
+across ticks, so codes are stable for the lifetime of the decoder.
+"""
+
+import numpy as np
+
+import csp
+from csp import ts
+
+from .compiled_protobuf import nyct_subway_pb2
+from .compiled_protobuf.gtfs_realtime_pb2 import FeedMessage
+
+__all__ = (
+    "StringInterner",
+    "FeedColumns",
+    "FeedColumnsDecoder",
+    "feed_columns",
+)
+
+
+class StringInterner:
+    """Assigns each distinct string a stable integer code"""
+
+    def __init__(self):
+        self._codes = {}
+        self._strings = []
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __contains__(self, s):
+        return s in self._codes
+
+    @property
+    def strings(self):
+        return self._strings
+
+    def code(self, s):
+        code = self._codes.get(s)
+        if code is None:
+            code = self._codes[s] = len(self._strings)
+            self._strings.append(s)
+        return code
+
+    def codes(self, strings):
+        """Intern a sequence of strings, returning an int32 array of their codes"""
+        return np.fromiter(
+            (self.code(s) for s in strings), dtype=np.int32, count=len(strings)
+        )
+
+    def get(self, s, default=-1):
+        """Code of an already interned string, without interning it"""
+        return self._codes.get(s, default)
+
+    def lookup(self, codes):
+        """Strings for an array of codes"""
+        strings = self._strings
+        return [strings[c] for c in codes]
+
+
+class FeedColumns:
+    """
+    Struct-of-arrays view of the stop time updates in one feed snapshot, one row per (trip, stop)
+
+    Attributes:
+        timestamp (int): feed header timestamp, in epoch seconds
+        trip (int32 array): trip_id codes
+        route (int32 array): route_id codes
+        stop (int32 array): stop_id codes
+        arrival (int64 array): arrival time in epoch seconds, 0 if not given
+        departure (int64 array): departure time in epoch seconds, 0 if not given
+        direction (int8 array): index into GTFS_DIRECTION
+    """
+
+    __slots__ = ("timestamp", "trip", "route", "stop", "arrival", "departure", "direction")
+
+    def __init__(self, timestamp, trip, route, stop, arrival, departure, direction):
+        self.timestamp = timestamp
+        self.trip = trip
+        self.route = route
+        self.stop = stop
+        self.arrival = arrival
+        self.departure = departure
+        self.direction = direction
+
+    def __len__(self):
+        return len(self.stop)
+
+    def __getstate__(self):
+        return tuple(getattr(self, k) for k in self.__slots__)
+
+    def __setstate__(self, state):
+        for k, v in zip(self.__slots__, state):
+            setattr(self, k, v)
+
+    def select(self, mask):
+        """Rows selected by a boolean mask or index array"""
+        return FeedColumns(
+            self.timestamp,
+            self.trip[mask],
+            self.route[mask],
+            self.stop[mask],
+            self.arrival[mask],
+            self.departure[mask],
+            self.direction[mask],
+        )
+
+
+class FeedColumnsDecoder:
+    """
+    Decodes FeedMessages into FeedColumns
+    The trip, route and stop interners are shared by every snapshot decoded, so codes can be compared across ticks
+    """
+
+    def __init__(self):
+        self.trips = StringInterner()
+        self.routes = StringInterner()
+        self.stops = StringInterner()
+
+    def adopt(self, columns, trips, routes, stops):
+        """
+        Re-code columns produced by another decoder (e.g. in a worker process) into this decoder's codes
+        trips, routes and stops are the other decoder's interned strings
+        """
+        columns.trip = self.trips.codes(trips)[columns.trip]
+        columns.route = self.routes.codes(routes)[columns.route]
+        columns.stop = self.stops.codes(stops)[columns.stop]
+        return columns
+
+    def decode_bytes(self, content):
+        feed = FeedMessage()
+        feed.ParseFromString(content)
+        return self.decode(feed)
+
+    def decode(self, feed):
+        trip_codes = []
+        route_codes = []
+        directions = []
+        counts = []
+        stop_ids = []
+        arrivals = []
+        departures = []
+        for entity in feed.entity:
+            if not entity.HasField("trip_update"):
+                continue
+            trip_update = entity.trip_update
+            updates = trip_update.stop_time_update
+            if not updates:
+                continue
+            trip = trip_update.trip
+            trip_codes.append(self.trips.code(trip.trip_id))
+            route_codes.append(self.routes.code(trip.route_id))
+            directions.append(
+                trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor].direction
+            )
+            counts.append(len(updates))
+            for update in updates:
+                stop_ids.append(update.stop_id)
+                arrivals.append(update.arrival.time)
+                departures.append(update.departure.time)
+
+        counts = np.array(counts, dtype=np.int64)
+        return FeedColumns(
+            timestamp=feed.header.timestamp,
+            trip=np.repeat(np.array(trip_codes, dtype=np.int32), counts),
+            route=np.repeat(np.array(route_codes, dtype=np.int32), counts),
+            stop=self.stops.codes(stop_ids),
+            arrival=np.array(arrivals, dtype=np.int64),
+            departure=np.array(departures, dtype=np.int64),
+            direction=np.repeat(np.array(directions, dtype=np.int8), counts),
+        )
+
+
+@csp.node
+def feed_columns(
+    feed: ts[FeedMessage], decoder: FeedColumnsDecoder = None
+) -> ts[FeedColumns]:
+    """
+    Decodes each feed snapshot into columns
+    Pass a decoder to share its string codes with other nodes or with the caller
+    """
+    with csp.state():
+        s_decoder = decoder if decoder is not None else FeedColumnsDecoder()
+
+    return s_decoder.decode(feed)
@@ -0,0 +1,157 @@
+"""
+Departure boards for every stop, precomputed once per feed snapshot and served from memory.
+
+DepartureBoardCache keeps the next N arrivals at each stop of a feed, both as StopArrivals and rendered as text.
+On each snapshot every stop's next arrivals are looked up in the StopArrivalIndex and compared with the cached
+board by trip, arrival time and minutes away; only the stops where these changed get a new board, so looking up
+a board never recomputes it, and unchanged boards keep their identity (and rendered text) across snapshots.
+Station names are looked up once per stop.
+"""
+
+import csp
+from csp import ts
+
+from .mta_util import GTFS_DIRECTION, to_epoch_seconds
+from .reference_data import get_stop_info
+from .stop_index import StopArrival, StopArrivalIndex
+
+__all__ = (
+    "DepartureBoard",
+    "DepartureBoardCache",
+    "render_departure_board",
+    "departure_boards",
+    "departure_board_at",
+)
+
+DEFAULT_NUM_TRAINS = 5
+
+
+class DepartureBoard(csp.Struct):
+    stop_id: str
+    name: str  # station name, or the stop_id if it is not in stops.txt
+    timestamp: int  # epoch seconds the board was computed at, which minutes away are counted from
+    arrivals: [StopArrival]  # the next arrivals, sorted by arrival time
+    text: str  # the board as rendered by render_departure_board
+
+
+def render_departure_board(name, arrivals, now, stop_name=None):
+    """
+    Pretty-print the next arrivals at a station as of now (epoch seconds)
+    Termini are named by stop_name(stop_id), from stops.txt by default
+    """
+    if stop_name is None:
+        stops = get_stop_info()
+
+        def stop_name(stop_id):
+            return _stop_name(stops, stop_id)
+
+    lines = [f"\n At station {name}\n\n"]
+    for arrival in arrivals:
+        direction = GTFS_DIRECTION[arrival.direction]
+        terminus = stop_name(arrival.terminus_id)
+        minutes = (arrival.arrival_time - now) // 60
+        lines.append(f"{direction} {arrival.route_id} train to {terminus} in {minutes} minutes\n")
+    return "".join(lines)
+
+
+def _stop_name(stops, stop_id):
+    return stops.name(stop_id) if stop_id in stops else stop_id
+
+
+def _board_key(arrivals, now):
+    # what a board shows: which trains, when, and how many minutes away
+    return tuple(
+        (a.trip_id, a.arrival_time, a.terminus_id, (a.arrival_time - now) // 60)
+        for a in arrivals
+    )
+
+
+class DepartureBoardCache:
+    """
+    The next num_trains arrivals at every stop of a feed, updated from each snapshot's StopArrivalIndex
+    Boards are keyed by stop_id, including both the platforms (e.g. 635N) and their parent station (635)
+    """
+
+    def __init__(self, num_trains=DEFAULT_NUM_TRAINS):
+        self.num_trains = num_trains
+        self._boards = {}
+        self._keys = {}
+        self._names = {}
+        self._stops = get_stop_info()
+
+    def __len__(self):
+        return len(self._boards)
+
+    def __contains__(self, stop_id):
+        return stop_id in self._boards
+
+    def __getitem__(self, stop_id):
+        return self._boards[stop_id]
+
+    def get(self, stop_id, default=None):
+        return self._boards.get(stop_id, default)
+
+    def stop_ids(self):
+        return self._boards.keys()
+
+    def name(self, stop_id):
+        name = self._names.get(stop_id)
+        if name is None:
+            name = self._names[stop_id] = _stop_name(self._stops, stop_id)
+        return name
+
+    def update(self, index, now):
+        """
+        Recompute the boards from a StopArrivalIndex as of now (epoch seconds)
+        Returns the boards which changed; stops no longer in the feed are dropped, and returned as empty boards
+        """
+        changed = []
+        for stop_id in index.stop_ids():
+            arrivals = index.next_arrivals(stop_id, now, self.num_trains)
+            key = _board_key(arrivals, now)
+            if self._keys.get(stop_id) == key:
+                continue
+            self._keys[stop_id] = key
+            board = self._boards[stop_id] = self._render(stop_id, arrivals, now)
+            changed.append(board)
+
+        for stop_id in [s for s in self._boards if s not in index]:
+            del self._boards[stop_id]
+            del self._keys[stop_id]
+            changed.append(self._render(stop_id, [], now))
+        return changed
+
+    def _render(self, stop_id, arrivals, now):
+        name = self.name(stop_id)
+        return DepartureBoard(
+            stop_id=stop_id,
+            name=name,
+            timestamp=now,
+            arrivals=arrivals,
+            text=render_departure_board(name, arrivals, now, self.name),
+        )
+
+
+@csp.node
+def departure_boards(
+    index: ts[StopArrivalIndex], num_trains: int = DEFAULT_NUM_TRAINS
+) -> csp.Outputs(cache=ts[DepartureBoardCache], changed=ts[[DepartureBoard]]):
+    """
+    Maintains the departure boards of every stop in a feed, as of engine time
+    Ticks the cache, to look boards up from, and the boards which changed, on every snapshot which changed any
+    """
+    with csp.state():
+        s_cache = DepartureBoardCache(num_trains)
+
+    changed = s_cache.update(index, to_epoch_seconds(csp.now()))
+    if changed:
+        csp.output(cache=s_cache, changed=changed)
+
+
+@csp.node
+def departure_board_at(boards: ts[[DepartureBoard]], stop_id: str) -> ts[DepartureBoard]:
+    """Ticks the board of one stop from the changed boards of departure_boards, whenever it changes"""
+    for board in boards:
+        if board.stop_id == stop_id:
+            csp.output(board)
+            break
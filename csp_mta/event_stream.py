@@ -0,0 +1,228 @@
+"""
+Streaming csp updates, such as departure boards, alerts and outages, to many clients over Server-Sent Events.
+
+An EventStreamServer serves GET /events on a background asyncio thread, and EventStreamOutputAdapter publishes a
+time series to it under a topic. Each update is serialized to an SSE event once, on the engine thread, and the
+same bytes are handed to every client; the engine thread never waits on a client.
+
+Updates are keyed, e.g. departure boards by stop_id, and each client holds at most one pending update per key:
+a newer update replaces an older one which the client has not been sent yet, so a slow client gets the latest
+state rather than a growing backlog. A client which falls behind on more than queue_size keys is disconnected;
+on (re)connecting, every client is first sent the latest update of each key it subscribes to.
+
+Clients subscribe with query parameters, e.g. /events?topic=boards&key=G22&key=L10; with no topic they get every
+topic, and with no key every key.
+"""
+
+import asyncio
+import json
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import csp
+from csp import ts
+from csp.impl.outputadapter import OutputAdapter
+from csp.impl.wiring import py_output_adapter_def
+
+from ._http_server import HTTPServerThread, read_request
+
+__all__ = (
+    "EventStreamServer",
+    "EventStreamOutputAdapter",
+)
+
+_EVENTS_PATH = "/events"
+_HEADERS = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/event-stream\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Connection: keep-alive\r\n"
+    b"\r\n"
+)
+_KEEPALIVE = b": keepalive\n\n"
+
+
+def _serialize(value):
+    if isinstance(value, csp.Struct):
+        return value.to_json()
+    if isinstance(value, list) and all(isinstance(v, csp.Struct) for v in value):
+        return "[" + ",".join(v.to_json() for v in value) + "]"
+    return json.dumps(value)
+
+
+class _Client:
+    __slots__ = ("topics", "keys", "pending", "wakeup", "writer")
+
+    def __init__(self, topics, keys, writer):
+        self.topics = topics
+        self.keys = keys
+        self.pending = {}  # (topic, key) -> event, in the order they were first queued
+        self.wakeup = asyncio.Event()
+        self.writer = writer
+
+    def subscribes(self, topic, key):
+        return (self.topics is None or topic in self.topics) and (
+            self.keys is None or key in self.keys
+        )
+
+
+class EventStreamServer(HTTPServerThread):
+    thread_name = "csp_mta-event-stream"
+
+    def __init__(self, host="127.0.0.1", port=8766, queue_size=1024, keepalive=15.0):
+        """Serves published updates to Server-Sent Events clients at /events
+
+        Args:
+            host (str): address to listen on
+            port (int): port to listen on, 0 for any free port
+            queue_size (int): most keys with an update pending for one client before it is disconnected
+            keepalive (float): seconds between comments sent to idle clients, to detect dropped connections
+
+        The server is started by the first EventStreamOutputAdapter to start, if it is not already running, and
+        keeps serving the latest updates after the graph has finished until stopped.
+        """
+        super().__init__(host, port)
+        self.queue_size = queue_size
+        self.keepalive = keepalive
+        self.num_published = 0
+        self.num_coalesced = 0
+        self.num_disconnected = 0
+        self._latest = {}  # (topic, key) -> event
+        self._clients = set()
+        self._sequence = 0
+        self._lock = threading.Lock()  # guards the event sequence, taken by publish
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}{_EVENTS_PATH}"
+
+    @property
+    def num_clients(self):
+        return len(self._clients)
+
+    def publish(self, topic, updates):
+        """
+        Publish (key, value) updates under a topic; values are serialized to JSON here, and sent from the server thread
+        Safe to call from any thread
+        """
+        events = []
+        with self._lock:
+            for key, value in updates:
+                self._sequence += 1
+                data = _serialize(value).replace("\n", "\ndata: ")
+                event = f"id: {self._sequence}\nevent: {topic}\ndata: {data}\n\n".encode()
+                events.append(((topic, key), event))
+            self.num_published += len(events)
+        loop = self._serving_loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._dispatch, events)
+            except RuntimeError:
+                # the server stopped in the meantime
+                pass
+
+    def _dispatch(self, events):
+        for item in events:
+            self._latest[item[0]] = item[1]
+        for client in list(self._clients):
+            pending = client.pending
+            for (topic, key), event in events:
+                if not client.subscribes(topic, key):
+                    continue
+                if (topic, key) in pending:
+                    self.num_coalesced += 1
+                pending[topic, key] = event
+            if len(pending) > self.queue_size:
+                self.num_disconnected += 1
+                self._disconnect(client)
+            elif pending:
+                client.wakeup.set()
+
+    def _disconnect(self, client):
+        self._clients.discard(client)
+        client.pending.clear()
+        # drop whatever is still buffered for the client rather than wait for it to be read
+        client.writer.transport.abort()
+        client.wakeup.set()
+
+    async def _handle(self, reader, writer):
+        method, target, _ = await read_request(reader)
+        if method is None:
+            return
+        target = urlsplit(target)
+        if method != "GET" or target.path != _EVENTS_PATH:
+            status = "405 Method Not Allowed" if method != "GET" else "404 Not Found"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode())
+            await writer.drain()
+            return
+
+        query = parse_qs(target.query)
+        topics = frozenset(query["topic"]) if "topic" in query else None
+        keys = frozenset(query["key"]) if "key" in query else None
+        client = _Client(topics, keys, writer)
+        # the latest state first, then updates as they are published
+        snapshot = [e for (t, k), e in self._latest.items() if client.subscribes(t, k)]
+        self._clients.add(client)
+        try:
+            writer.write(_HEADERS + b"".join(snapshot))
+            await writer.drain()
+
+            while client in self._clients:
+                try:
+                    await asyncio.wait_for(client.wakeup.wait(), self.keepalive)
+                except asyncio.TimeoutError:
+                    writer.write(_KEEPALIVE)
+                    await writer.drain()
+                    continue
+                client.wakeup.clear()
+                if not client.pending:
+                    continue
+                events, client.pending = client.pending, {}
+                writer.write(b"".join(events.values()))
+                # updates published while the client catches up are coalesced into its pending updates
+                await writer.drain()
+        finally:
+            self._clients.discard(client)
+
+    def _close(self):
+        for client in list(self._clients):
+            self._disconnect(client)
+        # and connections which have not subscribed yet
+        super()._close()
+
+
+class EventStreamAdapterImpl(OutputAdapter):
+    def __init__(self, server, topic, key):
+        """Implementation for the event stream output adapter
+
+        Args:
+            server (EventStreamServer): server to publish to
+            topic (str): SSE event name the updates are published under
+            key (str): field of each value its updates are keyed (and coalesced) by, e.g. stop_id. With a key, a
+                tick of a list publishes each of its elements, e.g. the changed boards ticked by departure_boards;
+                without one, each tick is published whole and replaces the last
+        """
+        super().__init__()
+        self._server = server
+        self._topic = topic
+        self._key = key
+
+    def start(self):
+        self._server.start()
+
+    def on_tick(self, time, value):
+        if not self._key:
+            self._server.publish(self._topic, [("", value)])
+            return
+        values = value if isinstance(value, list) else [value]
+        self._server.publish(self._topic, [(str(getattr(v, self._key)), v) for v in values])
+
+
+EventStreamOutputAdapter = py_output_adapter_def(
+    name="EventStreamOutputAdapter",
+    adapterimpl=EventStreamAdapterImpl,
+    input=ts["T"],
+    server=EventStreamServer,
+    topic=str,
+    key=(str, ""),
+)
@@ -0,0 +1,620 @@
+"""
+Process-wide polling engine shared by the realtime adapters.
+
+Rather than each adapter running its own thread and opening a fresh connection on every poll, all
+feeds are polled from a single asyncio event loop through one pooled, keep-alive httpx client.
+HTTP/2 is used when the optional `h2` package is installed.
+
+Polls are conditional (ETag/Last-Modified), and a snapshot that has not changed since the last poll
+is neither decoded nor delivered, unless a subscriber explicitly asks for keep-alive ticks.
+
+Polls are scheduled against each feed's publication cadence rather than a fixed sleep: the poller learns
+the interval between snapshots (from their version, e.g. the GTFS-rt header timestamp, or else from when
+changed content was first seen) and the delay before a published snapshot is served, and polls just after
+the next snapshot is expected. Failed polls are retried with jittered exponential backoff.
+
+Subscribers can also ask for PollMetrics on every poll, breaking down where the time went: the network
+phases of the request (from httpx's trace extension), decoding, and handing the snapshot to the engine.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import random
+import statistics
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+import csp
+
+from .mta_util import resolve_endpoint
+
+__all__ = (
+    "FeedStatus",
+    "PollMetrics",
+    "PublishCadence",
+    "FeedPoller",
+    "get_feed_poller",
+)
+
+_logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = 16
+# Keep idle connections alive for longer than a poll interval so they are reused across polls
+KEEPALIVE_EXPIRY = 120.0
+REQUEST_TIMEOUT = 10.0
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Number of recent snapshots the publication cadence is learned from
+CADENCE_HISTORY = 16
+# The first poll for a snapshot is made this fraction of the serving lag after it is published, so that the lag
+# estimate can tighten; at most one such early poll is made per snapshot, then the next is at the learned lag
+LAG_PROBE = 0.5
+# First re-poll interval while an expected snapshot is overdue, doubling on every poll up to the publish interval
+OVERDUE_RETRY_INTERVAL = 1.0
+MIN_POLL_INTERVAL = 1.0
+BACKOFF_INITIAL = 1.0
+BACKOFF_MAX = 120.0
+
+
+def _utc_datetime(t):
+    return datetime.fromtimestamp(t, timezone.utc).replace(tzinfo=None)
+
+
+def _retry_after(error):
+    """Seconds a server asked us to wait before retrying, if it did"""
+    if isinstance(error, httpx.HTTPStatusError):
+        retry_after = error.response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after)
+    return None
+
+
+class FeedStatus(csp.Struct):
+    """Health of a polled endpoint; unset fields have not been observed yet"""
+
+    endpoint: str
+    last_poll_time: datetime  # last successful poll
+    last_change_time: datetime  # when the latest snapshot was first seen
+    publish_time: datetime  # publication time of the latest snapshot, from its version if it has one
+    publish_interval: timedelta  # learned interval between snapshots
+    staleness: timedelta  # age of the latest snapshot
+    consecutive_failures: int
+    last_error: str
+
+
+class PollMetrics(csp.Struct):
+    """Timings of one poll of an endpoint, in seconds; unset fields did not apply to the poll"""
+
+    endpoint: str
+    poll_time: datetime  # when the request was sent
+    status_code: int
+    changed: bool  # a new snapshot was served
+    # opening a connection, including DNS resolution (which httpx does not time separately); 0 if one was reused
+    connect_time: float
+    tls_time: float  # TLS handshake, 0 if a connection was reused
+    wait_time: float  # from sending the request to receiving the response headers
+    transfer_time: float  # receiving the response body
+    total_time: float  # the whole request
+    payload_bytes: int
+    decode_time: float  # decoding a new snapshot, over all distinct decoders
+    entity_count: int  # entities (or records) in the decoded snapshot
+    staleness: float  # age of the latest snapshot when the poll completed, i.e. now - header.timestamp
+    push_delay: float  # from receiving a new snapshot to handing it to every subscriber, excluding decode_time
+    error: str
+
+
+class _PollTrace:
+    """httpx trace extension callback recording when each phase of a request started and completed"""
+
+    def __init__(self):
+        self.events = {}
+
+    async def __call__(self, event_name, info):
+        # e.g. connection.connect_tcp.started, http11.receive_response_body.complete
+        self.events[event_name.split(".", 1)[1]] = time.perf_counter()
+
+    def span(self, phase):
+        started = self.events.get(phase + ".started")
+        completed = self.events.get(phase + ".complete")
+        if started is None or completed is None:
+            return 0.0
+        return completed - started
+
+    def between(self, start, end):
+        if start not in self.events or end not in self.events:
+            return 0.0
+        return self.events[end] - self.events[start]
+
+
+def _entity_count(value):
+    entity = getattr(value, "entity", None)
+    if entity is not None:
+        return len(entity)
+    if isinstance(value, dict):
+        return len(value.get("entity", ()))
+    if isinstance(value, list):
+        return len(value)
+    return None
+
+
+class PublishCadence:
+    """
+    Learns when a feed publishes from the snapshots seen so far
+
+    Each observation is the snapshot's publication time and the time it was first seen, both in epoch
+    seconds. The publish interval is the median gap between consecutive snapshots, which is robust to
+    a missed snapshot doubling one gap, and the serving lag is the smallest delay seen between
+    publication and first sight. Note the interval can only be learned down to the polling interval.
+    """
+
+    def __init__(self):
+        self._publish_times = deque(maxlen=CADENCE_HISTORY)
+        self._lags = deque(maxlen=CADENCE_HISTORY)
+        # polls scheduled since the latest snapshot was first seen
+        self._polls = 0
+
+    def observe(self, publish_time, seen_time):
+        if self._publish_times and publish_time <= self._publish_times[-1]:
+            return
+        self._publish_times.append(publish_time)
+        self._lags.append(max(seen_time - publish_time, 0.0))
+        self._polls = 0
+
+    @property
+    def last_publish_time(self):
+        return self._publish_times[-1] if self._publish_times else None
+
+    @property
+    def interval(self):
+        """Learned interval between snapshots in seconds, or None until there are two gaps to go on"""
+        if len(self._publish_times) < 3:
+            return None
+        times = self._publish_times
+        return statistics.median(b - a for a, b in zip(times, list(times)[1:]))
+
+    @property
+    def lag(self):
+        return min(self._lags) if self._lags else 0.0
+
+    def next_poll_time(self, now):
+        """
+        Epoch time to poll at to see the next snapshot soon after it is served, or None if not yet known
+        Each call schedules one poll: one early probe, one at the expected serving time, then exponentially
+        backed-off re-polls while the snapshot is overdue
+        """
+        interval = self.interval
+        if interval is None:
+            return None
+        published = self.last_publish_time + interval
+        served = published + self.lag
+        polls = self._polls
+        self._polls += 1
+        if polls == 0 and now < published + self.lag * LAG_PROBE:
+            return published + self.lag * LAG_PROBE
+        if now < served:
+            return served
+        # the snapshot is late, or was missed: keep checking for it, less and less often
+        return now + min(OVERDUE_RETRY_INTERVAL * 2 ** max(polls - 1, 0), interval)
+
+
+class FeedSubscription:
+    """Handle returned by FeedPoller.subscribe, used to unsubscribe"""
+
+    def __init__(
+        self,
+        endpoint,
+        interval,
+        callback,
+        decoder,
+        version,
+        tick_unchanged,
+        timeout,
+        metrics_callback,
+    ):
+        self.endpoint = endpoint
+        self.interval = interval
+        self.callback = callback
+        self.decoder = decoder
+        self.version = version
+        self.tick_unchanged = tick_unchanged
+        self.timeout = timeout
+        self.metrics_callback = metrics_callback
+
+
+class _Feed:
+    """Polling state for one endpoint, shared by all of its subscriptions"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.subscriptions = []
+        self.task = None
+        self.content = None
+        self.content_version = None
+        self.etag = None
+        self.last_modified = None
+        # decoder -> decoded value of the latest content
+        self.decoded = {}
+        self.cadence = PublishCadence()
+        self.last_poll_time = None
+        self.last_change_time = None
+        self.consecutive_failures = 0
+        self.last_error = None
+
+    @property
+    def interval(self):
+        return min(s.interval for s in self.subscriptions)
+
+    @property
+    def timeout(self):
+        timeouts = [s.timeout for s in self.subscriptions if s.timeout is not None]
+        return min(timeouts) if timeouts else None
+
+    @property
+    def version(self):
+        return next((s.version for s in self.subscriptions if s.version), None)
+
+    def update(self, content, seen_time):
+        """Store newly fetched content, returning False if it is the same snapshot as before"""
+        if content == self.content:
+            return False
+        version = None
+        if self.version is not None:
+            try:
+                version = self.version(content)
+            except Exception:
+                _logger.exception(f"Failed to read snapshot version from {self.endpoint}")
+            if version is not None and version == self.content_version:
+                return False
+        self.content = content
+        self.content_version = version
+        self.decoded = {}
+        self.last_change_time = seen_time
+        # a numeric version is taken to be the publication time, e.g. a GTFS-rt header timestamp
+        if isinstance(version, (int, float)) and version > 0:
+            self.cadence.observe(version, seen_time)
+        else:
+            self.cadence.observe(seen_time, seen_time)
+        return True
+
+    def next_poll_delay(self, now):
+        """Seconds to wait before the next poll after a successful one"""
+        interval = self.interval
+        poll_time = self.cadence.next_poll_time(now)
+        if poll_time is None:
+            return interval
+        # never poll less often than the subscriptions asked for
+        return min(max(poll_time - now, MIN_POLL_INTERVAL), interval)
+
+    def backoff_delay(self, retry_after=None):
+        """Seconds to wait before retrying after consecutive_failures failed polls"""
+        delay = min(BACKOFF_INITIAL * 2 ** (self.consecutive_failures - 1), BACKOFF_MAX)
+        delay = random.uniform(delay / 2, delay)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def status(self, now):
+        status = FeedStatus(
+            endpoint=self.endpoint,
+            consecutive_failures=self.consecutive_failures,
+        )
+        if self.last_poll_time is not None:
+            status.last_poll_time = _utc_datetime(self.last_poll_time)
+        if self.last_change_time is not None:
+            status.last_change_time = _utc_datetime(self.last_change_time)
+        publish_time = self.cadence.last_publish_time
+        if publish_time is not None:
+            status.publish_time = _utc_datetime(publish_time)
+            status.staleness = timedelta(seconds=max(now - publish_time, 0.0))
+        if self.cadence.interval is not None:
+            status.publish_interval = timedelta(seconds=self.cadence.interval)
+        if self.last_error is not None:
+            status.last_error = self.last_error
+        return status
+
+    def request_headers(self):
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class FeedPoller:
+    def __init__(self, max_connections=MAX_CONNECTIONS, timeout=REQUEST_TIMEOUT):
+        """Polls HTTP endpoints on a single background event loop
+
+        Each endpoint is fetched once per cycle no matter how many subscriptions it has, and each
+        distinct decoder runs once per fetch; every subscriber receives the same decoded object.
+
+        Args:
+            max_connections (int): upper bound on the number of pooled connections
+            timeout (float): per-request timeout in seconds
+        """
+        self._max_connections = max_connections
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._feeds = {}
+        self._num_subscriptions = 0
+
+    def subscribe(
+        self,
+        endpoint,
+        interval,
+        callback,
+        decoder=None,
+        version=None,
+        tick_unchanged=False,
+        timeout=None,
+        metrics_callback=None,
+    ):
+        """Poll an endpoint at least every interval seconds, calling callback(decoder(content)) on the poller thread
+
+        Subscriptions sharing an endpoint and an (equal) decoder share both the fetch and the
+        decoded object, which must therefore be treated as read-only. Without a decoder the raw
+        response bytes are passed. A new subscription receives the latest snapshot immediately if
+        the endpoint is already being polled. Returns a FeedSubscription to pass to unsubscribe.
+
+        A poll is treated as unchanged if the server answers 304, if the payload is byte-identical
+        to the previous one, or if version(content) equals the previous snapshot's version (e.g. a
+        feed timestamp). Unchanged snapshots are only re-delivered if tick_unchanged is set. A
+        numeric version is also used as the snapshot's publication time to schedule polls.
+
+        timeout overrides the poller's request timeout for this endpoint; the smallest one asked
+        for by its subscriptions applies.
+
+        If given, metrics_callback(PollMetrics) is called after every poll of the endpoint, whether it
+        succeeded or not. callback may be None to only receive metrics: the decoder, if given, is then only
+        run when no other subscription decodes the snapshot, so that the metrics still count its entities.
+
+        MTA endpoints are polled from the overridden API base URL if one is set, see set_api_base.
+        """
+        subscription = FeedSubscription(
+            resolve_endpoint(endpoint),
+            interval,
+            callback,
+            decoder,
+            version,
+            tick_unchanged,
+            timeout,
+            metrics_callback,
+        )
+        with self._lock:
+            if self._loop is None:
+                self._start_loop()
+            asyncio.run_coroutine_threadsafe(
+                self._add(subscription), self._loop
+            ).result()
+            self._num_subscriptions += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop polling for a subscription; no callbacks are made for it once this returns"""
+        with self._lock:
+            if self._loop is None:
+                return
+            removed = asyncio.run_coroutine_threadsafe(
+                self._remove(subscription), self._loop
+            ).result()
+            if removed:
+                self._num_subscriptions -= 1
+                if not self._num_subscriptions:
+                    self._stop_loop()
+
+    def status(self):
+        """Returns a FeedStatus for each endpoint being polled"""
+        with self._lock:
+            if self._loop is None:
+                return []
+            return asyncio.run_coroutine_threadsafe(
+                self._status(), self._loop
+            ).result()
+
+    async def _status(self):
+        now = time.time()
+        return [feed.status(now) for feed in self._feeds.values()]
+
+    def _start_loop(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="csp_mta-feed-poller", daemon=True
+        )
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._open_client(), self._loop).result()
+
+    def _stop_loop(self):
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+        self._client = None
+
+    async def _open_client(self):
+        self._client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=self._timeout,
+            limits=httpx.Limits(
+                max_connections=self._max_connections,
+                max_keepalive_connections=self._max_connections,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+        )
+
+    async def _add(self, subscription):
+        feed = self._feeds.get(subscription.endpoint)
+        if feed is None:
+            feed = self._feeds[subscription.endpoint] = _Feed(subscription.endpoint)
+            feed.subscriptions.append(subscription)
+            feed.task = asyncio.create_task(self._poll(feed))
+        else:
+            feed.subscriptions.append(subscription)
+            if feed.content is not None:
+                self._publish(feed, [subscription])
+
+    async def _remove(self, subscription):
+        feed = self._feeds.get(subscription.endpoint)
+        if feed is None or subscription not in feed.subscriptions:
+            return False
+        feed.subscriptions.remove(subscription)
+        if not feed.subscriptions:
+            del self._feeds[feed.endpoint]
+            feed.task.cancel()
+            try:
+                await feed.task
+            except asyncio.CancelledError:
+                pass
+        return True
+
+    def _publish(self, feed, subscriptions):
+        """Deliver the latest snapshot, returning the time spent decoding it, or None if nothing was decoded"""
+        decode_time = None
+        for subscription in subscriptions:
+            if subscription.callback is None:
+                continue
+            decoder = subscription.decoder
+            if decoder not in feed.decoded:
+                decode_time = (decode_time or 0.0) + self._decode(feed, decoder)
+            value = feed.decoded[decoder]
+            if value is None:
+                continue
+            try:
+                subscription.callback(value)
+            except Exception:
+                _logger.exception(f"Error handling feed from {feed.endpoint}")
+
+        # metrics-only subscriptions decode only if no other subscription did, so that the entity count is known
+        if all(decoder is None for decoder in feed.decoded):
+            decoder = next(
+                (s.decoder for s in subscriptions if s.callback is None and s.decoder is not None),
+                None,
+            )
+            if decoder is not None:
+                decode_time = (decode_time or 0.0) + self._decode(feed, decoder)
+        return decode_time
+
+    def _decode(self, feed, decoder):
+        """Decode the latest snapshot into feed.decoded, returning the time it took"""
+        start = time.perf_counter()
+        try:
+            feed.decoded[decoder] = decoder(feed.content) if decoder is not None else feed.content
+        except Exception:
+            _logger.exception(f"Failed to decode feed from {feed.endpoint}")
+            feed.decoded[decoder] = None
+        return time.perf_counter() - start
+
+    async def _fetch(self, feed, trace=None):
+        """Poll an endpoint once, returning the response and whether it served a new snapshot"""
+        timeout = feed.timeout
+        response = await self._client.get(
+            feed.endpoint,
+            headers=feed.request_headers(),
+            timeout=timeout if timeout is not None else self._timeout,
+            extensions={"trace": trace} if trace is not None else None,
+        )
+        if response.status_code == httpx.codes.NOT_MODIFIED:
+            return response, False
+        response.raise_for_status()
+        feed.etag = response.headers.get("ETag")
+        feed.last_modified = response.headers.get("Last-Modified")
+        return response, feed.update(response.content, time.time())
+
+    async def _poll(self, feed):
+        while True:
+            metrics_subscriptions = [
+                s for s in feed.subscriptions if s.metrics_callback is not None
+            ]
+            trace = _PollTrace() if metrics_subscriptions else None
+            poll_time = time.time()
+            start = time.perf_counter()
+            try:
+                response, changed = await self._fetch(feed, trace)
+            except Exception as e:
+                # any failure is retried; the task must only end when the feed is unsubscribed
+                feed.consecutive_failures += 1
+                feed.last_error = repr(e)
+                _logger.warning(
+                    f"Failed to poll {feed.endpoint} ({feed.consecutive_failures} in a row): {e!r}"
+                )
+                if metrics_subscriptions:
+                    metrics = self._metrics(feed, poll_time, start, trace, error=e)
+                    self._publish_metrics(feed, metrics_subscriptions, metrics)
+                await asyncio.sleep(feed.backoff_delay(_retry_after(e)))
+                continue
+
+            received = time.perf_counter()
+            feed.consecutive_failures = 0
+            feed.last_poll_time = time.time()
+            decode_time = None
+            if changed:
+                decode_time = self._publish(feed, list(feed.subscriptions))
+            elif feed.content is not None:
+                self._publish(feed, [s for s in feed.subscriptions if s.tick_unchanged])
+            if metrics_subscriptions:
+                metrics = self._metrics(feed, poll_time, start, trace, response, changed)
+                if changed:
+                    if decode_time is not None:
+                        metrics.decode_time = decode_time
+                    # decoding is timed on its own, and interleaved with the pushes to subscribers
+                    metrics.push_delay = time.perf_counter() - received - (decode_time or 0.0)
+                    counts = (_entity_count(v) for v in feed.decoded.values() if v is not None)
+                    count = next((c for c in counts if c is not None), None)
+                    if count is not None:
+                        metrics.entity_count = count
+                self._publish_metrics(feed, metrics_subscriptions, metrics)
+            await asyncio.sleep(feed.next_poll_delay(time.time()))
+
+    def _metrics(self, feed, poll_time, start, trace, response=None, changed=False, error=None):
+        metrics = PollMetrics(
+            endpoint=feed.endpoint,
+            poll_time=_utc_datetime(poll_time),
+            changed=changed,
+            connect_time=trace.span("connect_tcp"),
+            tls_time=trace.span("start_tls"),
+            wait_time=trace.between(
+                "send_request_headers.started", "receive_response_headers.complete"
+            ),
+            transfer_time=trace.span("receive_response_body"),
+            total_time=time.perf_counter() - start,
+        )
+        if response is not None:
+            metrics.status_code = response.status_code
+            metrics.payload_bytes = len(response.content)
+        elif isinstance(error, httpx.HTTPStatusError):
+            metrics.status_code = error.response.status_code
+        if error is not None:
+            metrics.error = repr(error)
+        publish_time = feed.cadence.last_publish_time
+        if publish_time is not None:
+            metrics.staleness = max(time.time() - publish_time, 0.0)
+        return metrics
+
+    def _publish_metrics(self, feed, subscriptions, metrics):
+        for subscription in subscriptions:
+            try:
+                subscription.metrics_callback(metrics)
+            except Exception:
+                _logger.exception(f"Error handling poll metrics from {feed.endpoint}")
+
+
+_POLLER = None
+_POLLER_LOCK = threading.Lock()
+
+
+def get_feed_poller():
+    """Returns the process-wide FeedPoller used by the realtime adapters"""
+    global _POLLER
+    with _POLLER_LOCK:
+        if _POLLER is None:
+            _POLLER = FeedPoller()
+        return _POLLER
@@ -0,0 +1,205 @@
+"""
+Selective decoding of GTFS-rt feeds.
+
+A FeedSelection declares the routes, stops and entity types a consumer needs, and decodes a feed into a
+FeedMessage holding only those entities. Entities are selected on the wire, before parsing: the feed is split
+into its top-level fields by reading just their tags and lengths, and each entity is matched by searching its
+bytes for the encoded route_id and stop_id fields with one precompiled regular expression, so entities which are not selected are never parsed nor
+turned into Python objects. Consumers which then iterate over the feed, such as StopArrivalIndex, only do so
+over the selected entities.
+
+Matching on encoded fields can very rarely let through an entity which merely contains the same bytes;
+it never drops an entity which should be selected.
+"""
+
+import re
+
+from .compiled_protobuf.gtfs_realtime_pb2 import FeedMessage
+
+__all__ = ("FeedSelection",)
+
+# wire format tags (field number << 3 | wire type) of the fields matched on
+_LENGTH_DELIMITED = 2
+_FEED_HEADER = 1
+_FEED_ENTITY = 2
+_ENTITY_TYPES = {3: "trip_update", 4: "vehicle", 5: "alert"}
+_TRIP = 1  # TripUpdate.trip and VehiclePosition.trip
+_TRIP_ID = 1  # TripDescriptor.trip_id
+_ROUTE_ID_TAGS = b"\x2a"  # TripDescriptor.route_id = 5
+_ALERT_ROUTE_ID_TAGS = b"\x12"  # EntitySelector.route_id = 2
+_STOP_ID_TAGS = (
+    b"\x22"  # StopTimeUpdate.stop_id = 4
+    b"\x3a"  # VehiclePosition.stop_id = 7
+    b"\x2a"  # EntitySelector.stop_id = 5
+)
+
+
+def _varint(buf, pos):
+    b = buf[pos]
+    if b < 0x80:
+        return b, pos + 1
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        result |= (b & 0x7F) << shift
+        pos += 1
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(buf, pos, end):
+    """(field number, tag start, value start, value end) of each length-delimited field in buf[pos:end]"""
+    while pos < end:
+        start = pos
+        key = buf[pos]
+        if key < 0x80:
+            pos += 1
+        else:
+            key, pos = _varint(buf, pos)
+        wire_type = key & 7
+        if wire_type == _LENGTH_DELIMITED:
+            length = buf[pos]
+            if length < 0x80:
+                pos += 1
+            else:
+                length, pos = _varint(buf, pos)
+            yield key >> 3, start, pos, pos + length
+            pos += length
+        elif wire_type == 0:
+            _, pos = _varint(buf, pos)
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 5:
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type} in GTFS-rt feed")
+
+
+def _field(buf, pos, end, number):
+    """(value start, value end) of the first length-delimited field with the given number, or None"""
+    for field, _, start, stop in _fields(buf, pos, end):
+        if field == number:
+            return start, stop
+    return None
+
+
+def _encode_varint(n):
+    encoded = bytearray()
+    while n >= 0x80:
+        encoded.append(n & 0x7F | 0x80)
+        n >>= 7
+    encoded.append(n)
+    return bytes(encoded)
+
+
+def _encoded(tags, values):
+    """Pattern matching any of the values encoded as a field with one of the tags"""
+    values = sorted((v.encode() for v in values), key=len, reverse=True)
+    alternatives = b"|".join(re.escape(_encode_varint(len(v)) + v) for v in values)
+    return re.compile(b"[" + re.escape(tags) + b"](?:" + alternatives + b")")
+
+
+class FeedSelection:
+    def __init__(
+        self,
+        route_ids=None,
+        stop_ids=None,
+        entity_types=("trip_update", "vehicle", "alert"),
+    ):
+        """Decodes only the entities of a GTFS-rt feed which a subscriber needs
+
+        Args:
+            route_ids (list): if given, only entities of trips on (or alerts informing) these routes
+            stop_ids (list): if given, only trip updates calling at one of these stops, the vehicle positions of
+                those trips, and alerts informing the stops. Parent stations (e.g. 635) select both platforms
+            entity_types (list): entity types to keep, any of trip_update, vehicle and alert
+
+        Selections are immutable and compare equal when configured alike, so realtime adapters with the same
+        selection share one decode per poll.
+        """
+        self.route_ids = frozenset(route_ids) if route_ids is not None else None
+        self.stop_ids = frozenset(stop_ids) if stop_ids is not None else None
+        self.entity_types = frozenset(entity_types)
+        unknown = self.entity_types - set(_ENTITY_TYPES.values())
+        if unknown:
+            raise ValueError(f"Unknown entity types {sorted(unknown)}")
+
+        self._types = {k for k, v in _ENTITY_TYPES.items() if v in self.entity_types}
+        self._routes = None
+        self._alert_routes = None
+        if self.route_ids is not None:
+            self._routes = _encoded(_ROUTE_ID_TAGS, self.route_ids)
+            self._alert_routes = _encoded(_ALERT_ROUTE_ID_TAGS, self.route_ids)
+        self._stops = None
+        if self.stop_ids is not None:
+            platforms = set(self.stop_ids)
+            for stop_id in self.stop_ids:
+                platforms.update((stop_id + "N", stop_id + "S"))
+            self._stops = _encoded(_STOP_ID_TAGS, platforms)
+
+    def _key(self):
+        return self.route_ids, self.stop_ids, self.entity_types
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash((type(self), self._key()))
+
+    def __repr__(self):
+        return (
+            f"FeedSelection(route_ids={self.route_ids}, stop_ids={self.stop_ids}, "
+            f"entity_types={sorted(self.entity_types)})"
+        )
+
+    def _trip_id(self, content, start, end):
+        trip = _field(content, start, end, _TRIP)
+        if trip is None:
+            return None
+        trip_id = _field(content, trip[0], trip[1], _TRIP_ID)
+        return content[trip_id[0] : trip_id[1]] if trip_id is not None else None
+
+    def select(self, content):
+        """The raw bytes of a FeedMessage holding the header and the selected entities of content"""
+        selected = []
+        trips = set()
+        vehicles = []
+        for field, tag_start, start, end in _fields(content, 0, len(content)):
+            if field == _FEED_HEADER:
+                selected.append(content[tag_start:end])
+                continue
+            if field != _FEED_ENTITY:
+                continue
+            for entity_type, _, value_start, value_end in _fields(content, start, end):
+                if entity_type in _ENTITY_TYPES:
+                    break
+            else:
+                continue
+            if entity_type not in self._types:
+                continue
+
+            routes = self._alert_routes if entity_type == 5 else self._routes
+            if routes is not None and not routes.search(content, value_start, value_end):
+                continue
+            if entity_type == 4 and self._stops is not None:
+                # vehicles are kept if their trip is, which is only known once all trip updates are seen
+                vehicles.append((tag_start, value_start, value_end, end))
+                continue
+            if self._stops is not None and not self._stops.search(
+                content, value_start, value_end
+            ):
+                continue
+            if entity_type == 3 and self._stops is not None and 4 in self._types:
+                trips.add(self._trip_id(content, value_start, value_end))
+            selected.append(content[tag_start:end])
+
+        for tag_start, value_start, value_end, end in vehicles:
+            if self._trip_id(content, value_start, value_end) in trips or self._stops.search(
+                content, value_start, value_end
+            ):
+                selected.append(content[tag_start:end])
+        return b"".join(selected)
+
+    def __call__(self, content):
+        return FeedMessage.FromString(self.select(content))
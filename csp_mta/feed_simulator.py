@@ -0,0 +1,208 @@
+"""
+Local stand-in for the MTA's realtime API, serving recorded feed snapshots for load and latency testing.
+
+Each recording is served at the path of its service's endpoint, e.g. /Dataservice/mtagtfsfeeds/nyct%2Fgtfs-g,
+stepping through its snapshots at the recorded cadence, or faster with speed > 1. Responses carry an ETag and
+conditional requests get 304 Not Modified, as from the real feeds, and latency and 503 errors (optionally with
+Retry-After) can be injected.
+The same feeds are also served under /replica/<n>/... for any n, to simulate many more feeds than were recorded.
+
+Point the adapters at a running simulator with set_api_base(simulator.url) or CSP_MTA_API_BASE.
+"""
+
+import asyncio
+import bisect
+import os
+import random
+import time
+from urllib.parse import urlsplit
+
+from ._http_server import HTTPServerThread, read_request
+from .compiled_protobuf.gtfs_realtime_pb2 import FeedMessage
+from .mta_util import LINE_TO_ENDPOINT
+from .recording import iter_recording
+
+__all__ = ("FeedSimulator",)
+
+_REPLICA_PREFIX = "/replica/"
+
+
+class _RecordedFeed:
+    """The distinct snapshots of a recording, with their times relative to the first"""
+
+    def __init__(self, filename):
+        self.times = []
+        self.contents = []
+        start = None
+        for snapshot_time, content in iter_recording(filename):
+            if self.contents and content == self.contents[-1]:
+                continue
+            t = snapshot_time.timestamp()
+            if start is None:
+                start = t
+            self.times.append(t - start)
+            self.contents.append(content)
+        if not self.contents:
+            raise ValueError(f"Recording {filename} has no snapshots")
+        # when looping, the first snapshot comes round again one typical interval after the last
+        gaps = sorted(b - a for a, b in zip(self.times, self.times[1:]))
+        self.period = self.times[-1] + (gaps[len(gaps) // 2] if gaps else 30.0)
+        self._cached = (None, None)
+
+    def snapshot(self, elapsed, loop):
+        """(cycle, index) of the snapshot current elapsed recorded seconds into the replay"""
+        cycle = 0
+        if loop:
+            cycle, elapsed = divmod(elapsed, self.period)
+        return int(cycle), bisect.bisect_right(self.times, elapsed) - 1
+
+    def content(self, cycle, index, timestamp):
+        """The snapshot's content, with its header timestamp rewritten if one is given"""
+        if timestamp is None:
+            return self.contents[index]
+        key, content = self._cached
+        if key != (cycle, index):
+            feed = FeedMessage()
+            feed.ParseFromString(self.contents[index])
+            feed.header.timestamp = timestamp
+            content = feed.SerializeToString()
+            self._cached = ((cycle, index), content)
+        return content
+
+
+class FeedSimulator(HTTPServerThread):
+    thread_name = "csp_mta-feed-simulator"
+
+    def __init__(
+        self,
+        recordings,
+        speed=1.0,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        retry_after=None,
+        seed=None,
+        loop=True,
+        retime=True,
+        host="127.0.0.1",
+        port=8765,
+    ):
+        """Serves recorded GTFS-rt snapshots over HTTP as if they were the live feeds
+
+        Args:
+            recordings (dict or list): service -> recording filename, or a list of recordings named as
+                record_data.py names them, e.g. G_20240421_1854.parquet
+            speed (float): recorded seconds replayed per second
+            latency (float): seconds to wait before answering each request
+            jitter (float): up to this many more seconds, at random, to wait before answering
+            error_rate (float): fraction of requests answered with 503 Service Unavailable
+            retry_after (int): if given, the 503 responses ask clients to retry after this many seconds
+            seed (int): seed for the random jitter and errors
+            loop (bool): start each recording over once it ends, rather than serving its last snapshot
+            retime (bool): rewrite each snapshot's header timestamp to the time it was published by the
+                simulator, so that staleness is measured against the accelerated cadence. Pollers cannot learn
+                a cadence faster than their subscription interval, which is MTA_FEED_UPDATE_TIME for the GTFS-rt
+                adapters: to see every snapshot at speed > 1, subscribe with FeedPoller.subscribe and a shorter
+                interval
+            host (str): address to listen on
+            port (int): port to listen on, 0 for any free port
+        """
+        if not isinstance(recordings, dict):
+            recordings = {
+                os.path.basename(filename).split("_")[0]: filename
+                for filename in recordings
+            }
+        self._feeds = {}
+        for service, filename in recordings.items():
+            if service not in LINE_TO_ENDPOINT:
+                raise ValueError(f"Unknown service {service} for recording {filename}")
+            self._feeds[urlsplit(LINE_TO_ENDPOINT[service]).path] = _RecordedFeed(
+                filename
+            )
+
+        super().__init__(host, port)
+        self.speed = speed
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.loop = loop
+        self.retime = retime
+        self.num_requests = 0
+        self.num_not_modified = 0
+        self.num_errors = 0
+        self._random = random.Random(seed)
+        self._start_time = None
+
+    @property
+    def url(self):
+        """Base URL to poll the simulator at, see set_api_base"""
+        return f"http://{self.host}:{self.port}"
+
+    def _respond(self, path, etag):
+        """(status, headers, body) for a GET of path"""
+        if path.startswith(_REPLICA_PREFIX):
+            path = path[path.find("/", len(_REPLICA_PREFIX)) :]
+        feed = self._feeds.get(path)
+        if feed is None:
+            return 404, {}, b""
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.num_errors += 1
+            headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+            return 503, headers, b""
+
+        elapsed = (time.time() - self._start_time) * self.speed
+        cycle, index = feed.snapshot(elapsed, self.loop)
+        tag = f'"{cycle}-{index}"'
+        if etag == tag:
+            self.num_not_modified += 1
+            return 304, {"ETag": tag}, b""
+        timestamp = None
+        if self.retime:
+            timestamp = int(
+                self._start_time + (cycle * feed.period + feed.times[index]) / self.speed
+            )
+        return 200, {"ETag": tag}, feed.content(cycle, index, timestamp)
+
+    async def _handle(self, reader, writer):
+        while True:
+            method, target, headers = await read_request(reader)
+            if method is None:
+                break
+
+            self.num_requests += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            if delay:
+                await asyncio.sleep(delay)
+            if method == "GET":
+                status, response_headers, body = self._respond(
+                    urlsplit(target).path, headers.get("if-none-match")
+                )
+            else:
+                status, response_headers, body = 405, {}, b""
+
+            close = headers.get("connection", "").lower() == "close"
+            lines = [f"HTTP/1.1 {status} {_REASONS[status]}"]
+            lines += [f"{k}: {v}" for k, v in response_headers.items()]
+            lines.append(f"Content-Length: {len(body)}")
+            if status == 200:
+                lines.append("Content-Type: application/octet-stream")
+            if close:
+                lines.append("Connection: close")
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+            if close:
+                break
+
+    async def _serve(self, started, errors):
+        self._start_time = time.time()
+        await super()._serve(started, errors)
+
+
+_REASONS = {
+    200: "OK",
+    304: "Not Modified",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    503: "Service Unavailable",
+}
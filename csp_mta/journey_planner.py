@@ -0,0 +1,299 @@
+"""
+Realtime journey planning over the subway network.
+
+Stations and the transfers between them (transfers.csv) are compiled once into a CSR adjacency. Each feed
+snapshot replaces the live trips of its service only, indexed by the stations they call at, and
+"earliest arrival from A to B" queries are answered with RAPTOR: round k relaxes every trip boardable from a
+station improved in round k-1, then the footpath transfers out of the stations it improved, so round k finds the
+best journeys with k - 1 transfers.
+
+Planning is done at station level: platform stop_ids (e.g. 635N) are mapped to their parent station.
+"""
+
+import csp
+from csp import ts
+
+from .compiled_protobuf.gtfs_realtime_pb2 import FeedMessage
+from .mta_util import to_epoch_seconds
+from .reference_data import get_stop_info, get_transfer_info
+
+__all__ = (
+    "JourneyLeg",
+    "Journey",
+    "TransferGraph",
+    "JourneyPlanner",
+    "journey_planner",
+    "plan_journey",
+)
+
+# minimum time to change trains at a station without a transfer of its own to itself in transfers.csv
+DEFAULT_MIN_TRANSFER_TIME = 180
+_INF = float("inf")
+
+
+class JourneyLeg(csp.Struct):
+    trip_id: str  # empty for a transfer between stations
+    route_id: str  # empty for a transfer between stations
+    from_stop_id: str  # station stop_id
+    to_stop_id: str  # station stop_id
+    departure_time: int  # epoch seconds
+    arrival_time: int  # epoch seconds
+
+
+class Journey(csp.Struct):
+    origin: str
+    destination: str
+    departure_time: int  # epoch seconds, the time the query was made for
+    arrival_time: int  # epoch seconds
+    legs: [JourneyLeg]
+
+
+class TransferGraph:
+    """
+    Transfers between stations in CSR form: the transfers out of station code c are
+    targets[offsets[c]:offsets[c + 1]], taking times[offsets[c]:offsets[c + 1]] seconds
+
+    Transfers from a station to itself are kept apart, as the minimum time to change trains there
+    """
+
+    def __init__(self, stop_info, transfer_info):
+        num_stops = len(stop_info)
+        self.change_time = [DEFAULT_MIN_TRANSFER_TIME] * num_stops
+        adjacency = [[] for _ in range(num_stops)]
+        for src, dst, time in zip(
+            transfer_info.from_stop.tolist(),
+            transfer_info.to_stop.tolist(),
+            transfer_info.min_transfer_time.tolist(),
+        ):
+            if src == dst:
+                self.change_time[src] = time
+            else:
+                adjacency[src].append((dst, time))
+
+        self.offsets = [0] * (num_stops + 1)
+        self.targets = []
+        self.times = []
+        for code, edges in enumerate(adjacency):
+            for dst, time in sorted(edges):
+                self.targets.append(dst)
+                self.times.append(time)
+            self.offsets[code + 1] = len(self.targets)
+
+    def transfers(self, code):
+        start, end = self.offsets[code], self.offsets[code + 1]
+        return zip(self.targets[start:end], self.times[start:end])
+
+
+class _Trip:
+    __slots__ = ("trip_id", "route_id", "stops", "arrivals", "departures")
+
+    def __init__(self, trip_id, route_id, stops, arrivals, departures):
+        self.trip_id = trip_id
+        self.route_id = route_id
+        self.stops = stops  # station codes
+        self.arrivals = arrivals
+        self.departures = departures
+
+
+class _Timetable:
+    """The live trips of one service, with the (trip, position) pairs calling at each station"""
+
+    def __init__(self, timestamp, trips):
+        self.timestamp = timestamp
+        self.trips = trips
+        self.calls = {}
+        for i, trip in enumerate(trips):
+            for pos, code in enumerate(trip.stops):
+                self.calls.setdefault(code, []).append((i, pos))
+
+
+class JourneyPlanner:
+    """
+    Earliest arrival journeys over the live trips of any number of services
+    Call update(service, feed) as each service's feed ticks; the other services' trips are kept as they are
+    """
+
+    def __init__(self, stop_info=None, transfer_info=None):
+        self.stop_info = stop_info if stop_info is not None else get_stop_info()
+        if transfer_info is None:
+            transfer_info = get_transfer_info()
+        self.graph = TransferGraph(self.stop_info, transfer_info)
+        self._stations = {}
+        self._timetables = {}
+
+    def _station(self, stop_id):
+        """Station code of a stop_id, or -1 if it is not a known subway stop"""
+        code = self._stations.get(stop_id)
+        if code is None:
+            code = -1
+            if stop_id in self.stop_info:
+                code = self.stop_info.code(self.stop_info.parent_station(stop_id))
+            self._stations[stop_id] = code
+        return code
+
+    def update(self, service, feed):
+        """Replace the live trips of a service with those in a new feed snapshot"""
+        trips = []
+        for entity in feed.entity:
+            if not entity.HasField("trip_update"):
+                continue
+            trip_update = entity.trip_update
+            stops, arrivals, departures = [], [], []
+            for update in trip_update.stop_time_update:
+                code = self._station(update.stop_id)
+                # the first stop of a trip only has a departure time, and the last only an arrival time
+                arrival = update.arrival.time or update.departure.time
+                if code < 0 or not arrival:
+                    continue
+                stops.append(code)
+                arrivals.append(arrival)
+                departures.append(update.departure.time or arrival)
+            if len(stops) > 1:
+                trip = trip_update.trip
+                trips.append(
+                    _Trip(trip.trip_id, trip.route_id, stops, arrivals, departures)
+                )
+        self._timetables[service] = _Timetable(feed.header.timestamp, trips)
+
+    def services(self):
+        return self._timetables.keys()
+
+    def earliest_arrival(self, origin, destination, depart_time, max_transfers=3):
+        """
+        The journey from origin to destination leaving at or after depart_time (epoch seconds) which arrives
+        earliest, with at most max_transfers changes of train, or None if there is none in the live trips
+        """
+        src = self._station(origin)
+        dst = self._station(destination)
+        if src < 0 or dst < 0:
+            raise KeyError(f"Unknown stop_id {origin if src < 0 else destination}")
+
+        graph = self.graph
+        timetables = list(self._timetables.values())
+        best = {src: depart_time}
+        # per round, the station boarding times and the labels to rebuild journeys from
+        ready = {src: depart_time}
+        rides = [{}]
+        walks = [{}]
+        for target, time in graph.transfers(src):
+            arrival = depart_time + time
+            best[target] = ready[target] = arrival
+            walks[0][target] = (src, depart_time, arrival)
+
+        for _ in range(max_transfers + 1):
+            # board each trip at its first station reached in the previous round in time to catch it
+            boardings = {}
+            for code, ready_time in ready.items():
+                for t, timetable in enumerate(timetables):
+                    for i, pos in timetable.calls.get(code, ()):
+                        if timetable.trips[i].departures[pos] >= ready_time:
+                            key = (t, i)
+                            if boardings.get(key, pos) >= pos:
+                                boardings[key] = pos
+
+            round_rides = {}
+            for (t, i), pos in boardings.items():
+                trip = timetables[t].trips[i]
+                for j in range(pos + 1, len(trip.stops)):
+                    code = trip.stops[j]
+                    arrival = trip.arrivals[j]
+                    if arrival < best.get(code, _INF) and arrival < best.get(dst, _INF):
+                        best[code] = arrival
+                        round_rides[code] = (trip, pos, j)
+
+            ready = {
+                code: best[code] + graph.change_time[code] for code in round_rides
+            }
+            round_walks = {}
+            for code, (trip, _, j) in round_rides.items():
+                # walk on from the ride's arrival, not from best[code], which an earlier walk in this round may
+                # have lowered: walks are not chained, so every walk leg starts where a ride leg ends
+                departure = trip.arrivals[j]
+                for target, time in graph.transfers(code):
+                    arrival = departure + time
+                    if arrival < best.get(target, _INF) and arrival < best.get(dst, _INF):
+                        best[target] = ready[target] = arrival
+                        round_walks[target] = (code, departure, arrival)
+
+            rides.append(round_rides)
+            walks.append(round_walks)
+            if not ready:
+                break
+
+        if dst == src or dst not in best:
+            return None
+        return self._journey(origin, destination, depart_time, dst, rides, walks)
+
+    def _journey(self, origin, destination, depart_time, dst, rides, walks):
+        stop_ids = self.stop_info.stop_ids
+        # the last round to improve the destination holds its best label
+        k = max(k for k in range(len(rides)) if dst in rides[k] or dst in walks[k])
+        code = dst
+        legs = []
+        while True:
+            # a station's walk label beats its ride label in the same round, else it would not have been kept
+            if code in walks[k]:
+                prev, departure, arrival = walks[k][code]
+                legs.append(
+                    JourneyLeg(
+                        trip_id="",
+                        route_id="",
+                        from_stop_id=stop_ids[prev],
+                        to_stop_id=stop_ids[code],
+                        departure_time=departure,
+                        arrival_time=arrival,
+                    )
+                )
+                code = prev
+            if k == 0:
+                break
+            trip, pos, j = rides[k][code]
+            legs.append(
+                JourneyLeg(
+                    trip_id=trip.trip_id,
+                    route_id=trip.route_id,
+                    from_stop_id=stop_ids[trip.stops[pos]],
+                    to_stop_id=stop_ids[code],
+                    departure_time=trip.departures[pos],
+                    arrival_time=trip.arrivals[j],
+                )
+            )
+            code = trip.stops[pos]
+            k -= 1
+
+        legs.reverse()
+        return Journey(
+            origin=origin,
+            destination=destination,
+            departure_time=depart_time,
+            arrival_time=legs[-1].arrival_time,
+            legs=legs,
+        )
+
+
+@csp.node
+def journey_planner(feeds: {str: ts[FeedMessage]}) -> ts[JourneyPlanner]:
+    """
+    Keeps a JourneyPlanner up to date with the live trips of each service, keyed by service
+    The same planner ticks out whenever any service's feed ticks
+    """
+    with csp.state():
+        s_planner = JourneyPlanner()
+
+    for service, feed in feeds.tickeditems():
+        s_planner.update(service, feed)
+    return s_planner
+
+
+@csp.node
+def plan_journey(
+    planner: ts[JourneyPlanner], origin: str, destination: str, max_transfers: int = 3
+) -> ts[Journey]:
+    """
+    Returns the earliest arrival journey from origin to destination leaving at the current engine time
+    """
+    journey = planner.earliest_arrival(
+        origin, destination, to_epoch_seconds(csp.now()), max_transfers
+    )
+    if journey is not None:
+        return journey
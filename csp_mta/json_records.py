@@ -0,0 +1,209 @@
+"""
+Typed records for the MTA's JSON feeds: service alerts and elevator/escalator outages.
+
+Each payload is parsed in full, with `orjson` when it is installed, otherwise with the standard library.
+The decoders then filter records out before building them and pull out only the fields the records hold,
+so converting fields and building records scales with what is consumed; parsing still scales with the payload.
+Decoders compare equal when configured alike, so subscriptions to the same feed with the same
+decoder share a single decode per poll.
+"""
+
+import abc
+import functools
+import json
+from datetime import datetime, timezone
+
+import csp
+
+from .mta_util import NYC_TIMEZONE
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+__all__ = (
+    "AlertPeriod",
+    "AlertEntity",
+    "Alert",
+    "EquipmentOutage",
+    "AlertDecoder",
+    "EquipmentOutageDecoder",
+)
+
+_OUTAGE_DATE_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+
+
+class AlertPeriod(csp.Struct):
+    start: int  # epoch seconds
+    end: int  # epoch seconds, unset if the alert is open-ended
+
+
+class AlertEntity(csp.Struct):
+    agency_id: str
+    route_id: str
+    stop_id: str
+
+
+class Alert(csp.Struct):
+    id: str
+    alert_type: str  # e.g. Delays, Planned - Part Suspended
+    header_text: str
+    description_text: str  # only decoded if asked for
+    created_at: int  # epoch seconds
+    updated_at: int  # epoch seconds
+    active_periods: [AlertPeriod]
+    informed_entities: [AlertEntity]
+
+
+class EquipmentOutage(csp.Struct):
+    equipment: str  # equipment id, e.g. EL123
+    equipment_type: str  # EL for elevators, ES for escalators
+    station: str
+    borough: str
+    train_lines: str  # lines serving the station, e.g. A/C
+    serving: str  # description of what the equipment connects
+    ada: bool  # whether the equipment is needed for the station to be ADA accessible
+    outage_start: datetime  # UTC
+    estimated_return: datetime  # UTC
+    reason: str
+    upcoming: bool  # a planned outage which has not started yet
+    maintenance: bool
+
+
+def _text(translated, language="en"):
+    """Text of a GTFS-rt TranslatedString in the given language, or its first translation"""
+    translations = (translated or {}).get("translation") or ()
+    for translation in translations:
+        if translation.get("language") == language:
+            return translation.get("text", "")
+    return translations[0].get("text", "") if translations else ""
+
+
+@functools.lru_cache(maxsize=4096)
+def _outage_time(s):
+    # the feed gives NYC local times; the same few timestamps repeat across outages and polls
+    return (
+        NYC_TIMEZONE.localize(datetime.strptime(s, _OUTAGE_DATE_FORMAT))
+        .astimezone(timezone.utc)
+        .replace(tzinfo=None)
+    )
+
+
+class _RecordDecoder(abc.ABC):
+    @abc.abstractmethod
+    def _key(self):
+        """The configuration decoders are compared and hashed by"""
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash((type(self), self._key()))
+
+
+class AlertDecoder(_RecordDecoder):
+    def __init__(self, route_ids=None, include_description=False):
+        """Decodes an alerts feed into a list of Alerts
+
+        Args:
+            route_ids (list): if given, only alerts informing one of these routes are decoded
+            include_description (bool): decode the (long) description text of each alert
+        """
+        self.route_ids = frozenset(route_ids) if route_ids is not None else None
+        self.include_description = include_description
+
+    def _key(self):
+        return self.route_ids, self.include_description
+
+    def __call__(self, content):
+        alerts = []
+        for entity in loads(content).get("entity", ()):
+            alert = entity.get("alert")
+            if alert is None:
+                continue
+            informed = alert.get("informed_entity", ())
+            if self.route_ids is not None and not any(
+                e.get("route_id") in self.route_ids for e in informed
+            ):
+                continue
+
+            record = Alert(
+                id=entity.get("id", ""),
+                header_text=_text(alert.get("header_text")),
+                active_periods=[
+                    AlertPeriod(**{k: p[k] for k in ("start", "end") if k in p})
+                    for p in alert.get("active_period", ())
+                ],
+                informed_entities=[
+                    AlertEntity(
+                        agency_id=e.get("agency_id", ""),
+                        route_id=e.get("route_id", ""),
+                        stop_id=e.get("stop_id", ""),
+                    )
+                    for e in informed
+                ],
+            )
+            if self.include_description:
+                record.description_text = _text(alert.get("description_text"))
+            mercury = alert.get("transit_realtime.mercury_alert")
+            if mercury is not None:
+                record.alert_type = mercury.get("alert_type", "")
+                if "created_at" in mercury:
+                    record.created_at = mercury["created_at"]
+                if "updated_at" in mercury:
+                    record.updated_at = mercury["updated_at"]
+            alerts.append(record)
+        return alerts
+
+
+class EquipmentOutageDecoder(_RecordDecoder):
+    def __init__(self, equipment_types=None, include_upcoming=True):
+        """Decodes the elevator/escalator status feed into a list of EquipmentOutages
+
+        Args:
+            equipment_types (list): if given, only outages of these equipment types (EL, ES) are decoded
+            include_upcoming (bool): decode planned outages which have not started yet
+        """
+        self.equipment_types = (
+            frozenset(equipment_types) if equipment_types is not None else None
+        )
+        self.include_upcoming = include_upcoming
+
+    def _key(self):
+        return self.equipment_types, self.include_upcoming
+
+    def __call__(self, content):
+        outages = []
+        for outage in loads(content):
+            if (
+                self.equipment_types is not None
+                and outage.get("equipmenttype") not in self.equipment_types
+            ):
+                continue
+            upcoming = outage.get("isupcomingoutage") == "Y"
+            if upcoming and not self.include_upcoming:
+                continue
+
+            record = EquipmentOutage(
+                equipment=outage.get("equipment", ""),
+                equipment_type=outage.get("equipmenttype", ""),
+                station=outage.get("station", ""),
+                borough=outage.get("borough", ""),
+                train_lines=outage.get("trainno", ""),
+                serving=outage.get("serving", ""),
+                ada=outage.get("ADA") == "Y",
+                reason=outage.get("reason", ""),
+                upcoming=upcoming,
+                maintenance=outage.get("ismaintenanceoutage") == "Y",
+            )
+            if outage.get("outagedate"):
+                record.outage_start = _outage_time(outage["outagedate"])
+            if outage.get("estimatedreturntoservice"):
+                record.estimated_return = _outage_time(
+                    outage["estimatedreturntoservice"]
+                )
+            outages.append(record)
+        return outages
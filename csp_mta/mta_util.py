@@ -5,14 +5,10 @@ Useful data for transfers, trains, etc.: https://transitfeeds.com/p/mta/79/lates
 """
 
 import os
-import os.path
-from datetime import timedelta
+from datetime import datetime, timedelta
 
-import pandas as pd
 import pytz
 
-_DATA_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "data")
-
 __all__ = (
     "LINE_TO_ENDPOINT",
     "MTA_FEED_UPDATE_TIME",
@@ -20,10 +16,12 @@ __all__ = (
     "NYC_TIMEZONE",
     "TOTAL_SUBWAY_STATIONS",
     "ADA_ACCESSIBLE_STATIONS",
-    "STOP_INFO_DF",
-    "TRANSFER_INFO_DF",
     "ACCESSIBILITY_ENDPOINT",
     "ALERT_ENDPOINTS",
+    "MTA_API_BASE",
+    "set_api_base",
+    "resolve_endpoint",
+    "to_epoch_seconds",
 )
 
 
@@ -44,13 +42,9 @@ MTA_FEED_UPDATE_TIME = timedelta(seconds=30)
 GTFS_DIRECTION = ["", "Uptown", "", "Downtown", ""]
 NYC_TIMEZONE = pytz.timezone("America/New_York")
 
-# Stops and transfers: load into a dataframe
 TOTAL_SUBWAY_STATIONS = 472
 ADA_ACCESSIBLE_STATIONS = 113
 
-STOP_INFO_DF = pd.read_csv(os.path.join(_DATA_DIR, "stops.csv"), index_col="stop_id")
-TRANSFER_INFO_DF = pd.read_csv(os.path.join(_DATA_DIR, "transfers.csv"))
-
 # Realtime elevator/escalator status
 ACCESSIBILITY_ENDPOINT = (
     "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fnyct_ene.json"
@@ -64,3 +58,51 @@ ALERT_ENDPOINTS = {
     "subway": "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/camsys%2Fsubway-alerts.json",
     "all": "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/camsys%2Fall-alerts.json",
 }
+
+# All of the above are served from here; it can be overridden to poll a stand-in such as the feed simulator,
+# either with set_api_base or the CSP_MTA_API_BASE environment variable
+MTA_API_BASE = "https://api-endpoint.mta.info"
+_api_base = None
+
+
+def set_api_base(base):
+    """Poll MTA endpoints from another base URL, e.g. http://localhost:8765; None restores the default"""
+    global _api_base
+    _api_base = base
+
+
+def resolve_endpoint(endpoint):
+    """The URL to poll for an endpoint, after any override of the MTA API base URL"""
+    base = _api_base or os.environ.get("CSP_MTA_API_BASE")
+    if base and endpoint.startswith(MTA_API_BASE):
+        return base.rstrip("/") + endpoint[len(MTA_API_BASE) :]
+    return endpoint
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch_seconds(dt):
+    """
+    Convert a datetime to epoch seconds, the time unit used by the GTFS-rt feeds
+    Naive datetimes, such as csp.now(), are taken to be UTC
+    """
+    if dt.tzinfo is not None:
+        return int(dt.timestamp())
+    return int((dt - _EPOCH).total_seconds())
+
+
+# Stops and transfers as dataframes: kept for compatibility, but loaded lazily on first access so that
+# importing the package does not require pandas. Prefer get_stop_info() and get_transfer_info()
+_DATAFRAMES = {}
+
+
+def __getattr__(name):
+    if name not in ("STOP_INFO_DF", "TRANSFER_INFO_DF"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if name not in _DATAFRAMES:
+        from .reference_data import get_stop_info, get_transfer_info
+
+        info = get_stop_info() if name == "STOP_INFO_DF" else get_transfer_info()
+        _DATAFRAMES[name] = info.to_dataframe()
+    return _DATAFRAMES[name]
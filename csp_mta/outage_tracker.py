@@ -0,0 +1,158 @@
+"""
+Incremental state of elevator/escalator outages across polls of the accessibility feed.
+
+Outages are keyed by equipment id and diffed against the previous poll, so consumers receive
+opened/updated/resolved events rather than the full list, and the running aggregates are adjusted only
+for the outages that changed. Outage timestamps are parsed when the feed is decoded, see
+EquipmentOutageDecoder, not on every use.
+"""
+
+from datetime import timedelta
+
+import csp
+from csp import ts
+
+from .json_records import EquipmentOutage
+
+__all__ = (
+    "OutageEventType",
+    "OutageEvent",
+    "OutageSummary",
+    "OutageTracker",
+    "outage_events",
+)
+
+
+class OutageEventType(csp.Enum):
+    OPENED = csp.Enum.auto()
+    UPDATED = csp.Enum.auto()
+    RESOLVED = csp.Enum.auto()
+
+
+class OutageEvent(csp.Struct):
+    type: OutageEventType
+    equipment: str
+    # for RESOLVED, the outage as it was last seen
+    outage: EquipmentOutage
+
+
+class OutageSummary(csp.Struct):
+    num_outages: int
+    num_ada_outages: int  # outages of equipment needed for ADA accessibility
+    mean_downtime: timedelta  # mean expected downtime; unset if no outage has both its times
+    outages_by_station: dict  # station -> number of outages
+
+
+def _downtime(outage):
+    if hasattr(outage, "outage_start") and hasattr(outage, "estimated_return"):
+        return outage.estimated_return - outage.outage_start
+    return None
+
+
+class OutageTracker:
+    """
+    Keeps the current outages keyed by equipment id, with aggregates maintained as outages open, change and resolve
+    Planned outages which have not started yet are not tracked
+    """
+
+    def __init__(self):
+        self._outages = {}
+        self._by_station = {}
+        self._num_ada = 0
+        self._total_downtime = timedelta()
+        self._num_downtimes = 0
+
+    def __len__(self):
+        return len(self._outages)
+
+    def __contains__(self, equipment):
+        return equipment in self._outages
+
+    def outages(self):
+        return self._outages.values()
+
+    def _add(self, outage, sign):
+        station = outage.station
+        count = self._by_station.get(station, 0) + sign
+        if count:
+            self._by_station[station] = count
+        else:
+            del self._by_station[station]
+        if outage.ada:
+            self._num_ada += sign
+        downtime = _downtime(outage)
+        if downtime is not None:
+            self._total_downtime += sign * downtime
+            self._num_downtimes += sign
+
+    def update(self, outages):
+        """Apply the outages of a new poll, returning the list of OutageEvents relative to the previous one"""
+        events = []
+        current = {}
+        for outage in outages:
+            if outage.upcoming:
+                continue
+            equipment = outage.equipment
+            if equipment in current:
+                # listed twice in one poll: keep the first, so that it is counted once
+                continue
+            current[equipment] = outage
+            prev = self._outages.get(equipment)
+            if prev is None:
+                events.append(
+                    OutageEvent(
+                        type=OutageEventType.OPENED, equipment=equipment, outage=outage
+                    )
+                )
+            elif prev != outage:
+                self._add(prev, -1)
+                events.append(
+                    OutageEvent(
+                        type=OutageEventType.UPDATED, equipment=equipment, outage=outage
+                    )
+                )
+            else:
+                continue
+            self._add(outage, 1)
+
+        for equipment, prev in self._outages.items():
+            if equipment not in current:
+                self._add(prev, -1)
+                events.append(
+                    OutageEvent(
+                        type=OutageEventType.RESOLVED, equipment=equipment, outage=prev
+                    )
+                )
+
+        self._outages = current
+        return events
+
+    def summary(self):
+        summary = OutageSummary(
+            num_outages=len(self._outages),
+            num_ada_outages=self._num_ada,
+            outages_by_station=dict(self._by_station),
+        )
+        if self._num_downtimes:
+            summary.mean_downtime = self._total_downtime / self._num_downtimes
+        return summary
+
+
+@csp.node
+def outage_events(
+    outages: ts[[EquipmentOutage]],
+) -> csp.Outputs(events=ts[[OutageEvent]], summary=ts[OutageSummary]):
+    """
+    Converts polls of the elevator/escalator status feed into outage events and a running summary
+    Both tick only when at least one outage has opened, changed or resolved, and the summary also ticks on the first poll
+    """
+    with csp.state():
+        s_tracker = OutageTracker()
+        s_first = True
+
+    events = s_tracker.update(outages)
+    if events or s_first:
+        s_first = False
+        csp.output(summary=s_tracker.summary())
+    if events:
+        csp.output(events=events)
@@ -0,0 +1,104 @@
+"""
+Export of per-poll metrics in the Prometheus text format or OpenMetrics.
+
+The files written are meant for the node exporter's textfile collector (or any scraper reading files),
+with the latest timings of each endpoint as gauges and running totals as counters.
+"""
+
+import os
+
+import csp
+from csp import ts
+
+from .feed_poller import PollMetrics
+
+__all__ = ("PollMetricsRegistry", "write_poll_metrics")
+
+_PREFIX = "csp_mta_poll"
+
+# PollMetrics field -> (metric name, help)
+_GAUGES = {
+    "connect_time": ("connect_seconds", "Time to open a connection, including DNS"),
+    "tls_time": ("tls_seconds", "Time spent in the TLS handshake"),
+    "wait_time": ("wait_seconds", "Time from sending the request to receiving the response headers"),
+    "transfer_time": ("transfer_seconds", "Time receiving the response body"),
+    "total_time": ("total_seconds", "Time for the whole request"),
+    "payload_bytes": ("payload_bytes", "Size of the response body"),
+    "decode_time": ("decode_seconds", "Time decoding the latest new snapshot"),
+    "entity_count": ("entities", "Entities in the latest new snapshot"),
+    "staleness": ("staleness_seconds", "Age of the latest snapshot"),
+    "push_delay": ("push_delay_seconds", "Time from receiving a new snapshot to handing it to every subscriber, excluding decoding"),
+}
+
+_COUNTERS = {
+    "polls": "Polls made",
+    "failures": "Polls which failed",
+    "snapshots": "Polls which served a new snapshot",
+    "bytes": "Response bytes received",
+}
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class PollMetricsRegistry:
+    """Keeps the latest PollMetrics of each endpoint, and running totals"""
+
+    def __init__(self):
+        self._gauges = {}
+        self._counters = {}
+
+    def update(self, metrics):
+        endpoint = metrics.endpoint
+        gauges = self._gauges.setdefault(endpoint, {})
+        for field in _GAUGES:
+            if hasattr(metrics, field):
+                gauges[field] = getattr(metrics, field)
+
+        counters = self._counters.setdefault(endpoint, dict.fromkeys(_COUNTERS, 0))
+        counters["polls"] += 1
+        counters["failures"] += hasattr(metrics, "error")
+        counters["snapshots"] += metrics.changed
+        counters["bytes"] += getattr(metrics, "payload_bytes", 0)
+
+    def render(self, openmetrics=False):
+        """The metrics in the Prometheus text exposition format, or in OpenMetrics"""
+        lines = []
+        for field, (name, help) in _GAUGES.items():
+            name = f"{_PREFIX}_{name}"
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for endpoint, gauges in self._gauges.items():
+                if field in gauges:
+                    lines.append(f'{name}{{endpoint="{_escape(endpoint)}"}} {gauges[field]}')
+        for counter, help in _COUNTERS.items():
+            name = f"{_PREFIX}_{counter}"
+            # OpenMetrics names the counter family without the _total suffix of its samples
+            family = name if openmetrics else f"{name}_total"
+            lines.append(f"# HELP {family} {help}")
+            lines.append(f"# TYPE {family} counter")
+            for endpoint, counters in self._counters.items():
+                lines.append(f'{name}_total{{endpoint="{_escape(endpoint)}"}} {counters[counter]}')
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, openmetrics=False):
+        """Write the metrics to a file atomically, so a scraper never reads a partial file"""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render(openmetrics))
+        os.replace(tmp, path)
+
+
+@csp.node
+def write_poll_metrics(metrics: ts[PollMetrics], path: str, openmetrics: bool = False):
+    """
+    Rewrites a Prometheus textfile (or OpenMetrics file) with the latest metrics on every poll
+    """
+    with csp.state():
+        s_registry = PollMetricsRegistry()
+
+    s_registry.update(metrics)
+    s_registry.write(path, openmetrics)
@@ -0,0 +1,176 @@
+"""
+Mergeable, bounded-memory quantile sketches for wait time and headway distributions.
+
+QuantileSketch is a t-digest: samples are summarized by weighted centroids, small in the tails and large in the
+middle of the distribution, so extreme quantiles stay accurate while the number of centroids is bounded by
+the compression parameter however many samples are added. Sketches of disjoint samples merge into a sketch of
+their union, in any order, and serialize to bytes so partial sketches can be combined across processes and days.
+"""
+
+import math
+import struct
+
+import numpy as np
+
+import csp
+from csp import ts
+
+__all__ = (
+    "DEFAULT_QUANTILES",
+    "QuantileSketch",
+    "sketch_quantiles",
+)
+
+DEFAULT_QUANTILES = [0.5, 0.9, 0.99]
+DEFAULT_COMPRESSION = 200
+# samples are buffered and merged into the centroids in batches of this many times the compression
+_BUFFER_FACTOR = 10
+_HEADER = struct.Struct("<idddI")  # compression, count, min, max, number of centroids
+
+
+class QuantileSketch:
+    """
+    t-digest of a stream of samples, using at most about compression centroids
+    Use add or update to add samples, merge to combine sketches and quantile(s) to query
+    """
+
+    __slots__ = ("compression", "count", "min", "max", "_means", "_weights", "_buffer", "_arrays", "_buffered")
+
+    def __init__(self, compression=DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.count = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._means = np.empty(0)
+        self._weights = np.empty(0)
+        self._buffer = []  # samples added one at a time
+        self._arrays = []  # and arrays of samples, both merged into the centroids in batches
+        self._buffered = 0
+
+    def __len__(self):
+        return int(self.count)
+
+    def add(self, value):
+        self._buffer.append(value)
+        self._buffered += 1
+        self.count += 1
+        if self._buffered >= _BUFFER_FACTOR * self.compression:
+            self._compress()
+
+    def update(self, values):
+        """Add an array of samples, buffered like those added one at a time"""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if not len(values):
+            return
+        self._arrays.append(values)
+        self._buffered += len(values)
+        self.count += len(values)
+        if self._buffered >= _BUFFER_FACTOR * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        """Add the samples summarized by another sketch"""
+        other._compress()
+        if other.count:
+            self._compress(other._means, other._weights)
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        return self
+
+    def _compress(self, means=None, weights=None):
+        parts_means = [self._means]
+        parts_weights = [self._weights]
+        if self._buffer:
+            self._arrays.append(np.array(self._buffer, dtype=np.float64))
+            self._buffer = []
+        if self._arrays:
+            parts_means.extend(self._arrays)
+            parts_weights.append(np.ones(self._buffered))
+            self._arrays = []
+            self._buffered = 0
+        if means is not None:
+            parts_means.append(means)
+            parts_weights.append(weights)
+        if len(parts_means) == 1:
+            return
+        means = np.concatenate(parts_means)
+        weights = np.concatenate(parts_weights)
+        self.min = min(self.min, means.min())
+        self.max = max(self.max, means.max())
+
+        order = np.argsort(means, kind="stable")
+        means = means[order]
+        weights = weights[order]
+        total = weights.sum()
+        self.count = total
+        # each centroid covers at most one unit of the k2 scale function, k(q) = compression / Z log(q / (1 - q))
+        # with Z = 4 log(n / compression) + 24, which is steepest in the tails, so they are kept in small centroids
+        q = (np.cumsum(weights) - weights / 2) / total
+        normalizer = 4 * math.log(max(total / self.compression, 1.0)) + 24
+        k = self.compression / normalizer * np.log(q / (1 - q))
+        bucket = np.floor(k - k[0]).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        self._weights = np.add.reduceat(weights, starts)
+        self._means = np.add.reduceat(means * weights, starts) / self._weights
+
+    def quantiles(self, qs):
+        """Estimated values at each quantile in qs, NaN if the sketch is empty"""
+        self._compress()
+        qs = np.asarray(qs, dtype=np.float64)
+        if not self.count:
+            return np.full(qs.shape, np.nan)
+        # interpolate between centroid centres, pinned to the exact min and max at the ends
+        centres = np.cumsum(self._weights) - self._weights / 2
+        positions = np.r_[0.0, centres, self.count]
+        values = np.r_[self.min, self._means, self.max]
+        return np.interp(qs * self.count, positions, values)
+
+    def quantile(self, q):
+        return float(self.quantiles([q])[0])
+
+    def to_bytes(self):
+        self._compress()
+        return (
+            _HEADER.pack(
+                self.compression, self.count, self.min, self.max, len(self._means)
+            )
+            + self._means.astype("<f8").tobytes()
+            + self._weights.astype("<f8").tobytes()
+        )
+
+    @classmethod
+    def from_bytes(cls, data):
+        compression, count, min_, max_, n = _HEADER.unpack_from(data)
+        sketch = cls(compression)
+        sketch.count = count
+        sketch.min = min_
+        sketch.max = max_
+        offset = _HEADER.size
+        sketch._means = np.frombuffer(data, "<f8", n, offset).copy()
+        sketch._weights = np.frombuffer(data, "<f8", n, offset + 8 * n).copy()
+        return sketch
+
+    def __reduce__(self):
+        return QuantileSketch.from_bytes, (self.to_bytes(),)
+
+
+@csp.node
+def sketch_quantiles(
+    x: ts[float],
+    trigger: ts[object],
+    quantiles: [float] = DEFAULT_QUANTILES,
+    compression: int = DEFAULT_COMPRESSION,
+) -> csp.Outputs(values=ts[[float]], sketch=ts[QuantileSketch]):
+    """
+    Quantiles of x over each window between ticks of trigger, e.g. csp.timer(timedelta(hours=1))
+    The window's sketch is ticked too, to be serialized or merged with others; a new one is started every window
+    """
+    with csp.state():
+        s_sketch = QuantileSketch(compression)
+
+    if csp.ticked(x):
+        s_sketch.add(x)
+
+    if csp.ticked(trigger) and s_sketch.count:
+        csp.output(values=s_sketch.quantiles(quantiles).tolist(), sketch=s_sketch)
+        s_sketch = QuantileSketch(compression)
@@ -0,0 +1,260 @@
+"""
+Static GTFS reference data: stops and transfers.
+
+The CSV files are parsed lazily, on first use, into compact lookup structures: stop ids are interned to
+integer codes, and names, coordinates and parent stations are held in flat arrays indexed by code.
+The parsed data can be cached in a binary sidecar so later processes skip the CSV parse entirely; this is
+opt-in, by passing a cache_dir or setting CSP_MTA_CACHE_DIR. pandas is only imported if a DataFrame view is
+asked for.
+"""
+
+import csv
+import os
+import os.path
+import pickle
+import threading
+
+import numpy as np
+
+__all__ = (
+    "StopInfo",
+    "TransferInfo",
+    "get_stop_info",
+    "get_transfer_info",
+)
+
+_DATA_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "data")
+# bump when the layout of the cached objects changes
+_CACHE_VERSION = 1
+
+
+def _cache_dir(cache_dir):
+    # no caching unless asked for: nothing is written to, or unpickled from, a directory the user did not choose
+    return cache_dir if cache_dir is not None else os.environ.get("CSP_MTA_CACHE_DIR") or None
+
+
+class StopInfo:
+    """
+    Lookup structure over stops.csv
+
+    Attributes:
+        stop_ids (list): stop_id of each code
+        names (list): stop_name of each code
+        lat (float64 array): stop_lat of each code
+        lon (float64 array): stop_lon of each code
+        location_type (int8 array): 1 for stations, 0 for platforms
+        parent (int32 array): code of the parent station, -1 for stations
+    """
+
+    def __init__(self, stop_ids, names, lat, lon, location_type, parent):
+        self.stop_ids = stop_ids
+        self.names = names
+        self.lat = lat
+        self.lon = lon
+        self.location_type = location_type
+        self.parent = parent
+        self._codes = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+
+    @classmethod
+    def from_csv(cls, filename):
+        with open(filename, newline="") as f:
+            rows = list(csv.DictReader(f))
+        stop_ids = [r["stop_id"] for r in rows]
+        codes = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+        return cls(
+            stop_ids=stop_ids,
+            names=[r["stop_name"] for r in rows],
+            lat=np.array([float(r["stop_lat"]) for r in rows]),
+            lon=np.array([float(r["stop_lon"]) for r in rows]),
+            location_type=np.array(
+                [int(r["location_type"] or 0) for r in rows], dtype=np.int8
+            ),
+            parent=np.array(
+                [codes.get(r["parent_station"], -1) for r in rows], dtype=np.int32
+            ),
+        )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_codes"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._codes = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    def __contains__(self, stop_id):
+        return stop_id in self._codes
+
+    def code(self, stop_id):
+        """Integer code of a stop_id; raises KeyError if unknown"""
+        return self._codes[stop_id]
+
+    def name(self, stop_id):
+        return self.names[self._codes[stop_id]]
+
+    def parent_station(self, stop_id):
+        """stop_id of the parent station of a platform, or the stop_id itself for a station"""
+        parent = self.parent[self._codes[stop_id]]
+        return stop_id if parent < 0 else self.stop_ids[parent]
+
+    def to_dataframe(self):
+        """pandas view matching the layout of stops.csv, indexed by stop_id"""
+        import pandas as pd
+
+        parents = [self.stop_ids[p] if p >= 0 else None for p in self.parent]
+        location_type = [1 if t == 1 else None for t in self.location_type]
+        return pd.DataFrame(
+            {
+                "stop_name": self.names,
+                "stop_lat": self.lat,
+                "stop_lon": self.lon,
+                "location_type": location_type,
+                "parent_station": parents,
+            },
+            index=pd.Index(self.stop_ids, name="stop_id"),
+        )
+
+
+class TransferInfo:
+    """
+    Lookup structure over transfers.csv, with stops given as StopInfo codes
+
+    Attributes:
+        from_stop (int32 array): code of the stop transferred from
+        to_stop (int32 array): code of the stop transferred to
+        transfer_type (int8 array): GTFS transfer_type
+        min_transfer_time (int32 array): minimum transfer time in seconds
+    """
+
+    def __init__(self, stop_info, from_stop, to_stop, transfer_type, min_transfer_time):
+        self.stop_info = stop_info
+        self.from_stop = from_stop
+        self.to_stop = to_stop
+        self.transfer_type = transfer_type
+        self.min_transfer_time = min_transfer_time
+
+    @classmethod
+    def from_csv(cls, filename, stop_info):
+        with open(filename, newline="") as f:
+            rows = [
+                r
+                for r in csv.DictReader(f)
+                if r["from_stop_id"] in stop_info and r["to_stop_id"] in stop_info
+            ]
+        return cls(
+            stop_info=stop_info,
+            from_stop=np.array(
+                [stop_info.code(r["from_stop_id"]) for r in rows], dtype=np.int32
+            ),
+            to_stop=np.array(
+                [stop_info.code(r["to_stop_id"]) for r in rows], dtype=np.int32
+            ),
+            transfer_type=np.array(
+                [int(r["transfer_type"] or 0) for r in rows], dtype=np.int8
+            ),
+            min_transfer_time=np.array(
+                [int(r["min_transfer_time"] or 0) for r in rows], dtype=np.int32
+            ),
+        )
+
+    def __getstate__(self):
+        # the StopInfo is cached on its own, and re-attached on load
+        state = self.__dict__.copy()
+        state["stop_info"] = None
+        return state
+
+    def __len__(self):
+        return len(self.from_stop)
+
+    def to_dataframe(self):
+        """pandas view matching the layout of transfers.csv"""
+        import pandas as pd
+
+        stop_ids = np.array(self.stop_info.stop_ids, dtype=object)
+        return pd.DataFrame(
+            {
+                "from_stop_id": stop_ids[self.from_stop],
+                "to_stop_id": stop_ids[self.to_stop],
+                "transfer_type": self.transfer_type.astype(np.int64),
+                "min_transfer_time": self.min_transfer_time.astype(np.int64),
+            }
+        )
+
+
+def _load(name, sources, parse, cls, cache_dir):
+    """Parse reference data, going through the binary sidecar cache in cache_dir if there is one"""
+    cache_dir = _cache_dir(cache_dir)
+    if cache_dir is None:
+        return parse()
+
+    stats = [os.stat(os.path.join(_DATA_DIR, source)) for source in sources]
+    key = (_CACHE_VERSION, [(s.st_size, s.st_mtime_ns) for s in stats])
+    cache_file = os.path.join(cache_dir, name + ".pkl")
+    try:
+        with open(cache_file, "rb") as f:
+            cached_key, data = pickle.load(f)
+        if cached_key == key and isinstance(data, cls):
+            return data
+    except Exception:
+        # missing, corrupt or written by another version of the classes, e.g. AttributeError or
+        # ModuleNotFoundError: the cache is only an optimization, so fall back to parsing the CSV
+        pass
+
+    data = parse()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((key, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)
+    except OSError:
+        # e.g. the directory is read-only
+        pass
+    return data
+
+
+_LOCK = threading.Lock()
+_STOP_INFO = None
+_TRANSFER_INFO = None
+
+
+def get_stop_info(cache_dir=None):
+    """
+    Returns the process-wide StopInfo, loading it on first use
+    The parsed data is cached in cache_dir, or $CSP_MTA_CACHE_DIR if not given, and not cached if neither is set
+    """
+    global _STOP_INFO
+    with _LOCK:
+        if _STOP_INFO is None:
+            _STOP_INFO = _load(
+                "stops.csv",
+                ["stops.csv"],
+                lambda: StopInfo.from_csv(os.path.join(_DATA_DIR, "stops.csv")),
+                StopInfo,
+                cache_dir,
+            )
+        return _STOP_INFO
+
+
+def get_transfer_info(cache_dir=None):
+    """Returns the process-wide TransferInfo, loading it on first use; cached as get_stop_info is"""
+    global _TRANSFER_INFO
+    stop_info = get_stop_info(cache_dir)
+    with _LOCK:
+        if _TRANSFER_INFO is None:
+            # transfer codes depend on stops.csv too
+            _TRANSFER_INFO = _load(
+                "transfers.csv",
+                ["stops.csv", "transfers.csv"],
+                lambda: TransferInfo.from_csv(
+                    os.path.join(_DATA_DIR, "transfers.csv"), stop_info
+                ),
+                TransferInfo,
+                cache_dir,
+            )
+            _TRANSFER_INFO.stop_info = stop_info
+        return _TRANSFER_INFO
@@ -0,0 +1,127 @@
+"""
+Per-stop arrival index built once per GTFS-rt snapshot.
+
+Answering "next N trains at stop X" by scanning every entity's stop_time_update list costs
+entities x updates per stop per tick. The index is built in a single pass over the feed and then
+answers each stop query with a binary search.
+"""
+
+from bisect import bisect_left
+
+import csp
+from csp import ts
+
+from .compiled_protobuf import nyct_subway_pb2
+from .compiled_protobuf.gtfs_realtime_pb2 import FeedMessage
+from .mta_util import to_epoch_seconds
+
+__all__ = (
+    "StopArrival",
+    "StopArrivalIndex",
+    "stop_arrival_index",
+    "next_arrivals_at_stop",
+)
+
+
+class StopArrival(csp.Struct):
+    stop_id: str  # platform stop_id, i.e. including the N/S suffix for the subway
+    arrival_time: int  # epoch seconds
+    trip_id: str
+    route_id: str
+    direction: int  # index into GTFS_DIRECTION
+    terminus_id: str  # last stop of the trip
+
+
+def _parent_stop_id(stop_id):
+    # NYCT platforms are the parent station's stop_id with an N/S suffix
+    if len(stop_id) > 1 and stop_id[-1] in "NS":
+        return stop_id[:-1]
+    return None
+
+
+class StopArrivalIndex:
+    """
+    Maps stop_id to the arrivals at that stop, sorted by arrival time
+    Subway platforms are indexed both under their own stop_id (e.g. 635N) and their parent station (635)
+    """
+
+    def __init__(self, feed):
+        arrivals = {}
+        for entity in feed.entity:
+            if not entity.HasField("trip_update"):
+                continue
+            trip_update = entity.trip_update
+            updates = trip_update.stop_time_update
+            if not updates:
+                continue
+            trip = trip_update.trip
+            trip_id = trip.trip_id
+            route_id = trip.route_id
+            direction = trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor].direction
+            terminus_id = updates[-1].stop_id
+            for update in updates:
+                # the first stop of a trip only has a departure time
+                arrival_time = update.arrival.time or update.departure.time
+                if not arrival_time:
+                    continue
+                stop_id = update.stop_id
+                arrival = StopArrival(
+                    stop_id=stop_id,
+                    arrival_time=arrival_time,
+                    trip_id=trip_id,
+                    route_id=route_id,
+                    direction=direction,
+                    terminus_id=terminus_id,
+                )
+                arrivals.setdefault(stop_id, []).append(arrival)
+                parent = _parent_stop_id(stop_id)
+                if parent is not None:
+                    arrivals.setdefault(parent, []).append(arrival)
+
+        self.timestamp = feed.header.timestamp
+        self._arrivals = {}
+        self._times = {}
+        for stop_id, stop_arrivals in arrivals.items():
+            stop_arrivals.sort(key=lambda a: a.arrival_time)
+            self._arrivals[stop_id] = stop_arrivals
+            self._times[stop_id] = [a.arrival_time for a in stop_arrivals]
+
+    def __contains__(self, stop_id):
+        return stop_id in self._arrivals
+
+    def stop_ids(self):
+        return self._arrivals.keys()
+
+    def arrivals(self, stop_id):
+        """All arrivals at a stop in the snapshot, sorted by arrival time"""
+        return self._arrivals.get(stop_id, [])
+
+    def next_arrivals(self, stop_id, after, n=None):
+        """
+        Arrivals at a stop at or after the given epoch time, sorted by arrival time
+        If n is given, at most the next n arrivals are returned
+        """
+        times = self._times.get(stop_id)
+        if times is None:
+            return []
+        start = bisect_left(times, after)
+        end = len(times) if n is None else start + n
+        return self._arrivals[stop_id][start:end]
+
+
+@csp.node
+def stop_arrival_index(feed: ts[FeedMessage]) -> ts[StopArrivalIndex]:
+    """
+    Builds the per-stop arrival index once for each feed snapshot
+    """
+    return StopArrivalIndex(feed)
+
+
+@csp.node
+def next_arrivals_at_stop(
+    index: ts[StopArrivalIndex], stop_id: str, N: int
+) -> ts[[StopArrival]]:
+    """
+    Returns the next N arrivals at a stop relative to the current engine time
+    """
+    return index.next_arrivals(stop_id, to_epoch_seconds(csp.now()), N)
@@ -0,0 +1,263 @@
+"""
+Normalized archive of stop time updates.
+
+Converts raw feed recordings into a Parquet dataset with one row per (snapshot, trip, stop), hive-partitioned
+by service and NYC service date. Historical jobs can then read just the stops and time range they need,
+with predicate pushdown, and never touch protobuf.
+"""
+
+import os
+import typing
+from datetime import timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from csp import ts
+from csp.impl.pulladapter import PullInputAdapter
+from csp.impl.wiring import py_pull_adapter_def
+
+from .columnar import FeedColumns, FeedColumnsDecoder
+from .mta_util import NYC_TIMEZONE
+from .recording import iter_recording
+
+__all__ = (
+    "STOP_TIME_ARCHIVE_SCHEMA",
+    "convert_to_stop_time_archive",
+    "read_stop_time_archive",
+    "iter_stop_time_archive",
+    "StopTimeArchiveReader",
+)
+
+STOP_TIME_ARCHIVE_SCHEMA = pa.schema(
+    [
+        ("snapshot_time", pa.timestamp("ns", tz="UTC")),
+        ("feed_timestamp", pa.int64()),
+        ("trip_id", pa.string()),
+        ("route_id", pa.string()),
+        ("stop_id", pa.string()),
+        ("direction", pa.int8()),
+        ("arrival_time", pa.int64()),
+        ("departure_time", pa.int64()),
+    ]
+)
+_PARTITION_SCHEMA = pa.schema([("service", pa.string()), ("date", pa.string())])
+SNAPSHOTS_PER_FILE = 720  # 6 hours of 30 second snapshots
+
+
+def _service_date(time):
+    return time.astimezone(NYC_TIMEZONE).strftime("%Y-%m-%d")
+
+
+def _strings(codes, interner):
+    return pa.DictionaryArray.from_arrays(
+        pa.array(codes, type=pa.int32()), pa.array(interner.strings, type=pa.string())
+    ).cast(pa.string())
+
+
+class _ArchiveFileWriter:
+    def __init__(self, root, service, stem, decoder):
+        self._root = root
+        self._service = service
+        self._stem = stem
+        self._decoder = decoder
+        self._num_files = 0
+        self._date = None
+        self._snapshots = []
+
+    def add(self, time, columns):
+        """Buffer a snapshot, returning the number of rows written if a file was flushed to make room"""
+        rows = 0
+        date = _service_date(time)
+        if self._snapshots and (
+            date != self._date or len(self._snapshots) >= SNAPSHOTS_PER_FILE
+        ):
+            rows = self.flush()
+        self._date = date
+        self._snapshots.append((time, columns))
+        return rows
+
+    def flush(self):
+        if not self._snapshots:
+            return 0
+        counts = [len(c) for _, c in self._snapshots]
+        snapshot_times = pa.array(
+            [t for t, _ in self._snapshots], type=pa.timestamp("ns", tz="UTC")
+        ).take(np.repeat(np.arange(len(counts)), counts))
+        feed_timestamps = np.repeat([c.timestamp for _, c in self._snapshots], counts)
+        concat = lambda attr: np.concatenate([getattr(c, attr) for _, c in self._snapshots])
+        table = pa.table(
+            [
+                snapshot_times,
+                pa.array(feed_timestamps, type=pa.int64()),
+                _strings(concat("trip"), self._decoder.trips),
+                _strings(concat("route"), self._decoder.routes),
+                _strings(concat("stop"), self._decoder.stops),
+                pa.array(concat("direction"), type=pa.int8()),
+                pa.array(concat("arrival"), type=pa.int64()),
+                pa.array(concat("departure"), type=pa.int64()),
+            ],
+            schema=STOP_TIME_ARCHIVE_SCHEMA,
+        )
+        directory = os.path.join(
+            self._root, f"service={self._service}", f"date={self._date}"
+        )
+        os.makedirs(directory, exist_ok=True)
+        pq.write_table(
+            table,
+            os.path.join(directory, f"{self._stem}-{self._num_files:05d}.parquet"),
+            compression="zstd",
+        )
+        self._num_files += 1
+        self._snapshots = []
+        return table.num_rows
+
+
+def convert_to_stop_time_archive(recording, root, service):
+    """
+    Convert a raw GTFS-rt recording (either recording format) into the normalized stop time archive under root
+    Re-converting the same recording overwrites its files. Returns the number of rows written
+    """
+    decoder = FeedColumnsDecoder()
+    stem = os.path.splitext(os.path.basename(recording))[0]
+    writer = _ArchiveFileWriter(root, service, stem, decoder)
+    rows = 0
+    for time, content in iter_recording(recording):
+        rows += writer.add(time, decoder.decode_bytes(content))
+    return rows + writer.flush()
+
+
+def _utc(time):
+    if time is None or time.tzinfo is not None:
+        return time
+    return time.replace(tzinfo=timezone.utc)
+
+
+def _archive_filters(service, stop_ids, starttime, endtime):
+    """Returns filter expressions on the partition keys and on the rows"""
+    partition = row = pc.scalar(True)
+    if service is not None:
+        partition &= pc.field("service") == service
+    if stop_ids is not None:
+        row &= pc.field("stop_id").isin(list(stop_ids))
+    if starttime is not None:
+        partition &= pc.field("date") >= _service_date(starttime)
+        row &= pc.field("snapshot_time") >= pa.scalar(starttime, pa.timestamp("ns", tz="UTC"))
+    if endtime is not None:
+        partition &= pc.field("date") <= _service_date(endtime)
+        row &= pc.field("snapshot_time") <= pa.scalar(endtime, pa.timestamp("ns", tz="UTC"))
+    return partition, row
+
+
+def _dataset(root):
+    # imported here as pyarrow.dataset pulls in pandas
+    import pyarrow.dataset as ds
+
+    return ds.dataset(
+        root,
+        format="parquet",
+        partitioning=ds.partitioning(_PARTITION_SCHEMA, flavor="hive"),
+    )
+
+
+def read_stop_time_archive(
+    root, service=None, stop_ids=None, starttime=None, endtime=None, columns=None
+):
+    """
+    Read rows of the stop time archive as a pyarrow Table
+    Filters on service, stop_ids and the [starttime, endtime] snapshot time range are pushed down to the Parquet scan
+    """
+    partition, row = _archive_filters(service, stop_ids, _utc(starttime), _utc(endtime))
+    return _dataset(root).to_table(filter=partition & row, columns=columns)
+
+
+def _to_codes(column, interner):
+    encoded = pc.dictionary_encode(column).combine_chunks()
+    remap = interner.codes(encoded.dictionary.to_pylist())
+    return remap[encoded.indices.to_numpy(zero_copy_only=False)]
+
+
+def iter_stop_time_archive(
+    root, service, stop_ids=None, starttime=None, endtime=None, decoder=None
+):
+    """
+    Iterate over the snapshots of one service in the archive as (snapshot_time, FeedColumns), in time order
+    Codes in the returned columns are those of decoder, or of a new FeedColumnsDecoder if none is given
+    """
+    decoder = decoder if decoder is not None else FeedColumnsDecoder()
+    partition, row = _archive_filters(service, stop_ids, _utc(starttime), _utc(endtime))
+    # files are named after the recording they came from and numbered in time order
+    fragments = sorted(_dataset(root).get_fragments(filter=partition), key=lambda f: f.path)
+    for fragment in fragments:
+        table = fragment.to_table(filter=row, schema=STOP_TIME_ARCHIVE_SCHEMA)
+        if not table.num_rows:
+            continue
+        snapshot_times = table.column("snapshot_time")
+        times = snapshot_times.cast(pa.int64()).to_numpy()
+        trip = _to_codes(table.column("trip_id"), decoder.trips)
+        route = _to_codes(table.column("route_id"), decoder.routes)
+        stop = _to_codes(table.column("stop_id"), decoder.stops)
+        feed_timestamps = table.column("feed_timestamp").to_numpy()
+        direction = table.column("direction").to_numpy()
+        arrival = table.column("arrival_time").to_numpy()
+        departure = table.column("departure_time").to_numpy()
+        bounds = np.flatnonzero(np.diff(times)) + 1
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(times)]):
+            yield snapshot_times[int(start)].as_py(), FeedColumns(
+                timestamp=int(feed_timestamps[start]),
+                trip=trip[start:end],
+                route=route[start:end],
+                stop=stop[start:end],
+                arrival=arrival[start:end],
+                departure=departure[start:end],
+                direction=direction[start:end],
+            )
+
+
+class StopTimeArchiveReaderImpl(PullInputAdapter):
+    def __init__(self, root, service, stop_ids, decoder):
+        """Implementation for the stop time archive reader
+
+        Args:
+            root (str): root directory of the archive
+            service (str): service to replay
+            stop_ids (list): if given, only rows for these stop_ids are read
+            decoder (FeedColumnsDecoder): decoder whose string codes the ticked columns use; a new one if None
+        """
+        self._root = root
+        self._service = service
+        self._stop_ids = stop_ids
+        self._decoder = decoder
+        self._snapshots = None
+        super().__init__()
+
+    def start(self, start_time, end_time):
+        super().start(start_time, end_time)
+        self._snapshots = iter_stop_time_archive(
+            self._root,
+            self._service,
+            self._stop_ids,
+            start_time,
+            end_time,
+            self._decoder,
+        )
+
+    def next(self):
+        snapshot = next(self._snapshots, None)
+        if snapshot is None:
+            return None
+        time, columns = snapshot
+        return time.replace(tzinfo=None), columns
+
+
+StopTimeArchiveReader = py_pull_adapter_def(
+    "StopTimeArchiveReader",
+    StopTimeArchiveReaderImpl,
+    ts[FeedColumns],
+    root=str,
+    service=str,
+    stop_ids=(typing.List[str], None),
+    decoder=(FeedColumnsDecoder, None),
+)
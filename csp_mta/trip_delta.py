@@ -0,0 +1,170 @@
+"""
+Trip-level deltas between successive GTFS-rt snapshots.
+
+Most trips are unchanged between two 30 second snapshots, so rather than rescanning the full FeedMessage
+on every tick, consumers can subscribe to added/updated/removed events per TripUpdate and keep their own
+state incrementally.
+"""
+
+import csp
+from csp import ts
+
+from .compiled_protobuf import nyct_subway_pb2
+from .compiled_protobuf.gtfs_realtime_pb2 import FeedMessage
+
+__all__ = (
+    "TripDeltaType",
+    "StopTimeUpdate",
+    "TripDelta",
+    "TripDeltaTracker",
+    "trip_deltas",
+)
+
+
+class TripDeltaType(csp.Enum):
+    ADDED = csp.Enum.auto()
+    UPDATED = csp.Enum.auto()
+    REMOVED = csp.Enum.auto()
+
+
+class StopTimeUpdate(csp.Struct):
+    stop_id: str
+    arrival_time: int  # epoch seconds, 0 if not given
+    departure_time: int  # epoch seconds, 0 if not given
+
+
+class TripDelta(csp.Struct):
+    type: TripDeltaType
+    trip_id: str
+    route_id: str
+    direction: int  # index into GTFS_DIRECTION
+    timestamp: int  # feed header timestamp of the snapshot which produced this delta
+    # for ADDED, all stop time updates; for UPDATED, only the new or changed ones
+    stop_time_updates: [StopTimeUpdate]
+    # for UPDATED, stops which are no longer in the trip update (usually because the train has passed them)
+    removed_stop_ids: [str]
+
+
+class _TripState:
+    __slots__ = ("raw", "route_id", "direction", "stops")
+
+    def __init__(self, raw, route_id, direction, stops):
+        self.raw = raw
+        self.route_id = route_id
+        self.direction = direction
+        self.stops = stops
+
+
+def _stop_times(trip_update):
+    return {
+        u.stop_id: (u.arrival.time, u.departure.time)
+        for u in trip_update.stop_time_update
+    }
+
+
+def _to_updates(stops, stop_ids):
+    return [
+        StopTimeUpdate(
+            stop_id=stop_id,
+            arrival_time=stops[stop_id][0],
+            departure_time=stops[stop_id][1],
+        )
+        for stop_id in stop_ids
+    ]
+
+
+class TripDeltaTracker:
+    """
+    Keeps the last snapshot keyed by trip_id and diffs each new FeedMessage against it
+    Unchanged trips are detected by comparing the serialized TripUpdate, so they cost no per-stop work
+    """
+
+    def __init__(self):
+        self._trips = {}
+
+    def __len__(self):
+        return len(self._trips)
+
+    def update(self, feed):
+        """Apply a new snapshot, returning the list of TripDelta events relative to the previous one"""
+        timestamp = feed.header.timestamp
+        deltas = []
+        trips = {}
+        for entity in feed.entity:
+            if not entity.HasField("trip_update"):
+                continue
+            trip_update = entity.trip_update
+            trip_id = trip_update.trip.trip_id
+            raw = trip_update.SerializeToString()
+            prev = self._trips.get(trip_id)
+            if prev is not None and prev.raw == raw:
+                trips[trip_id] = prev
+                continue
+
+            stops = _stop_times(trip_update)
+            state = _TripState(
+                raw,
+                trip_update.trip.route_id,
+                trip_update.trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor].direction,
+                stops,
+            )
+            trips[trip_id] = state
+            if prev is None:
+                deltas.append(
+                    TripDelta(
+                        type=TripDeltaType.ADDED,
+                        trip_id=trip_id,
+                        route_id=state.route_id,
+                        direction=state.direction,
+                        timestamp=timestamp,
+                        stop_time_updates=_to_updates(stops, stops),
+                        removed_stop_ids=[],
+                    )
+                )
+                continue
+
+            changed = [s for s, t in stops.items() if prev.stops.get(s) != t]
+            removed = [s for s in prev.stops if s not in stops]
+            if changed or removed or state.route_id != prev.route_id or state.direction != prev.direction:
+                deltas.append(
+                    TripDelta(
+                        type=TripDeltaType.UPDATED,
+                        trip_id=trip_id,
+                        route_id=state.route_id,
+                        direction=state.direction,
+                        timestamp=timestamp,
+                        stop_time_updates=_to_updates(stops, changed),
+                        removed_stop_ids=removed,
+                    )
+                )
+
+        for trip_id, prev in self._trips.items():
+            if trip_id not in trips:
+                deltas.append(
+                    TripDelta(
+                        type=TripDeltaType.REMOVED,
+                        trip_id=trip_id,
+                        route_id=prev.route_id,
+                        direction=prev.direction,
+                        timestamp=timestamp,
+                        stop_time_updates=[],
+                        removed_stop_ids=list(prev.stops),
+                    )
+                )
+
+        self._trips = trips
+        return deltas
+
+
+@csp.node
+def trip_deltas(feed: ts[FeedMessage]) -> ts[[TripDelta]]:
+    """
+    Converts a stream of whole FeedMessage snapshots into trip-level delta events
+    Ticks only when at least one trip has changed
+    """
+    with csp.state():
+        s_tracker = TripDeltaTracker()
+
+    deltas = s_tracker.update(feed)
+    if deltas:
+        return deltas
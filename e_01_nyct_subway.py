@@ -1,101 +1,66 @@
 import argparse
+import glob
+import os
 from datetime import datetime, timedelta
 from typing import List, Tuple
 
 import csp
 
 from csp_mta import (
-    GTFS_DIRECTION,
     LINE_TO_ENDPOINT,
-    STOP_INFO_DF,
+    EventStreamOutputAdapter,
+    EventStreamServer,
+    FeedSelection,
     GTFSRealtimeInputAdapter,
-    nyct_subway_pb2,
+    departure_board_at,
+    departure_boards,
+    get_stop_info,
+    iter_recording,
+    stop_arrival_index,
 )
 
 
-def get_stop_time_at_station(entity, stop_id):
-    """
-    Helper Python function to get the stop time at a station
-    """
-    if entity.HasField("trip_update"):
-        stop_time_updates = entity.trip_update.stop_time_update
-        for update in stop_time_updates:
-            # could be N or S
-            if (
-                stop_id in update.stop_id
-                and datetime.fromtimestamp(update.arrival.time) >= datetime.now()
-            ):
-                return update.arrival.time
-    return None
-
-
-@csp.node
-def filter_trains_headed_for_stop(
-    gtfs_msgs: csp.ts[object], stop_id: str
-) -> csp.ts[object]:
-    """
-    Filters the GTFS messages to only include trains that are currently headed for a stop with a given stop_id, found in stops.txt
-    Any train that has either passed the stop or does not stop at said stop will be ignored
-    """
-    relevant_entities = []
-    for entity in gtfs_msgs.entity:
-        if get_stop_time_at_station(entity, stop_id):
-            relevant_entities.append(entity)
-
-    return relevant_entities
-
-
-@csp.node
-def next_N_trains_at_stop(
-    gtfs_msgs: csp.ts[object], stop_id: str, N: int
-) -> csp.ts[object]:
-    """
-    Returns the TripUpdate objects of the next N trains approaching the stop
-    """
-    gtfs_msgs.sort(key=lambda entity: get_stop_time_at_station(entity, stop_id))
-    return gtfs_msgs[:N]
-
-
-def get_terminus(entity):
-    return entity.trip_update.stop_time_update[-1].stop_id
-
-
-def entities_to_departure_board_str(entities, stop_id):
-    """
-    Helper function to pretty-print train info
-    """
-    dep_str = f'\n At station {STOP_INFO_DF.loc[stop_id, "stop_name"]}\n\n'
-    for entity in entities:
-        route = entity.trip_update.trip.route_id
-        direction = GTFS_DIRECTION[
-            entity.trip_update.trip.Extensions[
-                nyct_subway_pb2.nyct_trip_descriptor
-            ].direction
-        ]
-        terminus = get_terminus(entity)
-        arrival = datetime.fromtimestamp(get_stop_time_at_station(entity, stop_id))
-        delta = arrival - datetime.now()
-        dep_str += f'{direction} {route} train to {STOP_INFO_DF.loc[terminus, "stop_name"]} in {round(delta.total_seconds() // 60)} minutes\n'
-
-    return dep_str
-
-
 @csp.graph
-def departure_board(platforms: List[Tuple[str, str]], N: int):
+def departure_board(
+    platforms: List[Tuple[str, str]],
+    N: int,
+    recordings: dict = {},
+    speed: float = 1.0,
+    server: EventStreamServer = None,
+    select: bool = False,
+):
     """
-    csp graph which ticks out the next N trains approaching the provided stations on each given line
+    csp graph which ticks out the next N trains approaching the provided stations on each given line, whenever they change
+    Lines with a recording in recordings (line -> filename) are replayed from it rather than polled
+    With a server, the boards are also streamed to its clients as "board" events
+    With select, only the trips calling at the board's stations are decoded, which pays off on large multi-line feeds
     """
+    selections = {}
+    if select:
+        stop_ids = {}
+        for stop_id, line in platforms:
+            stop_ids.setdefault(line, []).append(stop_id)
+        selections = {
+            line: FeedSelection(stop_ids=stops, entity_types=["trip_update"])
+            for line, stops in stop_ids.items()
+        }
+
     for service in platforms:
         stop_id, line = service
-        line_data = GTFSRealtimeInputAdapter(line, False)
-        trains_headed_for_station = filter_trains_headed_for_stop(line_data, stop_id)
-        next_N_trains = next_N_trains_at_stop(trains_headed_for_station, stop_id, N)
-        dep_str = csp.apply(
-            next_N_trains,
-            lambda x, key_=stop_id: entities_to_departure_board_str(x, key_),
-            str,
+        line_data = GTFSRealtimeInputAdapter(
+            line,
+            False,
+            recording=recordings.get(line, ""),
+            speed=speed,
+            selection=selections.get(line),
         )
-        csp.print("Departure Board", dep_str)
+        # the index and boards are built once per snapshot and shared by all platforms on the line;
+        # minutes are counted from engine time, so that replayed boards read as they did live
+        boards = departure_boards(stop_arrival_index(line_data), N)
+        board = departure_board_at(boards.changed, stop_id)
+        csp.print("Departure Board", csp.apply(board, lambda b: b.text, str))
+        if server is not None:
+            EventStreamOutputAdapter(board, server, "board", "stop_id")
 
 
 if __name__ == "__main__":
@@ -123,6 +88,31 @@ if __name__ == "__main__":
         default=5,
         help="Number of trains for each line to show on the departure board",
     )
+    parser.add_argument(
+        "--recordings",
+        type=str,
+        default=None,
+        help="Directory of recordings (see record_data.py) to replay instead of polling the realtime feeds",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Replay speed relative to wall-clock time when replaying recordings; 0 replays as fast as possible",
+    )
+
+    parser.add_argument(
+        "--select",
+        action="store_true",
+        default=False,
+        help="Only decode the trips calling at the given stations; faster on large multi-line feeds such as 1234567",
+    )
+    parser.add_argument(
+        "--serve",
+        type=int,
+        default=None,
+        help="Also stream the boards as Server-Sent Events from http://localhost:<port>/events",
+    )
 
     args = parser.parse_args()
     platforms = args.platforms
@@ -146,13 +136,26 @@ if __name__ == "__main__":
             raise ValueError(f"Did not recognize service {train_line}")
 
         # process stop_id
-        if stop_id not in STOP_INFO_DF.index:
+        if stop_id not in get_stop_info():
             raise ValueError(
                 f"Did not recognize stop_id {stop_id}: see stops.txt for valid stop_ids"
             )
 
         platforms_to_subscribe_to.append((stop_id, train_line))
 
+    recordings = {}
+    if args.recordings:
+        # recordings are named after their service, e.g. G_20240421_1854.parquet
+        for filename in glob.glob(os.path.join(args.recordings, "*.parquet")):
+            recordings[os.path.basename(filename).split("_")[0]] = filename
+        for _, train_line in platforms_to_subscribe_to:
+            if train_line not in recordings:
+                raise ValueError(f"No recording of service {train_line} in {args.recordings}")
+
+    server = None
+    if args.serve is not None:
+        server = EventStreamServer(port=args.serve)
+
     if show_graph:
         csp.show_graph(
             departure_board,
@@ -160,11 +163,28 @@ if __name__ == "__main__":
             num_trains,
             graph_filename="departure_board.png",
         )
-    if run_graph:
+    if run_graph and recordings:
+        starttime = min(
+            next(iter_recording(recordings[line]))[0] for _, line in platforms_to_subscribe_to
+        )
+        csp.run(
+            departure_board,
+            platforms_to_subscribe_to,
+            num_trains,
+            recordings,
+            args.speed,
+            server,
+            args.select,
+            starttime=starttime.replace(tzinfo=None),
+            endtime=timedelta(days=1),
+        )
+    elif run_graph:
         csp.run(
             departure_board,
             platforms_to_subscribe_to,
             num_trains,
+            server=server,
+            select=args.select,
             starttime=datetime.utcnow(),
             endtime=timedelta(minutes=1),
             realtime=True,
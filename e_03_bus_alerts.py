@@ -4,17 +4,15 @@ from datetime import datetime, timedelta
 
 import csp
 
-from csp_mta import ALERT_ENDPOINTS, MTA_FEED_UPDATE_TIME, JSONRealtimeInputAdapter
+from csp_mta import ALERT_ENDPOINTS, Alert, AlertsInputAdapter
 
 
 @csp.node
-def pretty_print_alerts(alerts: csp.ts[object]) -> csp.ts[str]:
+def pretty_print_alerts(alerts: csp.ts[[Alert]]) -> csp.ts[str]:
     all_alerts = []
-    for entity in alerts["entity"]:
-        route_id = entity["alert"]["informed_entity"][0]["route_id"]
-        all_alerts.append(
-            f'-- {route_id}: {entity["alert"]["header_text"]["translation"][0]["text"]}'
-        )
+    for alert in alerts:
+        route_id = alert.informed_entities[0].route_id
+        all_alerts.append(f"-- {route_id}: {alert.header_text}")
 
     all_alerts.sort()
     delimiter = "\n\n"
@@ -23,7 +21,7 @@ def pretty_print_alerts(alerts: csp.ts[object]) -> csp.ts[str]:
 
 @csp.graph
 def get_alerts(endpoint: str):
-    alert_adapter = JSONRealtimeInputAdapter(endpoint, MTA_FEED_UPDATE_TIME, False)
+    alert_adapter = AlertsInputAdapter(endpoint)
     alert_panel = pretty_print_alerts(alert_adapter)
     csp.print("Realtime Alerts", alert_panel)
 
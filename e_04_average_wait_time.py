@@ -2,8 +2,7 @@
 
 import argparse
 import csp
-from csp.adapters.parquet import ParquetReader
-from csp_mta import gtfs_realtime_pb2, STOP_INFO_DF
+from csp_mta import GTFSReplayInputAdapter, StopArrivalIndex, get_stop_info, sketch_quantiles, stop_arrival_index, to_epoch_seconds
 
 from datetime import datetime, timedelta
 from matplotlib import pyplot as plt
@@ -15,66 +14,33 @@ ET = pytz.timezone('America/New_York')
 
 
 @csp.node
-def raw_bytes_to_gtfs_message(raw: csp.ts[str]) -> csp.ts[object]:
-    feed = gtfs_realtime_pb2.FeedMessage()
-    feed.ParseFromString(raw.encode("latin-1"))
-    return feed
-
-
-def get_stop_time_at_station(entity, stop_id, direction):
-    """
-    Helper Python function to get the stop time at a station
-    Same as e_01 helper except that this one is directional
-    """
-    if entity.HasField("trip_update"):
-        stop_time_updates = entity.trip_update.stop_time_update
-        for update in stop_time_updates:
-            # could be N or S
-            if update.stop_id == stop_id + direction:
-                return update.arrival.time
-    return None
-
-
-@csp.node
-def wait_time(feed_msgs: csp.ts[object], stop_id: str) -> csp.Outputs(
+def wait_time(arrivals: csp.ts[StopArrivalIndex], stop_id: str) -> csp.Outputs(
     uptown_wait=csp.ts[timedelta], downtown_wait=csp.ts[timedelta]
 ):
     """
     Posted wait time in both directions from the stop - not really "true" wait time since we don't check
     if the trains actually arrived when they said they would.
     """
-    n_min, s_min = timedelta.max, timedelta.max
-    for entity in feed_msgs.entity:
-        for direction in ("N", "S"):
-            t = get_stop_time_at_station(entity, stop_id, direction)
-            if t is not None:
-                # Some careful notes on timing in csp...
-                # The stop time that we load from file is in Eastern time since that's what the MTA reports it as
-                # But csp.now() and the engine time (which is recorded in our parquet files) uses UTC!
-                # Thus, be very careful about comparing them, making sure to localize first
-
-                stop_time = ET.localize(datetime.fromtimestamp(t))
-                current_time = pytz.timezone('UTC').localize(csp.now())
-                wait = stop_time - current_time
-                if wait >= timedelta(0):
-                    if direction == "N":
-                        n_min = min(n_min, wait)
-                    else:
-                        s_min = min(s_min, wait)
-
-    if n_min != timedelta.max and s_min != timedelta.max:
-        return csp.output(uptown_wait=n_min, downtown_wait=s_min)
+    # Some careful notes on timing in csp...
+    # csp.now() and the engine time (which is recorded in our parquet files) are naive UTC datetimes,
+    # while the feed reports stop times as epoch seconds. Convert the engine time to epoch seconds
+    # so that the comparison does not depend on the local timezone
+    current_time = to_epoch_seconds(csp.now())
+    n_next = arrivals.next_arrivals(stop_id + "N", current_time, 1)
+    s_next = arrivals.next_arrivals(stop_id + "S", current_time, 1)
+    if n_next and s_next:
+        return csp.output(
+            uptown_wait=timedelta(seconds=n_next[0].arrival_time - current_time),
+            downtown_wait=timedelta(seconds=s_next[0].arrival_time - current_time),
+        )
 
 
 @csp.graph
 def hourly_wait_times(filename: str, stop_id: str) -> csp.Outputs(
-    mean=csp.ts[float], std=csp.ts[float]
+    mean=csp.ts[float], std=csp.ts[float], quantiles=csp.ts[[float]]
 ):
-    raw_bytes = ParquetReader(
-        filename_or_list=filename, time_column="time"
-    ).subscribe_all(typ=str, field_map="msg")
-    gtfs = raw_bytes_to_gtfs_message(raw_bytes)
-    wait_times = wait_time(gtfs, stop_id)
+    gtfs = GTFSReplayInputAdapter(filename)
+    wait_times = wait_time(stop_arrival_index(gtfs), stop_id)
     # Calculate the average and standard deviation for each bucket
     bidirectional_wait_times = csp.flatten(
         [
@@ -97,7 +63,10 @@ def hourly_wait_times(filename: str, stop_id: str) -> csp.Outputs(
         trigger=trigger,
     )
 
-    return csp.output(mean=avg_wait_time, std=std_wait_time)
+    # wait times are skewed, so also track the median and tail, in constant memory
+    quantiles = sketch_quantiles(bidirectional_wait_times, trigger, [0.5, 0.9]).values
+
+    return csp.output(mean=avg_wait_time, std=std_wait_time, quantiles=quantiles)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -133,13 +102,16 @@ if __name__ == "__main__":
     # Hourly wait times over the window (7PM Sun night to 6AM Monday morning)
     mean_wait_times_by_hour = np.array(res["mean"])[:,1] / 60 # convert to minutes
     std_wait_times_by_hour = np.array(res["std"])[:,1] / 60
+    p90_wait_times_by_hour = np.array([q[1] for _, q in res["quantiles"]]) / 60
 
     # Plotting the average and standard deviation
     format_str = "%Y-%m-%d %H:%M:%S"
     date_range = pd.date_range(start='2024-04-21-19:00', end='2024-04-22-05:00', freq='h')
-    plt.errorbar(date_range, mean_wait_times_by_hour, yerr=std_wait_times_by_hour, fmt='o-', color='b', ecolor='lightgray', capsize=4)
+    plt.errorbar(date_range, mean_wait_times_by_hour, yerr=std_wait_times_by_hour, fmt='o-', color='b', ecolor='lightgray', capsize=4, label='mean')
+    plt.plot(date_range, p90_wait_times_by_hour, 'x--', color='r', label='90th percentile')
+    plt.legend()
     
-    plt.title(f'Station {STOP_INFO_DF.loc[args.stop_id, "stop_name"]} between {start.strftime(format_str)} and {end.strftime(format_str)}')
+    plt.title(f'Station {get_stop_info().name(args.stop_id)} between {start.strftime(format_str)} and {end.strftime(format_str)}')
     plt.xlabel('time')
     plt.ylabel('average wait (minutes)')
     
@@ -9,8 +9,9 @@ from datetime import datetime, timedelta
 
 from csp_mta import (
     MTA_FEED_UPDATE_TIME,
-    GTFSRealtimeInputAdapter,
+    GTFSRealtimeRawInputAdapter,
     JSONRealtimeInputAdapter,
+    write_recording,
 )
 
 
@@ -21,7 +22,13 @@ def cast_to_str(data: csp.ts[object]) -> csp.ts[str]:
 
 
 @csp.graph
-def record(filename: str, service: str = "", endpoint: str = ""):
+def record(
+    filename: str,
+    service: str = "",
+    endpoint: str = "",
+    binary: bool = False,
+    keyframe_interval: int = 0,
+):
     # Simple graph to record data and write to Parquet
     if service and endpoint or not (service or endpoint):
         raise ValueError(
@@ -29,15 +36,17 @@ def record(filename: str, service: str = "", endpoint: str = ""):
         )
 
     if service:
-        raw_bytes = GTFSRealtimeInputAdapter(service, True)
+        raw_bytes = GTFSRealtimeRawInputAdapter(service)
     else:
-        raw_bytes = JSONRealtimeInputAdapter(
-            endpoint, MTA_FEED_UPDATE_TIME.total_seconds(), True
-        )
+        raw_bytes = JSONRealtimeInputAdapter(endpoint, MTA_FEED_UPDATE_TIME, True)
 
-    msg = cast_to_str(raw_bytes)
-    pq = ParquetWriter(file_name=filename, timestamp_column_name="time")
-    pq.publish("msg", msg)
+    if binary:
+        # zstd-compressed binary column, skipping identical snapshots
+        write_recording(raw_bytes, filename, keyframe_interval)
+    else:
+        msg = cast_to_str(raw_bytes)
+        pq = ParquetWriter(file_name=filename, timestamp_column_name="time")
+        pq.publish("msg", msg)
 
 
 if __name__ == "__main__":
@@ -60,6 +69,18 @@ if __name__ == "__main__":
     parser.add_argument(
         "--minutes_to_run", type=int, default=None, help="Minutes to run for"
     )
+    parser.add_argument(
+        "--binary",
+        action="store_true",
+        default=False,
+        help="Write a compressed binary recording instead of latin-1 strings",
+    )
+    parser.add_argument(
+        "--keyframe_interval",
+        type=int,
+        default=0,
+        help="With --binary, number of snapshots to store as deltas after each full snapshot",
+    )
 
     args = parser.parse_args()
     duration = timedelta(minutes=args.minutes_to_run)
@@ -70,6 +91,8 @@ if __name__ == "__main__":
         args.out_file,
         args.service or "",
         args.endpoint or "",
+        args.binary,
+        args.keyframe_interval,
         starttime=datetime.utcnow(),
         endtime=duration,
         realtime=True,
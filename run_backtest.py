@@ -0,0 +1,67 @@
+# Network-wide wait time and headway backtest over all of the recordings in recorded_data/, run in parallel
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from csp_mta import NYC_TIMEZONE, run_backtest
+
+
+def _nyc_time(s):
+    """Naive UTC datetime for an ISO format NYC local time"""
+    return NYC_TIMEZONE.localize(datetime.fromisoformat(s)).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--root",
+        type=str,
+        default="recorded_data",
+        help="Directory to search for recordings",
+    )
+    parser.add_argument(
+        "--services",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Services to backtest, all recorded services if not given",
+    )
+    parser.add_argument(
+        "--start", type=_nyc_time, default=None, help="NYC local start time, e.g. 2024-04-21T19:00"
+    )
+    parser.add_argument(
+        "--end", type=_nyc_time, default=None, help="NYC local end time, e.g. 2024-04-22T06:00"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes, one per core if not given",
+    )
+    parser.add_argument(
+        "--slice_hours",
+        type=float,
+        default=6,
+        help="Length of the time slices recordings are split into",
+    )
+    parser.add_argument(
+        "--sketches",
+        action="store_true",
+        default=False,
+        help="Add p50/p90/p99 columns",
+    )
+    parser.add_argument(
+        "--output", type=str, default="backtest.csv", help="CSV file to write the results to"
+    )
+    args = parser.parse_args()
+
+    results = run_backtest(
+        args.root,
+        services=args.services,
+        starttime=args.start,
+        endtime=args.end,
+        workers=args.workers,
+        slice_length=timedelta(hours=args.slice_hours),
+        sketches=args.sketches,
+    )
+    results.to_csv(args.output, index=False)
+    print(f"Wrote {len(results)} rows for services {', '.join(results.service.unique())} to {args.output}")
@@ -0,0 +1,303 @@
+# Offline benchmarks which replay the recordings in recorded_data/ through the package's hot paths
+# Results can be saved as JSON and compared against a baseline run to catch performance regressions
+
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import csp
+import numpy as np
+import pyarrow.parquet as pq
+from csp import ts
+
+from csp_mta import (
+    DepartureBoardCache,
+    FeedSelection,
+    GTFSReplayInputAdapter,
+    StopArrivalIndex,
+    WaitTimeBacktest,
+    decode_feed_message,
+    iter_recording,
+    recorded_snapshots,
+    stop_arrival_index,
+    to_epoch_seconds,
+    write_recording,
+)
+
+DEFAULT_RECORDINGS = "recorded_data/2024-04-21-18:54_to_2024-04-22-06:54"
+# a busy station on each recorded line
+BENCHMARK_STOPS = {"G": "G22", "L": "L10", "SI": "S31"}
+NEXT_N = 3
+
+
+def _service(filename):
+    return os.path.basename(filename).split("_")[0]
+
+
+def _time_range(filename, limit):
+    times = pq.read_table(filename, columns=["time"]).column("time").to_pylist()
+    if limit:
+        times = times[:limit]
+    return times[0], times[-1]
+
+
+def _snapshots(filename, limit):
+    snapshots = []
+    for snapshot in iter_recording(filename):
+        snapshots.append(snapshot)
+        if limit and len(snapshots) == limit:
+            break
+    return snapshots
+
+
+def _time_each(func, items):
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_decode(filename, limit):
+    """Protobuf decode of each raw snapshot"""
+    contents = [content for _, content in _snapshots(filename, limit)]
+    return _time_each(decode_feed_message, contents)
+
+
+def bench_stop_index(filename, limit):
+    """Build the per-stop arrival index for a snapshot and query the next trains in both directions"""
+    stop_id = BENCHMARK_STOPS[_service(filename)]
+    feeds = [
+        (to_epoch_seconds(t), decode_feed_message(content))
+        for t, content in _snapshots(filename, limit)
+    ]
+
+    def query(item):
+        now, feed = item
+        index = StopArrivalIndex(feed)
+        index.next_arrivals(stop_id + "N", now, NEXT_N)
+        index.next_arrivals(stop_id + "S", now, NEXT_N)
+
+    return _time_each(query, feeds)
+
+
+def bench_selected_stop_index(filename, limit):
+    """As stop_index, including decoding only the trip updates calling at the station"""
+    stop_id = BENCHMARK_STOPS[_service(filename)]
+    selection = FeedSelection(stop_ids=[stop_id], entity_types=["trip_update"])
+    snapshots = [(to_epoch_seconds(t), content) for t, content in _snapshots(filename, limit)]
+
+    def query(item):
+        now, content = item
+        index = StopArrivalIndex(selection(content))
+        index.next_arrivals(stop_id + "N", now, NEXT_N)
+        index.next_arrivals(stop_id + "S", now, NEXT_N)
+
+    return _time_each(query, snapshots)
+
+
+def bench_departure_boards(filename, limit):
+    """Update the departure boards of every stop from each snapshot's arrival index, excluding decoding"""
+    cache = DepartureBoardCache(NEXT_N)
+    indexes = [
+        (StopArrivalIndex(decode_feed_message(content)), to_epoch_seconds(t))
+        for t, content in _snapshots(filename, limit)
+    ]
+    return _time_each(lambda item: cache.update(*item), indexes)
+
+
+def bench_backtest(filename, limit):
+    """Wait time and headway backtest of all stops, per snapshot, excluding decoding"""
+    backtest = WaitTimeBacktest()
+    snapshots = [
+        (to_epoch_seconds(t), backtest.decoder.decode_bytes(content))
+        for t, content in _snapshots(filename, limit)
+    ]
+    return _time_each(lambda snapshot: backtest.update(*snapshot), snapshots)
+
+
+@csp.node
+def _stamp(trigger: ts[object], after: ts[object], stamps: list):
+    # depends on the last node of the graph, so runs at the end of each engine cycle
+    if csp.ticked(trigger):
+        stamps.append(time.perf_counter())
+
+
+def _run_graph(graph, filename, limit):
+    """Per engine cycle wall time of a graph replaying a recording"""
+    starttime, endtime = _time_range(filename, limit)
+    stamps = []
+    csp.run(graph, filename, stamps, starttime=starttime, endtime=endtime)
+    # the first cycle is left out, as it would include starting the engine
+    return np.diff(stamps).tolist()
+
+
+def bench_wait_time(filename, limit):
+    """The wait_time node of e_04 over a replay, including snapshot decoding"""
+    from e_04_average_wait_time import wait_time
+
+    stop_id = BENCHMARK_STOPS[_service(filename)]
+
+    @csp.graph
+    def graph(filename: str, stamps: list):
+        gtfs = GTFSReplayInputAdapter(filename)
+        wait_times = wait_time(stop_arrival_index(gtfs), stop_id)
+        _stamp(gtfs, csp.flatten([wait_times.uptown_wait, wait_times.downtown_wait]), stamps)
+
+    return _run_graph(graph, filename, limit)
+
+
+def bench_recording_writer(filename, limit):
+    """Replay raw snapshots and write them to a binary recording"""
+    with tempfile.TemporaryDirectory() as tmp:
+
+        @csp.graph
+        def graph(filename: str, stamps: list):
+            raw = recorded_snapshots(filename)
+            write_recording(raw, os.path.join(tmp, "recording.parquet"))
+            _stamp(raw, raw, stamps)
+
+        return _run_graph(graph, filename, limit)
+
+
+BENCHMARKS = {
+    "decode": bench_decode,
+    "stop_index": bench_stop_index,
+    "selected_stop_index": bench_selected_stop_index,
+    "departure_boards": bench_departure_boards,
+    "backtest": bench_backtest,
+    "wait_time": bench_wait_time,
+    "recording_writer": bench_recording_writer,
+}
+
+
+def run_benchmark(name, filename, limit, memory):
+    func = BENCHMARKS[name]
+    latencies = np.array(func(filename, limit))
+    result = {
+        "benchmark": name,
+        "service": _service(filename),
+        "ticks": len(latencies),
+        "seconds": float(latencies.sum()),
+        "throughput": float(len(latencies) / latencies.sum()),
+        "p50_ms": float(np.percentile(latencies, 50) * 1e3),
+        "p99_ms": float(np.percentile(latencies, 99) * 1e3),
+    }
+    if memory:
+        # peak Python heap, including loading the benchmark's inputs; tracemalloc slows everything down,
+        # so memory is measured in a separate pass
+        tracemalloc.start()
+        func(filename, limit)
+        result["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result
+
+
+def compare(results, baseline, max_regression):
+    """Print throughput relative to a baseline run, returning the results which regressed"""
+    baseline = {(r["benchmark"], r["service"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        base = baseline.get((result["benchmark"], result["service"]))
+        if base is None:
+            continue
+        ratio = result["throughput"] / base["throughput"]
+        flag = ""
+        if ratio < 1 - max_regression:
+            regressions.append(result)
+            flag = "  REGRESSION"
+        print(f"{result['benchmark']:>18} {result['service']:>3}: {ratio:6.2f}x baseline throughput{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--recordings",
+        type=str,
+        default=DEFAULT_RECORDINGS,
+        help="Directory of recordings to replay",
+    )
+    parser.add_argument(
+        "--benchmarks",
+        type=str,
+        nargs="+",
+        default=list(BENCHMARKS),
+        choices=list(BENCHMARKS),
+        help="Benchmarks to run",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=None,
+        help="Maximum number of snapshots to replay per recording",
+    )
+    parser.add_argument(
+        "--no_memory",
+        action="store_true",
+        default=False,
+        help="Skip the peak memory pass",
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="Write the results to a JSON file"
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="JSON results of a previous run to compare throughput against",
+    )
+    parser.add_argument(
+        "--max_regression",
+        type=float,
+        default=0.1,
+        help="Fraction of baseline throughput which may be lost before failing",
+    )
+    args = parser.parse_args()
+
+    filenames = sorted(
+        f for f in glob.glob(os.path.join(args.recordings, "*.parquet"))
+        if _service(f) in BENCHMARK_STOPS
+    )
+    results = []
+    for name in args.benchmarks:
+        for filename in filenames:
+            result = run_benchmark(name, filename, args.limit, not args.no_memory)
+            results.append(result)
+            memory = f"{result['peak_memory_mb']:8.1f} MB" if "peak_memory_mb" in result else ""
+            print(
+                f"{name:>18} {result['service']:>3}: {result['ticks']:6d} ticks "
+                f"{result['throughput']:10.1f}/s p50 {result['p50_ms']:8.3f} ms p99 {result['p99_ms']:8.3f} ms {memory}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "meta": {
+                        "time": datetime.now(timezone.utc).isoformat(),
+                        "python": platform.python_version(),
+                        "csp": getattr(csp, "__version__", ""),
+                        "platform": platform.platform(),
+                        "recordings": args.recordings,
+                        "limit": args.limit,
+                    },
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.max_regression):
+            sys.exit(1)
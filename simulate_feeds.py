@@ -0,0 +1,76 @@
+# Serves recorded feeds locally as a stand-in for the MTA's realtime API, for load and latency testing
+import argparse
+import glob
+import os
+
+from csp_mta import FeedSimulator
+
+DEFAULT_RECORDINGS = "recorded_data/2024-04-21-18:54_to_2024-04-22-06:54"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--recordings",
+        type=str,
+        default=DEFAULT_RECORDINGS,
+        help="Directory of recordings to serve, one per service",
+    )
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Recorded seconds replayed per second",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds to wait before answering each request",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="Up to this many more seconds, at random, to wait before answering",
+    )
+    parser.add_argument(
+        "--error_rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests answered with 503 Service Unavailable",
+    )
+    parser.add_argument(
+        "--retry_after",
+        type=int,
+        default=None,
+        help="Seconds the 503 responses ask clients to wait before retrying",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=None, help="Seed for the random jitter and errors"
+    )
+    parser.add_argument(
+        "--no_loop",
+        action="store_true",
+        default=False,
+        help="Keep serving the last snapshot once a recording ends, rather than starting it over",
+    )
+    args = parser.parse_args()
+
+    simulator = FeedSimulator(
+        sorted(glob.glob(os.path.join(args.recordings, "*.parquet"))),
+        speed=args.speed,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+        loop=not args.no_loop,
+        port=args.port,
+    )
+    print(f"Serving {args.recordings}; to poll it run: export CSP_MTA_API_BASE={simulator.url}")
+    try:
+        simulator.run()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,56 @@
+"""Builders for small GTFS-rt feeds, and paths to the recordings under recorded_data/"""
+
+import os
+
+from csp_mta.compiled_protobuf import nyct_subway_pb2
+from csp_mta.compiled_protobuf.gtfs_realtime_pb2 import FeedMessage
+
+RECORDED_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "recorded_data")
+RECORDING_DIR = os.path.join(RECORDED_DATA, "2024-04-21-18:54_to_2024-04-22-06:54")
+
+
+def recording(service):
+    """The overnight recording of a service, e.g. G"""
+    return os.path.join(RECORDING_DIR, f"{service}_20240421_1854.parquet")
+
+
+def make_feed(timestamp, trips=(), vehicles=(), alerts=()):
+    """
+    A FeedMessage at timestamp (epoch seconds)
+
+    Args:
+        trips: (trip_id, route_id, direction, [(stop_id, arrival, departure)]) of each trip update; 0 leaves a
+            time unset
+        vehicles: (trip_id, stop_id, current_status, timestamp) of each vehicle position
+        alerts: (route_ids, stop_ids) informed by each alert
+    """
+    feed = FeedMessage()
+    feed.header.gtfs_realtime_version = "1.0"
+    feed.header.timestamp = timestamp
+    for trip_id, route_id, direction, stops in trips:
+        entity = feed.entity.add(id=f"trip_{trip_id}")
+        trip = entity.trip_update.trip
+        trip.trip_id = trip_id
+        trip.route_id = route_id
+        trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor].direction = direction
+        for stop_id, arrival, departure in stops:
+            update = entity.trip_update.stop_time_update.add(stop_id=stop_id)
+            if arrival:
+                update.arrival.time = arrival
+            if departure:
+                update.departure.time = departure
+    for trip_id, stop_id, status, vehicle_timestamp in vehicles:
+        entity = feed.entity.add(id=f"vehicle_{trip_id}")
+        vehicle = entity.vehicle
+        vehicle.trip.trip_id = trip_id
+        vehicle.stop_id = stop_id
+        vehicle.current_status = status
+        if vehicle_timestamp:
+            vehicle.timestamp = vehicle_timestamp
+    for i, (route_ids, stop_ids) in enumerate(alerts):
+        entity = feed.entity.add(id=f"alert_{i}")
+        for route_id in route_ids:
+            entity.alert.informed_entity.add(route_id=route_id)
+        for stop_id in stop_ids:
+            entity.alert.informed_entity.add(stop_id=stop_id)
+    return feed
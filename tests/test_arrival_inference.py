@@ -0,0 +1,94 @@
+import itertools
+
+from csp_mta import ArrivalInferenceEngine, iter_recording
+from csp_mta.compiled_protobuf.gtfs_realtime_pb2 import VehiclePosition
+from csp_mta.GTFSInputAdapter import decode_feed_message
+
+from .feeds import make_feed, recording
+
+STOPPED_AT = VehiclePosition.STOPPED_AT
+IN_TRANSIT_TO = VehiclePosition.IN_TRANSIT_TO
+NORTH = 1
+
+
+def _arrivals(arrivals):
+    return [(a.trip_id, a.stop_id, a.arrival_time, a.departure_time, a.observed, a.timestamp) for a in arrivals]
+
+
+def test_stops_dropping_off_a_trip_are_passed():
+    engine = ArrivalInferenceEngine()
+    stops = [("A", 1100, 1110), ("B", 1200, 1210), ("C", 1300, 0)]
+    assert engine.update(make_feed(1000, trips=[("t1", "G", NORTH, stops)])) == []
+
+    # A dropped out: it is timed by its last prediction, and departed when last predicted to
+    arrivals = engine.update(make_feed(1150, trips=[("t1", "G", NORTH, stops[1:])]))
+    assert _arrivals(arrivals) == [("t1", "A", 1100, 1110, False, 1150)]
+    assert arrivals[0].route_id == "G"
+    assert arrivals[0].direction == NORTH
+
+    # a late train: B's prediction is capped at the snapshot it was seen to be passed in
+    late = [("B", 1300, 1310), ("C", 1400, 0)]
+    engine.update(make_feed(1250, trips=[("t1", "G", NORTH, late)]))
+    arrivals = engine.update(make_feed(1280, trips=[("t1", "G", NORTH, late[1:])]))
+    assert _arrivals(arrivals) == [("t1", "B", 1280, 1280, False, 1280)]
+
+    # the last stop is passed when the trip leaves the feed, and the trip is then dropped
+    assert len(engine) == 1
+    for now in (1410, 1420):
+        assert engine.update(make_feed(now)) == []
+    assert _arrivals(engine.update(make_feed(1430))) == [("t1", "C", 1400, 1400, False, 1430)]
+    assert len(engine) == 0
+
+
+def test_vehicle_positions_time_arrivals():
+    engine = ArrivalInferenceEngine()
+    engine.update(make_feed(1000, trips=[("t1", "G", NORTH, [("A", 1100, 1110), ("B", 1200, 1210), ("C", 1300, 0)])]))
+
+    # stopped at B: A has been passed, and B's arrival is the vehicle's timestamp
+    feed = make_feed(
+        1204,
+        trips=[("t1", "G", NORTH, [("B", 1203, 1215), ("C", 1300, 0)])],
+        vehicles=[("t1", "B", STOPPED_AT, 1203)],
+    )
+    assert _arrivals(engine.update(feed)) == [("t1", "A", 1100, 1110, False, 1204)]
+
+    feed = make_feed(
+        1260,
+        trips=[("t1", "G", NORTH, [("C", 1300, 0)])],
+        vehicles=[("t1", "C", IN_TRANSIT_TO, 1255)],
+    )
+    assert _arrivals(engine.update(feed)) == [("t1", "B", 1203, 1215, True, 1260)]
+
+
+def test_stops_due_in_the_future_are_not_passed_when_a_trip_is_evicted():
+    engine = ArrivalInferenceEngine(max_missing=0)
+    engine.update(make_feed(1000, trips=[("t1", "G", NORTH, [("A", 1100, 1110), ("B", 1200, 0)])]))
+    assert _arrivals(engine.update(make_feed(1150))) == [("t1", "A", 1100, 1110, False, 1150)]
+    assert len(engine) == 0
+
+
+def test_reinstated_trips_do_not_publish_stops_twice():
+    engine = ArrivalInferenceEngine(max_missing=0)
+    stops = [("A", 1100, 1110), ("B", 1200, 0)]
+    engine.update(make_feed(1000, trips=[("t1", "G", NORTH, stops)]))
+    assert len(engine.update(make_feed(1250))) == 2
+    # the trip is back, still listing the stops it has passed
+    assert engine.update(make_feed(1260, trips=[("t1", "G", NORTH, stops)])) == []
+    assert engine.update(make_feed(1270, trips=[("t1", "G", NORTH, stops[1:])])) == []
+
+
+def test_recorded_arrivals_are_consistent():
+    engine = ArrivalInferenceEngine()
+    seen = set()
+    count = 0
+    for _, content in itertools.islice(iter_recording(recording("G")), 600):
+        feed = decode_feed_message(content)
+        for arrival in engine.update(feed):
+            count += 1
+            # each stop of a trip is published once
+            key = (arrival.trip_id, arrival.stop_id)
+            assert key not in seen
+            seen.add(key)
+            assert arrival.arrival_time <= arrival.departure_time <= arrival.timestamp
+    assert count > 100
+    assert len(engine) < 100
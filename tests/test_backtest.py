@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import csp
+from csp import ts
+
+from csp_mta import FeedColumnsDecoder, GTFSColumnsReplayInputAdapter, QuantileSketch, run_backtest
+
+from .feeds import RECORDED_DATA, recording
+
+STARTTIME = datetime(2024, 4, 21, 23)
+ENDTIME = datetime(2024, 4, 22, 3)
+
+
+def _run(**kwargs):
+    return run_backtest(
+        RECORDED_DATA,
+        services=["G"],
+        starttime=STARTTIME,
+        endtime=ENDTIME,
+        slice_length=timedelta(hours=1),
+        **kwargs,
+    )
+
+
+def test_process_pool_matches_inline():
+    inline = _run(workers=0, sketches=True, aggregate=True)
+    pooled = _run(workers=2, sketches=True, aggregate=True)
+    assert len(inline) > 0
+    # shards are merged in the same order either way, so even the sketches are byte for byte the same
+    pd.testing.assert_frame_equal(inline, pooled)
+
+    summary = _run(workers=0)
+    pd.testing.assert_frame_equal(summary, _run(workers=2))
+    assert set(summary.service) == {"G"}
+    assert (summary["count"] > 0).all()
+    assert (summary["min"] <= summary["mean"]).all() and (summary["mean"] <= summary["max"]).all()
+
+
+def test_sketches_agree_with_moments():
+    aggregates = _run(workers=0, sketches=True, aggregate=True)
+    for row in aggregates.itertuples():
+        sketch = QuantileSketch.from_bytes(row.sketch)
+        assert sketch.count == row.count
+        assert (sketch.min, sketch.max) == (row.min, row.max)
+
+
+def test_empty_time_range_has_the_same_columns():
+    before = datetime(2020, 1, 1)
+    for kwargs in (dict(), dict(sketches=True, aggregate=True)):
+        expected = _run(workers=0, **kwargs)
+        empty = run_backtest(
+            RECORDED_DATA, services=["G"], starttime=before, endtime=before + timedelta(hours=1), workers=0, **kwargs
+        )
+        assert len(empty) == 0
+        assert list(empty.columns) == list(expected.columns)
+
+
+def _replay_columns(workers):
+    decoder = FeedColumnsDecoder()
+    ticks = []
+
+    @csp.node
+    def collect(columns: ts[object]):
+        if csp.ticked(columns):
+            ticks.append(
+                (
+                    columns.timestamp,
+                    np.array(decoder.trips.strings)[columns.trip].tolist(),
+                    np.array(decoder.stops.strings)[columns.stop].tolist(),
+                    columns.arrival.tolist(),
+                    columns.departure.tolist(),
+                    columns.direction.tolist(),
+                )
+            )
+
+    def graph():
+        collect(GTFSColumnsReplayInputAdapter(recording("L"), workers=workers, prefetch=8, decoder=decoder))
+
+    csp.run(graph, starttime=STARTTIME, endtime=STARTTIME + timedelta(minutes=20))
+    return ticks
+
+
+def test_replay_decodes_the_same_columns_in_a_pool():
+    inline = _replay_columns(0)
+    assert len(inline) > 10
+    assert _replay_columns(2) == inline
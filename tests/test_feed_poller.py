@@ -0,0 +1,88 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+from csp_mta import FeedPoller, FeedSimulator
+from csp_mta.GTFSInputAdapter import decode_feed_message, peek_feed_timestamp
+from csp_mta.mta_util import LINE_TO_ENDPOINT
+
+from .feeds import recording
+
+
+def _simulator(**kwargs):
+    # the first snapshot is served for the whole test
+    return FeedSimulator({"G": recording("G")}, speed=1e-6, port=0, **kwargs)
+
+
+def _endpoint(sim):
+    return sim.url + urlsplit(LINE_TO_ENDPOINT["G"]).path
+
+
+def _wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def test_unchanged_snapshots_are_not_modified():
+    feeds = []
+    metrics = []
+    poller = FeedPoller()
+    with _simulator() as sim:
+        subscription = poller.subscribe(
+            _endpoint(sim),
+            1.0,
+            feeds.append,
+            decoder=decode_feed_message,
+            version=peek_feed_timestamp,
+            metrics_callback=metrics.append,
+        )
+        try:
+            assert _wait_for(lambda: sim.num_not_modified >= 2)
+        finally:
+            poller.unsubscribe(subscription)
+
+    # the poller sent the ETag it was served, and the unchanged snapshot was not delivered again
+    assert len(feeds) == 1
+    assert len(feeds[0].entity) > 0
+    assert metrics[0].status_code == 200 and metrics[0].changed
+    assert metrics[0].entity_count == len(feeds[0].entity)
+    assert [m.status_code for m in metrics[1:3]] == [304, 304]
+    assert not any(m.changed for m in metrics[1:])
+
+
+def test_unavailable_feeds_are_retried_after_the_time_asked_for():
+    received = threading.Event()
+    metrics = []
+    poller = FeedPoller()
+    with _simulator(error_rate=1.0, retry_after=2) as sim:
+        endpoint = _endpoint(sim)
+        subscription = poller.subscribe(
+            endpoint,
+            1.0,
+            lambda feed: received.set(),
+            decoder=decode_feed_message,
+            metrics_callback=metrics.append,
+        )
+        try:
+            time.sleep(3.0)
+            # without Retry-After, the backoff would have retried after at most 1 and 2 seconds
+            assert sim.num_requests == 2
+            assert [m.status_code for m in metrics] == [503, 503]
+            (status,) = poller.status()
+            assert status.endpoint == endpoint
+            assert status.consecutive_failures == 2
+            assert "503" in status.last_error
+            assert not received.is_set()
+
+            sim.error_rate = 0.0
+            assert received.wait(5.0)
+            (status,) = poller.status()
+            assert status.consecutive_failures == 0
+            assert status.last_poll_time is not None
+        finally:
+            poller.unsubscribe(subscription)
+    assert poller.status() == []
@@ -0,0 +1,125 @@
+import itertools
+
+import pytest
+
+from csp_mta import FeedSelection, iter_recording
+from csp_mta.GTFSInputAdapter import decode_feed_message
+
+from .feeds import make_feed, recording
+
+_ENTITY_TYPES = ("trip_update", "vehicle", "alert")
+
+
+def _entity_type(entity):
+    return next(t for t in _ENTITY_TYPES if entity.HasField(t))
+
+
+def _expected(feed, route_ids=None, stop_ids=None, entity_types=_ENTITY_TYPES):
+    """The entities a selection should keep, filtered from the fully decoded feed"""
+    platforms = None
+    if stop_ids is not None:
+        platforms = set(stop_ids) | {s + d for s in stop_ids for d in "NS"}
+
+    kept = []
+    trips = set()
+    for entity in feed.entity:
+        entity_type = _entity_type(entity)
+        if entity_type not in entity_types or entity_type != "trip_update":
+            continue
+        trip = entity.trip_update.trip
+        if route_ids is not None and trip.route_id not in route_ids:
+            continue
+        if platforms is not None and not any(
+            u.stop_id in platforms for u in entity.trip_update.stop_time_update
+        ):
+            continue
+        kept.append(entity)
+        trips.add(trip.trip_id)
+
+    for entity in feed.entity:
+        entity_type = _entity_type(entity)
+        if entity_type not in entity_types or entity_type == "trip_update":
+            continue
+        if entity_type == "vehicle":
+            vehicle = entity.vehicle
+            if route_ids is not None and vehicle.trip.route_id not in route_ids:
+                continue
+            if platforms is not None and not (
+                vehicle.trip.trip_id in trips or vehicle.stop_id in platforms
+            ):
+                continue
+        else:
+            informed = entity.alert.informed_entity
+            if route_ids is not None and not any(e.route_id in route_ids for e in informed):
+                continue
+            if platforms is not None and not any(e.stop_id in platforms for e in informed):
+                continue
+        kept.append(entity)
+    return kept
+
+
+def _assert_selects(selection, content, **kwargs):
+    feed = decode_feed_message(content)
+    selected = selection(content)
+    assert selected.header == feed.header
+    expected = _expected(feed, **kwargs)
+    assert sorted(e.SerializeToString() for e in selected.entity) == sorted(
+        e.SerializeToString() for e in expected
+    )
+
+
+@pytest.mark.parametrize(
+    "service, kwargs",
+    [
+        ("G", dict(stop_ids=["G22"])),
+        ("G", dict(stop_ids=["G22N"], entity_types=["trip_update"])),
+        ("G", dict(stop_ids=["G22", "G29S"], entity_types=["trip_update", "vehicle"])),
+        ("L", dict(route_ids=["L"])),
+        ("L", dict(route_ids=["G"])),
+        ("L", dict(route_ids=["L"], stop_ids=["L08"])),
+        ("L", dict(entity_types=["vehicle"])),
+        ("SI", dict(stop_ids=["S31", "S09"])),
+    ],
+)
+def test_matches_full_decode_of_recording(service, kwargs):
+    selection = FeedSelection(**kwargs)
+    for _, content in itertools.islice(iter_recording(recording(service)), 0, 1500, 150):
+        _assert_selects(selection, content, **kwargs)
+
+
+def test_selects_alerts_by_route_and_stop():
+    feed = make_feed(
+        1000,
+        trips=[("t1", "G", 1, [("G22N", 1100, 1110)])],
+        alerts=[(["G"], []), (["L"], []), ([], ["G22"]), ([], ["L08N"])],
+    )
+    content = feed.SerializeToString()
+    for kwargs in (dict(route_ids=["G"]), dict(stop_ids=["G22"]), dict(entity_types=["alert"])):
+        _assert_selects(FeedSelection(**kwargs), content, **kwargs)
+
+
+def test_selects_ids_longer_than_a_single_byte_length():
+    stop_id = "X" * 200
+    route_id = "R" * 150
+    feed = make_feed(
+        1000,
+        trips=[
+            ("t1", route_id, 1, [(stop_id, 1100, 1110)]),
+            ("t2", "G", 1, [("G22N", 1100, 1110)]),
+        ],
+    )
+    content = feed.SerializeToString()
+    for kwargs in (dict(stop_ids=[stop_id]), dict(route_ids=[route_id])):
+        selected = FeedSelection(**kwargs)(content)
+        assert [e.id for e in selected.entity] == ["trip_t1"]
+
+
+def test_equal_selections_share_a_key():
+    assert FeedSelection(stop_ids=["G22"]) == FeedSelection(stop_ids=("G22",))
+    assert hash(FeedSelection(route_ids=["G"])) == hash(FeedSelection(route_ids={"G"}))
+    assert FeedSelection(stop_ids=["G22"]) != FeedSelection(stop_ids=["G22"], entity_types=["trip_update"])
+
+
+def test_rejects_unknown_entity_types():
+    with pytest.raises(ValueError):
+        FeedSelection(entity_types=["trip"])
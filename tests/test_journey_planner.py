@@ -0,0 +1,146 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from csp_mta import JourneyPlanner, iter_recording
+from csp_mta.GTFSInputAdapter import decode_feed_message
+from csp_mta.reference_data import StopInfo, TransferInfo
+
+from .feeds import make_feed, recording
+
+STATIONS = ["A", "B", "C", "D", "E", "F"]
+
+
+def _network():
+    stop_ids = STATIONS + ["AN"]
+    stop_info = StopInfo(
+        stop_ids=stop_ids,
+        names=[f"Station {s}" for s in stop_ids],
+        lat=np.zeros(len(stop_ids)),
+        lon=np.zeros(len(stop_ids)),
+        location_type=np.array([1] * len(STATIONS) + [0], dtype=np.int8),
+        parent=np.array([-1] * len(STATIONS) + [0], dtype=np.int32),
+    )
+    # walk C -> D and D -> F, and a quick change of trains at B
+    transfers = [("C", "D", 120), ("D", "F", 200), ("B", "B", 60)]
+    transfer_info = TransferInfo(
+        stop_info,
+        np.array([stop_info.code(src) for src, _, _ in transfers], dtype=np.int32),
+        np.array([stop_info.code(dst) for _, dst, _ in transfers], dtype=np.int32),
+        np.full(len(transfers), 2, dtype=np.int8),
+        np.array([time for _, _, time in transfers], dtype=np.int32),
+    )
+    return stop_info, transfer_info
+
+
+G_TRIPS = [
+    ("T1", "G", 1, [("A", 0, 1000), ("B", 1100, 1100), ("C", 1200, 0)]),
+    # leaves B before the change time there has passed
+    ("T2", "G", 1, [("B", 0, 1150), ("E", 1400, 0)]),
+    ("T3", "G", 1, [("B", 0, 1170), ("E", 1500, 0)]),
+]
+L_TRIPS = [("T4", "L", 1, [("D", 0, 1330), ("E", 1450, 0)])]
+
+
+@pytest.fixture
+def planner():
+    planner = JourneyPlanner(*_network())
+    planner.update("G", make_feed(900, trips=G_TRIPS))
+    planner.update("L", make_feed(900, trips=L_TRIPS))
+    return planner
+
+
+def _legs(journey):
+    return [
+        (leg.trip_id, leg.from_stop_id, leg.to_stop_id, leg.departure_time, leg.arrival_time) for leg in journey.legs
+    ]
+
+
+def test_earliest_arrival_walks_between_services(planner):
+    journey = planner.earliest_arrival("A", "E", 900)
+    assert journey.arrival_time == 1450
+    assert _legs(journey) == [
+        ("T1", "A", "C", 1000, 1200),
+        ("", "C", "D", 1200, 1320),
+        ("T4", "D", "E", 1330, 1450),
+    ]
+    assert journey.legs[0].route_id == "G"
+    assert journey.legs[2].route_id == "L"
+    # platforms plan from their station
+    assert _legs(planner.earliest_arrival("AN", "E", 900)) == _legs(journey)
+
+
+def test_max_transfers_limits_changes_of_train(planner):
+    assert planner.earliest_arrival("A", "E", 900, max_transfers=0) is None
+    assert planner.earliest_arrival("A", "C", 900, max_transfers=0).arrival_time == 1200
+    assert planner.earliest_arrival("A", "E", 900, max_transfers=1).arrival_time == 1450
+
+
+def test_trains_departing_too_early_are_missed(planner):
+    assert planner.earliest_arrival("A", "E", 1001) is None
+
+
+def test_walks_are_not_chained(planner):
+    # F is a walk on from D, which is itself only reached on foot
+    assert planner.earliest_arrival("A", "F", 900) is None
+    assert planner.earliest_arrival("C", "F", 900) is None
+    assert _legs(planner.earliest_arrival("C", "D", 900)) == [("", "C", "D", 900, 1020)]
+
+
+def test_update_replaces_only_its_service(planner):
+    planner.update("L", make_feed(1000))
+    assert set(planner.services()) == {"G", "L"}
+    journey = planner.earliest_arrival("A", "E", 900)
+    # the change at B uses its own transfer time, so T2 is missed
+    assert _legs(journey) == [
+        ("T1", "A", "B", 1000, 1100),
+        ("T3", "B", "E", 1170, 1500),
+    ]
+    planner.update("L", make_feed(1000, trips=L_TRIPS))
+    assert planner.earliest_arrival("A", "E", 900).arrival_time == 1450
+
+
+def test_unknown_stops_raise(planner):
+    with pytest.raises(KeyError):
+        planner.earliest_arrival("A", "Z", 900)
+
+
+def test_recorded_journeys_are_consistent():
+    planner = JourneyPlanner()
+    stop_info = planner.stop_info
+    stations = set()
+    now = 0
+    for service in ("G", "L", "SI"):
+        _, content = next(iter_recording(recording(service)))
+        feed = decode_feed_message(content)
+        planner.update(service, feed)
+        now = max(now, feed.header.timestamp)
+        for entity in feed.entity:
+            for update in entity.trip_update.stop_time_update:
+                if update.stop_id in stop_info:
+                    stations.add(stop_info.parent_station(update.stop_id))
+
+    stations = sorted(stations)
+    found = 0
+    for origin, destination in itertools.islice(itertools.permutations(stations[::5], 2), 200):
+        journey = planner.earliest_arrival(origin, destination, now)
+        if journey is None:
+            continue
+        found += 1
+        legs = journey.legs
+        assert legs[0].from_stop_id == origin
+        assert legs[-1].to_stop_id == destination
+        assert legs[0].departure_time >= now
+        assert journey.arrival_time == legs[-1].arrival_time
+        for leg in legs:
+            assert leg.departure_time <= leg.arrival_time
+        for prev, leg in zip(legs, legs[1:]):
+            assert prev.to_stop_id == leg.from_stop_id
+            assert prev.trip_id or leg.trip_id
+            if prev.trip_id and leg.trip_id:
+                change_time = planner.graph.change_time[stop_info.code(leg.from_stop_id)]
+                assert leg.departure_time >= prev.arrival_time + change_time
+            else:
+                assert leg.departure_time >= prev.arrival_time
+    assert found > 10
@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+
+from csp_mta import EquipmentOutage, OutageEventType, OutageTracker
+
+
+def _outage(equipment, station="Court Sq", ada=True, days=10, upcoming=False, reason="Repair"):
+    start = datetime(2024, 4, 1)
+    return EquipmentOutage(
+        equipment=equipment,
+        equipment_type="EL",
+        station=station,
+        ada=ada,
+        outage_start=start,
+        estimated_return=start + timedelta(days=days),
+        reason=reason,
+        upcoming=upcoming,
+        maintenance=False,
+    )
+
+
+def _events(events):
+    return [(e.type, e.equipment) for e in events]
+
+
+def _check_summary(tracker, outages):
+    """The tracker's running aggregates agree with the current outages, recomputed from scratch"""
+    summary = tracker.summary()
+    assert summary.num_outages == len(outages)
+    assert summary.num_ada_outages == sum(o.ada for o in outages)
+    by_station = {}
+    for outage in outages:
+        by_station[outage.station] = by_station.get(outage.station, 0) + 1
+    assert summary.outages_by_station == by_station
+    if outages:
+        downtimes = [o.estimated_return - o.outage_start for o in outages]
+        assert summary.mean_downtime == sum(downtimes, timedelta()) / len(downtimes)
+    else:
+        assert not hasattr(summary, "mean_downtime")
+
+
+def test_diffs_successive_polls():
+    tracker = OutageTracker()
+    a, b, c = _outage("EL1"), _outage("EL2", station="Jay St", ada=False), _outage("EL3", days=4)
+
+    assert _events(tracker.update([a, b])) == [
+        (OutageEventType.OPENED, "EL1"),
+        (OutageEventType.OPENED, "EL2"),
+    ]
+    _check_summary(tracker, [a, b])
+
+    # unchanged polls produce no events
+    assert tracker.update([_outage("EL1"), _outage("EL2", station="Jay St", ada=False)]) == []
+
+    a2 = _outage("EL1", days=20, reason="Capital work")
+    events = tracker.update([a2, c])
+    assert _events(events) == [
+        (OutageEventType.UPDATED, "EL1"),
+        (OutageEventType.OPENED, "EL3"),
+        (OutageEventType.RESOLVED, "EL2"),
+    ]
+    assert events[0].outage == a2
+    # resolved outages carry the outage as it was last seen
+    assert events[2].outage == b
+    assert "EL2" not in tracker and len(tracker) == 2
+    _check_summary(tracker, [a2, c])
+
+    assert _events(tracker.update([])) == [
+        (OutageEventType.RESOLVED, "EL1"),
+        (OutageEventType.RESOLVED, "EL3"),
+    ]
+    _check_summary(tracker, [])
+
+
+def test_upcoming_outages_are_not_tracked():
+    tracker = OutageTracker()
+    assert tracker.update([_outage("EL1", upcoming=True)]) == []
+    assert len(tracker) == 0
+    # until they start
+    assert _events(tracker.update([_outage("EL1")])) == [(OutageEventType.OPENED, "EL1")]
+
+
+def test_equipment_listed_twice_is_counted_once():
+    tracker = OutageTracker()
+    a = _outage("EL1")
+    assert _events(tracker.update([a, _outage("EL1", days=3)])) == [(OutageEventType.OPENED, "EL1")]
+    _check_summary(tracker, [a])
+    assert tracker.update([a, a]) == []
+    assert _events(tracker.update([])) == [(OutageEventType.RESOLVED, "EL1")]
+    _check_summary(tracker, [])
+
+
+def test_outages_without_both_times_have_no_downtime():
+    tracker = OutageTracker()
+    a = _outage("EL1", days=2)
+    b = EquipmentOutage(equipment="EL2", station="Jay St", ada=False, upcoming=False)
+    tracker.update([a, b])
+    summary = tracker.summary()
+    assert summary.num_outages == 2
+    assert summary.mean_downtime == timedelta(days=2)
+    tracker.update([b])
+    assert not hasattr(tracker.summary(), "mean_downtime")
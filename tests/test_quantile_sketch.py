@@ -0,0 +1,111 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from csp_mta import QuantileSketch
+
+QUANTILES = [0.01, 0.1, 0.5, 0.9, 0.99, 0.999]
+
+
+def _rank_error(samples, qs, estimates):
+    """How far, as a fraction of the samples, each estimate's rank is from its quantile"""
+    ordered = np.sort(samples)
+    lo = np.searchsorted(ordered, estimates, side="left") / len(ordered)
+    hi = np.searchsorted(ordered, estimates, side="right") / len(ordered)
+    return np.maximum(np.maximum(lo - qs, qs - hi), 0.0)
+
+
+@pytest.mark.parametrize(
+    "samples",
+    [
+        np.random.default_rng(0).exponential(300.0, 200_000),
+        np.random.default_rng(1).normal(600.0, 60.0, 200_000),
+        np.random.default_rng(2).integers(0, 1800, 200_000).astype(np.float64),
+    ],
+    ids=["exponential", "normal", "integers"],
+)
+def test_quantiles_are_accurate(samples):
+    sketch = QuantileSketch()
+    sketch.update(samples)
+    qs = np.array(QUANTILES)
+    errors = _rank_error(samples, qs, sketch.quantiles(qs))
+    # t-digest is most accurate in the tails
+    assert errors.max() < 0.005
+    assert errors[[0, -1]].max() < 0.001
+    assert sketch.count == len(samples)
+    assert sketch.min == samples.min()
+    assert sketch.max == samples.max()
+    assert sketch.quantile(0.0) == samples.min()
+    assert sketch.quantile(1.0) == samples.max()
+
+
+def test_centroids_are_bounded():
+    sketch = QuantileSketch(compression=100)
+    for chunk in np.array_split(np.random.default_rng(3).exponential(300.0, 500_000), 1000):
+        sketch.update(chunk)
+    assert len(sketch.to_bytes()) < 64 * 100 * 16
+
+
+def test_add_and_update_agree():
+    samples = np.random.default_rng(4).exponential(300.0, 50_000)
+    added = QuantileSketch()
+    for value in samples.tolist():
+        added.add(value)
+    updated = QuantileSketch()
+    updated.update(samples)
+    qs = np.array(QUANTILES)
+    assert _rank_error(samples, qs, added.quantiles(qs)).max() < 0.005
+    assert _rank_error(samples, qs, updated.quantiles(qs)).max() < 0.005
+    assert added.count == updated.count == len(samples)
+
+
+def test_merge_summarizes_the_union():
+    rng = np.random.default_rng(5)
+    parts = [rng.exponential(scale, 40_000) for scale in (60.0, 300.0, 900.0)]
+    samples = np.concatenate(parts)
+    sketches = []
+    for part in parts:
+        sketch = QuantileSketch()
+        sketch.update(part)
+        sketches.append(sketch)
+
+    qs = np.array(QUANTILES)
+    # in any order
+    for order in ([0, 1, 2], [2, 0, 1]):
+        merged = QuantileSketch()
+        for i in order:
+            merged.merge(sketches[i])
+        assert merged.count == len(samples)
+        assert merged.min == samples.min()
+        assert merged.max == samples.max()
+        errors = _rank_error(samples, qs, merged.quantiles(qs))
+        # merged centroids are coarser in the middle of the distribution, but not in the tails
+        assert errors.max() < 0.01
+        assert errors[[0, -1]].max() < 0.001
+
+
+def test_merge_with_empty_sketches():
+    sketch = QuantileSketch()
+    sketch.update([1.0, 2.0, 3.0])
+    sketch.merge(QuantileSketch())
+    assert sketch.count == 3
+    empty = QuantileSketch().merge(sketch)
+    assert empty.count == 3
+    assert empty.quantile(0.5) == pytest.approx(2.0)
+
+
+def test_empty_sketch_has_no_quantiles():
+    assert np.isnan(QuantileSketch().quantiles([0.5, 0.9])).all()
+
+
+def test_serialization_round_trips():
+    sketch = QuantileSketch(compression=50)
+    sketch.update(np.random.default_rng(6).exponential(300.0, 10_000))
+    sketch.add(5000.0)
+    for copy in (QuantileSketch.from_bytes(sketch.to_bytes()), pickle.loads(pickle.dumps(sketch))):
+        assert copy.compression == 50
+        assert copy.count == sketch.count
+        assert (copy.min, copy.max) == (sketch.min, sketch.max)
+        np.testing.assert_array_equal(copy.quantiles(QUANTILES), sketch.quantiles(QUANTILES))
+        assert copy.to_bytes() == sketch.to_bytes()